@@ -0,0 +1,301 @@
+import asyncio
+import glob
+import gzip
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+from datetime import datetime
+
+from persistence import atomic_write_text
+
+BACKUP_DIR = 'backup'
+BACKUP_FILES = ('settings.json', 'admins.json', 'broadcast_config.json')
+SQLITE_HEADER = b'SQLite format 3\x00'
+
+
+def _object_path(backup_dir: str, digest: str) -> str:
+    return os.path.join(backup_dir, 'objects', digest[:2], f"{digest}.gz")
+
+
+def is_sqlite(path: str) -> bool:
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(SQLITE_HEADER)) == SQLITE_HEADER
+    except OSError:
+        return False
+
+
+def _read_manifest(path: str) -> dict:
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def list_snapshots(backup_dir: str = BACKUP_DIR) -> list[dict]:
+    """所有快照 (由新到舊)，每個快照為 {'id', 'created', 'files': {檔名: hash}, 'changed': [...]}。"""
+    snapshots = []
+    for path in glob.glob(os.path.join(glob.escape(backup_dir), 'snapshots', '*.json')):
+        try:
+            snapshots.append(_read_manifest(path))
+        except (OSError, json.JSONDecodeError):
+            logging.warning(f"⚠️ 略過無法讀取的備份快照: {path}")
+    # 同一秒內的快照 ID 帶有 -2、-3 後綴，依數字排序
+    return sorted(snapshots, key=lambda s: (s['id'][:15], int(s['id'][16:] or 1)), reverse=True)
+
+
+def read_object(backup_dir: str, digest: str) -> bytes:
+    with gzip.open(_object_path(backup_dir, digest), 'rb') as f:
+        data = f.read()
+    if hashlib.sha256(data).hexdigest() != digest:
+        raise ValueError(f"備份內容 {digest[:12]} 校驗失敗")
+    return data
+
+
+def backup_versions(path: str, backup_dir: str = BACKUP_DIR):
+    """
+    依新到舊產生 path 的備份內容 (bytes)：先是快照中的版本 (相同內容只出現一次)，
+    再來是舊版 backup/<檔名>.<時間>.bak 複本。供設定檔損毀時自動還原使用。
+    """
+    name = os.path.basename(path)
+    seen = set()
+    for snapshot in list_snapshots(backup_dir):
+        digest = snapshot['files'].get(name)
+        if not digest or digest in seen:
+            continue
+        seen.add(digest)
+        try:
+            yield read_object(backup_dir, digest)
+        except (OSError, ValueError) as e:
+            logging.warning(f"⚠️ 略過損毀的備份 {name}@{snapshot['id']}: {e}")
+    for legacy in sorted(glob.glob(os.path.join(glob.escape(backup_dir), f"{glob.escape(name)}.*.bak")), reverse=True):
+        try:
+            with open(legacy, 'rb') as f:
+                yield f.read()
+        except OSError:
+            continue
+
+
+class BackupManager:
+    """
+    設定檔與 SQLite 資料庫的增量備份：以內容 hash 去重，每份內容只以 gzip 壓縮保存一次 (backup/objects/)，
+    每次快照只是一份「檔名 → hash」清單 (backup/snapshots/<時間>.json)，沒有任何檔案變更時不建立快照。
+    快照時持有 JsonWriter 的鎖，確保讀到的是完整寫入後的一致內容；資料庫以 SQLite 線上備份 API 複製到暫存檔，
+    不會讀到寫入到一半的頁面。依保留策略刪除舊快照與不再使用的內容。
+    """
+    def __init__(self, config, backup_dir: str = None, files=None):
+        self.writer = config.writer
+        self.backup_dir = backup_dir or config.backup_dir
+        self.files = tuple(files or config.backup_files)
+        self.interval = config.backup_interval
+        self.keep_recent = config.backup_keep_recent
+        self.keep_days = config.backup_keep_days
+        self._stat_cache = {}  # 檔名 -> (mtime_ns, size, hash)，檔案未變動時不必重新讀取計算 hash
+        self._task = None
+
+    # --- 建立快照 ---
+
+    @staticmethod
+    def _signature(name: str):
+        """判斷檔案是否變動用的 (mtime, 大小)；WAL 模式的資料庫寫入會先進入 -wal 檔，一併列入。"""
+        stat = os.stat(name)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        try:
+            wal = os.stat(f"{name}-wal")
+            signature += (wal.st_mtime_ns, wal.st_size)
+        except FileNotFoundError:
+            pass
+        return signature
+
+    def _read_database(self, name: str) -> bytes:
+        """以 SQLite 線上備份 API 將資料庫 (含 WAL 中已提交的交易) 複製到暫存檔後讀出，取得一致的內容。"""
+        os.makedirs(self.backup_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix='.db.tmp', dir=self.backup_dir)
+        os.close(fd)
+        try:
+            source = sqlite3.connect(name)
+            target = sqlite3.connect(tmp_path)
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+                source.close()
+            with open(tmp_path, 'rb') as f:
+                return f.read()
+        finally:
+            os.remove(tmp_path)
+
+    def _read(self, name: str) -> bytes:
+        if is_sqlite(name):
+            return self._read_database(name)
+        with open(name, 'rb') as f:
+            return f.read()
+
+    def _hash_files(self) -> dict:
+        """讀取目前的設定檔與資料庫，回傳 {檔名: (hash, 內容或 None)}；內容為 None 表示與上次相同，不需重新讀取。"""
+        result = {}
+        for name in self.files:
+            try:
+                signature = self._signature(name)
+            except FileNotFoundError:
+                continue
+            cached = self._stat_cache.get(name)
+            if cached and cached[0] == signature:
+                result[name] = (cached[1], None)
+                continue
+            data = self._read(name)
+            digest = hashlib.sha256(data).hexdigest()
+            self._stat_cache[name] = (signature, digest)
+            result[name] = (digest, data)
+        return result
+
+    def _store(self, hashed: dict, previous: dict) -> dict:
+        """寫入尚未保存過的內容並建立快照清單；沒有變更時回傳 None。"""
+        files = {name: digest for name, (digest, _) in hashed.items()}
+        if previous is not None and files == previous.get('files'):
+            return None
+        for name, (digest, data) in hashed.items():
+            path = _object_path(self.backup_dir, digest)
+            if os.path.exists(path):
+                continue
+            if data is None:
+                data = self._read(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with gzip.open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+
+        now = datetime.now()
+        base_id = now.strftime('%Y%m%d-%H%M%S')
+        snapshots_dir = os.path.join(self.backup_dir, 'snapshots')
+        os.makedirs(snapshots_dir, exist_ok=True)
+        # 同一秒內的快照接續上一個快照的後綴編號，ID 永遠遞增 (不會重用已被清除的 ID)
+        suffix = int(previous['id'][16:] or 1) if previous and previous['id'][:15] == base_id else 0
+        snapshot_id = f"{base_id}-{suffix + 1}" if suffix else base_id
+        while os.path.exists(os.path.join(snapshots_dir, f"{snapshot_id}.json")):
+            suffix = max(suffix, 1) + 1
+            snapshot_id = f"{base_id}-{suffix}"
+        previous_files = previous.get('files', {}) if previous else {}
+        snapshot = {
+            'id': snapshot_id,
+            'created': now.isoformat(timespec='seconds'),
+            'files': files,
+            'changed': sorted(name for name, digest in files.items() if previous_files.get(name) != digest),
+        }
+        atomic_write_text(os.path.join(snapshots_dir, f"{snapshot_id}.json"), json.dumps(snapshot, ensure_ascii=False, indent=2))
+        return snapshot
+
+    async def snapshot(self) -> dict:
+        """建立一次快照 (只保存有變更的檔案)，回傳快照；沒有變更時回傳 None。"""
+        # 先寫入合併中的設定變更，再在寫入鎖內讀取，避免讀到寫入前的舊內容
+        await self.writer.flush()
+        async with self.writer.lock:
+            hashed = await asyncio.to_thread(self._hash_files)
+            snapshots = await asyncio.to_thread(list_snapshots, self.backup_dir)
+            snapshot = await asyncio.to_thread(self._store, hashed, snapshots[0] if snapshots else None)
+        if snapshot:
+            removed = await asyncio.to_thread(self.prune)
+            logging.info(f"💾 已建立備份快照 {snapshot['id']}: {', '.join(snapshot['changed'])}"
+                         + (f" (清除 {removed} 個舊快照)" if removed else ""))
+        return snapshot
+
+    # --- 保留策略 ---
+
+    def prune(self) -> int:
+        """保留最近 keep_recent 個快照，以及最近 keep_days 天每天的最後一個快照；刪除其餘快照與不再被引用的內容。"""
+        snapshots = list_snapshots(self.backup_dir)
+        keep = {s['id'] for s in snapshots[:self.keep_recent]}
+        days = []
+        for s in snapshots:
+            day = s['created'][:10]
+            if day not in days:
+                days.append(day)
+                if len(days) > self.keep_days:
+                    break
+                keep.add(s['id'])
+        removed = 0
+        for s in snapshots:
+            if s['id'] not in keep:
+                os.remove(os.path.join(self.backup_dir, 'snapshots', f"{s['id']}.json"))
+                removed += 1
+        if removed:
+            referenced = {digest for s in snapshots if s['id'] in keep for digest in s['files'].values()}
+            for path in glob.glob(os.path.join(glob.escape(self.backup_dir), 'objects', '*', '*.gz')):
+                if os.path.basename(path)[:-3] not in referenced:
+                    os.remove(path)
+        return removed
+
+    # --- 還原 ---
+
+    def find_all(self) -> list[dict]:
+        return list_snapshots(self.backup_dir)
+
+    def find(self, snapshot_id: str = None) -> dict:
+        """依 ID (可只輸入開頭) 尋找快照；未指定時回傳最新的快照。"""
+        snapshots = list_snapshots(self.backup_dir)
+        if not snapshot_id:
+            return snapshots[0] if snapshots else None
+        exact = [s for s in snapshots if s['id'] == snapshot_id]
+        matches = exact or [s for s in snapshots if s['id'].startswith(snapshot_id)]
+        return matches[0] if len(matches) == 1 else None
+
+    def _restore_database(self, name: str, data: bytes):
+        """
+        以 SQLite 備份 API 將快照內容寫回資料庫，而不是直接覆寫檔案：
+        其他仍開啟中的連線 (歷史記錄、工作佇列) 會讀到還原後的內容，也不會與 -wal 檔不一致。
+        """
+        os.makedirs(self.backup_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix='.db.tmp', dir=self.backup_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            source = sqlite3.connect(tmp_path)
+            target = sqlite3.connect(name)
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+                source.close()
+        finally:
+            os.remove(tmp_path)
+
+    async def restore(self, snapshot: dict, files=None) -> list[str]:
+        """
+        將快照中的檔案寫回 (可只還原指定檔案)。還原前先建立目前狀態的快照，必要時可以再還原回來。
+        回傳已還原的檔名；呼叫端需重新載入設定。
+        """
+        names = [n for n in (snapshot['files'] if files is None else files) if n in snapshot['files']]
+        contents = {n: await asyncio.to_thread(read_object, self.backup_dir, snapshot['files'][n]) for n in names}
+        await self.snapshot()
+        async with self.writer.lock:
+            for name, data in contents.items():
+                if data.startswith(SQLITE_HEADER):
+                    await asyncio.to_thread(self._restore_database, name, data)
+                else:
+                    await asyncio.to_thread(atomic_write_text, name, data.decode('utf-8'))
+                self._stat_cache.pop(name, None)
+        logging.warning(f"♻️ 已從備份快照 {snapshot['id']} 還原: {', '.join(names)}")
+        # 還原後的內容成為最新的快照，之後設定檔損毀時會自動還原到此狀態
+        await self.snapshot()
+        return names
+
+    # --- 背景執行 ---
+
+    def start_background_backup(self):
+        """在事件循環中啟動定期快照的背景任務 (啟動時的第一次快照由呼叫端在背景執行)。"""
+        async def runner():
+            while True:
+                await asyncio.sleep(self.interval)
+                try:
+                    await self.snapshot()
+                except Exception as e:
+                    logging.error(f"❌ 定時備份失敗: {e}")
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(runner())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
@@ -0,0 +1,139 @@
+import asyncio
+import os
+import random
+import time
+from types import SimpleNamespace
+
+from telethon import errors, types
+
+
+class FakeTelegramClient:
+    """
+    模擬 Telethon TelegramClient 的本地假客戶端，不需要真實帳號即可測量廣播效能。
+    可設定每次呼叫的延遲、上傳頻寬，以及 flood-wait 與永久性錯誤的注入比例。
+    所有發送與上傳都會記錄下來，供基準測試計算吞吐量、延遲分佈與上傳量。
+    """
+    def __init__(self, latency: float = 0.05, jitter: float = 0.02, upload_bandwidth: float = 20 * 1024 * 1024,
+                 flood_rate: float = 0.0, flood_seconds: int = 1, permanent_error_rate: float = 0.0,
+                 seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.upload_bandwidth = upload_bandwidth
+        self.flood_rate = flood_rate
+        self.flood_seconds = flood_seconds
+        self.permanent_error_rate = permanent_error_rate
+        self.random = random.Random(seed)
+
+        self.send_latencies = []
+        self.uploaded_bytes = 0
+        self.upload_seconds = 0.0
+        self.sent = 0
+        self.flood_waits = 0
+        self.permanent_errors = 0
+        self.handlers = []
+        # 永久性錯誤以目標決定，重試同一目標時結果一致
+        self._forbidden = {}
+        self._next_message_id = 1
+
+    # --- 內部工具 ---
+
+    async def _rpc_delay(self):
+        await asyncio.sleep(max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter)))
+
+    def _peer_id(self, peer):
+        for attr in ('channel_id', 'chat_id', 'user_id'):
+            if hasattr(peer, attr):
+                return getattr(peer, attr)
+        return peer
+
+    def _maybe_fail(self, peer):
+        peer_id = self._peer_id(peer)
+        if peer_id not in self._forbidden:
+            self._forbidden[peer_id] = self.random.random() < self.permanent_error_rate
+        if self._forbidden[peer_id]:
+            self.permanent_errors += 1
+            raise errors.ChatWriteForbiddenError(request=None)
+        if self.flood_rate and self.random.random() < self.flood_rate:
+            self.flood_waits += 1
+            raise errors.FloodWaitError(request=None, capture=self.flood_seconds)
+
+    async def _simulate_upload(self, path: str) -> int:
+        size = os.path.getsize(path)
+        start = time.monotonic()
+        await asyncio.sleep(size / self.upload_bandwidth if self.upload_bandwidth else 0)
+        self.uploaded_bytes += size
+        self.upload_seconds += time.monotonic() - start
+        return size
+
+    def _message(self, peer, media=None):
+        self._next_message_id += 1
+        return SimpleNamespace(id=self._next_message_id, peer_id=peer, media=media)
+
+    # --- Telethon API 子集 ---
+
+    async def upload_file(self, path, **kwargs):
+        size = await self._simulate_upload(path)
+        return types.InputFile(id=self.random.getrandbits(63), parts=max(1, size // (512 * 1024)),
+                               name=os.path.basename(path), md5_checksum='')
+
+    async def send_file(self, peer, file, caption=None, **kwargs):
+        start = time.monotonic()
+        if isinstance(file, (list, tuple)):
+            media = [await self._resolve_media(f) for f in file]
+        else:
+            media = await self._resolve_media(file)
+        await self._rpc_delay()
+        self._maybe_fail(peer)
+        self.send_latencies.append(time.monotonic() - start)
+        self.sent += 1
+        if isinstance(media, list):
+            return [self._message(peer, m) for m in media]
+        return self._message(peer, media)
+
+    async def _resolve_media(self, file):
+        # 傳入路徑時與 Telethon 相同：每次發送都重新上傳
+        if isinstance(file, str):
+            await self._simulate_upload(file)
+            return types.MessageMediaDocument(document=types.DocumentEmpty(id=self.random.getrandbits(63)))
+        if isinstance(file, types.InputFile):
+            return types.MessageMediaDocument(document=types.DocumentEmpty(id=file.id))
+        return file
+
+    async def send_message(self, peer, message, **kwargs):
+        start = time.monotonic()
+        await self._rpc_delay()
+        self._maybe_fail(peer)
+        self.send_latencies.append(time.monotonic() - start)
+        self.sent += 1
+        return self._message(peer)
+
+    async def edit_message(self, entity, message=None, text=None, **kwargs):
+        await self._rpc_delay()
+        return self._message(entity)
+
+    async def get_input_entity(self, peer):
+        return types.InputPeerChannel(abs(int(peer)), 1)
+
+    async def get_entity(self, peer):
+        await self._rpc_delay()
+        if isinstance(peer, list):
+            return [self._channel(self._peer_id(p)) for p in peer]
+        return self._channel(self._peer_id(peer))
+
+    def _channel(self, channel_id):
+        return types.Channel(id=abs(int(channel_id)), title=f"Group {channel_id}", photo=types.ChatPhotoEmpty(),
+                             date=None, access_hash=1, megagroup=True)
+
+    async def get_me(self):
+        return SimpleNamespace(id=1, first_name='Bench', last_name=None, username='bench')
+
+    def add_event_handler(self, callback, event=None):
+        self.handlers.append((callback, event))
+
+    async def iter_dialogs(self):
+        for _ in ():
+            yield
+
+    async def iter_participants(self, entity, **kwargs):
+        for _ in ():
+            yield
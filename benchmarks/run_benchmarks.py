@@ -0,0 +1,261 @@
+"""
+離線廣播基準測試：以 FakeTelegramClient 執行 BroadcastManager、Scheduler 與 CommandHandler，
+輸出機器可讀的 JSON 結果，方便每次修改發送流程後比較效能。
+
+用法:
+    python benchmarks/run_benchmarks.py                      # 執行標準情境
+    python benchmarks/run_benchmarks.py --quick              # 只跑小規模情境
+    python benchmarks/run_benchmarks.py --targets 1000 --content video --flood-rate 0.01
+    python benchmarks/run_benchmarks.py --output bench.json  # 將結果寫入檔案
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Config 會讀取 .env；先提供可解析的預設值，避免依賴真實帳號設定
+os.environ['API_ID'] = '1'
+os.environ['API_HASH'] = 'benchmark'
+os.environ['CONTROL_GROUP'] = '0'
+
+from fake_telegram import FakeTelegramClient  # noqa: E402
+from config import Config  # noqa: E402
+from broadcast_manager import BroadcastManager  # noqa: E402
+from command_handler import CommandHandler  # noqa: E402
+from entity_cache import EntityCache  # noqa: E402
+from message_manager import MessageManager  # noqa: E402
+from scheduler import Scheduler  # noqa: E402
+
+MEDIA_SIZES = {'photo': 2 * 1024 * 1024, 'video': 40 * 1024 * 1024}
+# 相簿情境：一個活動資料夾中的多張圖片
+ALBUM_SIZE = 5
+CONTENT_TYPES = ('text', 'photo', 'video', 'album')
+STANDARD_SCENARIOS = [
+    {'targets': targets, 'content': content}
+    for targets in (10, 1000, 10000)
+    for content in CONTENT_TYPES
+]
+QUICK_SCENARIOS = [{'targets': 10, 'content': content} for content in CONTENT_TYPES]
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def make_campaign(workdir: str, content_type: str) -> dict:
+    """在暫存目錄建立活動內容 (媒體檔以指定大小的檔案模擬)。"""
+    content = {"text": "Benchmark message", "photo": None, "video": None, "gif": None, "media": []}
+    if content_type in MEDIA_SIZES:
+        names = [f"bench.{'jpg' if content_type == 'photo' else 'mp4'}"]
+        kind = content_type
+    elif content_type == 'album':
+        names = [f"album_{i}.jpg" for i in range(1, ALBUM_SIZE + 1)]
+        kind = 'photo'
+    else:
+        return content
+    for name in names:
+        path = os.path.join(workdir, name)
+        if not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.truncate(MEDIA_SIZES[kind])
+        content["media"].append(path)
+    content[kind] = content["media"][0]
+    return content
+
+
+def make_config(targets: int, args) -> Config:
+    with contextlib.redirect_stdout(io.StringIO()):
+        config = Config()
+    config.target_groups = [{'id': 1000000 + i, 'title': f'Group {i}', 'type': 'group'} for i in range(targets)]
+    config.broadcast_concurrency = args.concurrency
+    config.broadcast_rate = args.rate
+    config.per_peer_rate = 0
+    config.max_retries = args.max_retries
+    return config
+
+
+async def bench_broadcast(scenario: dict, args, workdir: str) -> dict:
+    client = FakeTelegramClient(latency=args.latency, jitter=args.jitter, upload_bandwidth=args.bandwidth * 1024 * 1024,
+                                flood_rate=args.flood_rate, flood_seconds=args.flood_seconds,
+                                permanent_error_rate=args.permanent_rate)
+    config = make_config(scenario['targets'], args)
+    entity_cache = EntityCache(client, path=os.path.join(workdir, 'entity_cache.json'))
+    manager = BroadcastManager(client, config, MessageManager(), entity_cache)
+    content = make_campaign(workdir, scenario['content'])
+
+    stats = {}
+    start = time.monotonic()
+    with contextlib.redirect_stdout(io.StringIO()):
+        success, total = await manager.send_campaign_broadcast(content, f"bench_{scenario['content']}", stats=stats)
+    wall = time.monotonic() - start
+    latencies = client.send_latencies
+    return {
+        'benchmark': 'broadcast',
+        **scenario,
+        'success': success,
+        'total': total,
+        'wall_seconds': round(wall, 3),
+        'sends_per_second': round(client.sent / wall, 2) if wall else None,
+        'latency_p50_ms': round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+        'latency_p95_ms': round(percentile(latencies, 95) * 1000, 2) if latencies else None,
+        'latency_p99_ms': round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+        'bytes_uploaded': client.uploaded_bytes,
+        'upload_seconds': round(client.upload_seconds, 3),
+        'flood_waits': client.flood_waits,
+        'permanent_errors': client.permanent_errors,
+    }
+
+
+async def bench_scheduler(args, workdir: str) -> dict:
+    """測量排程觸發到第一個目標發送成功的延遲。"""
+    client = FakeTelegramClient(latency=args.latency, jitter=0)
+    config = make_config(10, args)
+    config.enabled = True
+    config.schedules = [{'time': '00:00', 'campaign': 'bench'}]
+    os.makedirs(os.path.join(MessageManager.CONTENT_DB_PATH, 'bench'), exist_ok=True)
+    with open(os.path.join(MessageManager.CONTENT_DB_PATH, 'bench', 'message.txt'), 'w', encoding='utf-8') as f:
+        f.write('Benchmark message')
+    manager = BroadcastManager(client, config, MessageManager())
+    scheduler = Scheduler(config, manager, asyncio.get_running_loop(), MessageManager())
+    with contextlib.redirect_stdout(io.StringIO()):
+        scheduler.setup_schedule()
+        # 將排程改為 0.1 秒後到期，以測量真實的觸發延遲
+        fire_ts, seq, fire_at, task = scheduler._heap[0]
+        due = datetime.fromtimestamp(time.time() + 0.1, scheduler.tz)
+        scheduler._heap[0] = (due.timestamp(), seq, due, task)
+        scheduler.start_background_runner()
+        while not scheduler.recent_runs or scheduler.recent_runs[-1]['duration'] is None:
+            await asyncio.sleep(0.01)
+    run = scheduler.recent_runs[-1]
+    scheduler._runner.cancel()
+    return {
+        'benchmark': 'scheduler',
+        'fire_delay_ms': round(run['fire_delay'] * 1000, 2),
+        'first_send_latency_ms': round(run['first_send_latency'] * 1000, 2),
+        'duration_seconds': run['duration'],
+    }
+
+
+class _BenchEvent:
+    def __init__(self, text, sender_id):
+        self.raw_text = text
+        self.sender_id = sender_id
+        self.pattern_match = None
+
+    async def reply(self, message, **kwargs):
+        pass
+
+
+async def bench_commands(args) -> dict:
+    """測量每則訊息經過指令路由的 CPU 成本 (一般訊息與指令訊息)。"""
+    client = FakeTelegramClient(latency=0, jitter=0)
+    config = make_config(10, args)
+    config.admins = [{'id': 1, 'name': 'bench', 'username': ''}]
+    config.save_admins()
+    handler = CommandHandler(None, client, config, None, None, MessageManager(), None)
+    with contextlib.redirect_stdout(io.StringIO()):
+        handler.register_handlers()
+
+    async def noop(event):
+        pass
+    handler.routes['status'] = (noop, handler.routes['status'][1], True)
+
+    count = args.messages
+    chatter = [f"hello world {i}" for i in range(count)]
+    start = time.perf_counter()
+    for text in chatter:
+        handler.COMMAND_RE.match(text)
+    chatter_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(count):
+            event = _BenchEvent('/status', 1)
+            event.pattern_match = handler.COMMAND_RE.match(event.raw_text)
+            await handler._dispatch(event)
+    command_seconds = time.perf_counter() - start
+    return {
+        'benchmark': 'commands',
+        'messages': count,
+        'non_command_us_per_message': round(chatter_seconds / count * 1e6, 3),
+        'command_us_per_message': round(command_seconds / count * 1e6, 3),
+    }
+
+
+async def main(args):
+    logging.disable(logging.CRITICAL)
+    if args.targets:
+        scenarios = [{'targets': args.targets, 'content': args.content}]
+    else:
+        scenarios = QUICK_SCENARIOS if args.quick else STANDARD_SCENARIOS
+
+    results = []
+    origin = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='userbot_bench_') as workdir:
+        # 在暫存目錄執行，避免寫入專案中的 settings.json / userbot.db 等檔案
+        os.chdir(workdir)
+        try:
+            for scenario in scenarios:
+                result = await bench_broadcast(scenario, args, workdir)
+                print(f"📈 {result['targets']:>6} 個目標 / {result['content']:<5}: "
+                      f"{result['sends_per_second']} sends/s, p95 {result['latency_p95_ms']}ms, "
+                      f"上傳 {result['bytes_uploaded'] / 1024 / 1024:.1f} MB, {result['wall_seconds']}s",
+                      file=sys.stderr)
+                results.append(result)
+            results.append(await bench_scheduler(args, workdir))
+            results.append(await bench_commands(args))
+        finally:
+            os.chdir(origin)
+
+    report = {
+        'generated_at': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'parameters': {k: v for k, v in vars(args).items() if k != 'output'},
+        'results': results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+        print(f"✅ 結果已寫入 {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="離線廣播基準測試 (模擬 Telegram 客戶端)")
+    parser.add_argument('--quick', action='store_true', help="只執行 10 個目標的情境")
+    parser.add_argument('--targets', type=int, help="只執行指定目標數的單一情境")
+    parser.add_argument('--content', choices=list(CONTENT_TYPES), default='text')
+    parser.add_argument('--concurrency', type=int, default=20, help="同時發送數量")
+    parser.add_argument('--rate', type=float, default=0, help="全域發送速率 (每秒，0 = 不限速)")
+    parser.add_argument('--max-retries', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.05, help="每次 API 呼叫的延遲 (秒)")
+    parser.add_argument('--jitter', type=float, default=0.02, help="延遲的隨機浮動 (秒)")
+    parser.add_argument('--bandwidth', type=float, default=20, help="上傳頻寬 (MB/s)")
+    parser.add_argument('--flood-rate', type=float, default=0.0, help="每次發送觸發 flood-wait 的機率")
+    parser.add_argument('--flood-seconds', type=int, default=1, help="flood-wait 要求的等待秒數")
+    parser.add_argument('--permanent-rate', type=float, default=0.0, help="目標為永久性錯誤 (無發言權) 的比例")
+    parser.add_argument('--messages', type=int, default=20000, help="指令路由測試的訊息數量")
+    parser.add_argument('--output', help="將 JSON 結果寫入檔案")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
@@ -1,138 +1,731 @@
 import asyncio
-import json
+from collections import Counter
 from datetime import datetime
+import io
 import logging
 import os # Import os module
+import time
+
+from dispatcher import BroadcastDispatcher, PRIORITY_NORMAL
+from history_store import HistoryStore
+from job_queue import JobQueue, JobCheckpoint
+from media_uploader import MediaUploader
+from metrics import BROADCASTS, FLOOD_WAIT_SECONDS, SEND_ATTEMPTS, SEND_LATENCY, SENDS_IN_FLIGHT
+from progress_reporter import ProgressReporter, format_duration
+from rate_limiter import RateLimiter
+from send_errors import classify_error, is_unresolved, ACCOUNT, FLOOD_WAIT, SLOW_MODE, PERMANENT
+from send_queue import SendQueue, SendTask
+from simulator import TimingModel, simulate
+from telegram_client import SessionPool
+
+# 目標已放回佇列等待重試 (尚無最終結果)
+_REQUEUED = object()
+
+
+class _AccountSender:
+    """單一帳號在一次廣播中的發送狀態：專屬的令牌桶與媒體上傳 (每個帳號各自上傳一次)。"""
+    def __init__(self, session, config, media_paths: list = (), media_info: dict = None, limiter: RateLimiter = None):
+        self.session = session
+        self.limiter = limiter or RateLimiter(config.broadcast_rate, config.broadcast_burst, config.per_peer_rate)
+        self.uploader = MediaUploader(session.client)
+        self.media_paths = list(media_paths)
+        self.media_info = media_info or {}
+        self.media = None
+        self._media_ready = False
+        self._lock = asyncio.Lock()
+
+    async def get_media(self):
+        """第一次由此帳號發送時才上傳媒體 (相簿的檔案同時上傳)，之後共用同一組 handle。沒有媒體時回傳 None。"""
+        if self.media_paths and not self._media_ready:
+            async with self._lock:
+                if not self._media_ready:
+                    self.media = list(await asyncio.gather(*(self.uploader.prepare(p, self.media_info.get(p)) for p in self.media_paths)))
+                    self._media_ready = True
+        return self.media
 
 class BroadcastManager:
     """
     處理廣播發送的核心邏輯以及歷史記錄的保存。
     """
-    def __init__(self, client, config, message_manager):
+    # 協調者模式下輪詢工作進度的間隔 (秒)，以及 worker 心跳多久未更新視為離線
+    JOB_POLL_INTERVAL = 1.0
+    WORKER_STALE_AFTER = 60
+    # 本行程直接發送時，在工作佇列中認領目標所用的名稱
+    LOCAL_WORKER = 'local'
+    OUTCOME_LABELS = {True: 'sent', False: 'failed', None: 'skipped'}
+    # Telegram 訊息與媒體說明的長度上限 (以 UTF-16 計算)；完整報告超過時改為附加文字檔
+    TEXT_LIMIT = 4096
+    CAPTION_LIMIT = 1024
+
+    def __init__(self, client, config, message_manager, entity_cache=None, history_store=None, pool=None,
+                 job_queue=None, dispatcher=None):
         self.client = client
         self.config = config
         self.message_manager = message_manager
+        self.entity_cache = entity_cache
+        self.history_store = history_store or HistoryStore(config.database_path)
+        # 多帳號連線池；未提供時以單一客戶端運作
+        self.pool = pool or SessionPool.from_client(client, entity_cache)
+        # 每次廣播都是一個持久化的工作，記錄每個目標的狀態，行程重啟後可以繼續
+        self.job_queue = job_queue or JobQueue(config.job_queue_path)
+        # 協調者模式：廣播交給 worker 行程發送，本行程只負責排入工作與彙整報告
+        self.use_workers = config.broadcast_mode == 'coordinator'
+        # 每個帳號的令牌桶由所有廣播共用，同時進行的廣播不會讓單一帳號的發送速率加倍
+        self.limiters = {}
+        # 所有廣播共用的分派器：依優先度與截止時間分配發送名額，同優先度的工作輪流發送
+        self.dispatcher = dispatcher or BroadcastDispatcher(
+            capacity=lambda: config.broadcast_concurrency * max(1, len(self.pool.active_sessions())),
+            fallback_rate=lambda: config.broadcast_rate * max(1, len(self.pool.active_sessions())),
+        )
 
-    async def send_campaign_broadcast(self, content: dict, campaign_name: str):
+    async def send_campaign_broadcast(self, content: dict, campaign_name: str, stats: dict = None,
+                                      target: str = None, priority: int = PRIORITY_NORMAL, deadline: float = None):
         """
         執行廣播任務，根據內容字典發送文字、圖片、影片或GIF。
+        target 為目標選擇器 (例如 `tag:vip`)，未指定時發送到所有目標。
+        priority 與 deadline (epoch 秒) 決定與其他同時進行的廣播之間的發送順序。
+        若提供 stats 字典，第一個目標發送成功時會寫入 stats['first_send_at'] (epoch 秒)。
         """
-        message_text = content.get("text", "")
-        photo_path = content.get("photo")
-        video_path = content.get("video")
-        gif_path = content.get("gif")
-
-        # Determine the primary file for logging and history
-        primary_content_type = "text_only"
-        if photo_path: primary_content_type = "photo"
-        elif video_path: primary_content_type = "video"
-        elif gif_path: primary_content_type = "gif"
-
-        if primary_content_type == "text_only" and not message_text:
+        targets, _ = self.plan_broadcast(content, target)
+        if targets is None:
             error_msg = f"❌ 廣播中止，因為活動 '{campaign_name}' 中沒有可發送的內容 (文字、圖片、影片或GIF)。"
-            print(error_msg)
-            logging.error(error_msg)
+            logging.error(error_msg, extra={'campaign': campaign_name})
             if self.config.control_group:
                 await self.client.send_message(self.config.control_group, f"⚠️ 廣播任務中止\n原因: {error_msg}")
             return 0, 0
+        if not targets:
+            logging.warning(f"⚠️ 活動 '{campaign_name}' 沒有符合 `{target or 'all'}` 的目標，略過廣播。",
+                            extra={'campaign': campaign_name})
+            return 0, 0
+        job_id = await asyncio.to_thread(self.job_queue.enqueue, campaign_name, content, targets, priority, deadline)
+        logging.info(f"📢 開始廣播到 {len(targets)} 個目標{f' ({target})' if target else ''}... "
+                     f"(內容來自活動: {campaign_name}，工作 #{job_id})",
+                     extra={'campaign': campaign_name, 'job_id': job_id})
+        return await self._run_job(job_id, content, campaign_name, stats)
+
+    def plan_broadcast(self, content: dict, target: str = None) -> tuple:
+        """
+        廣播的規劃步驟 (send_campaign_broadcast 與 /simulate 共用)：回傳 (符合選擇器的目標, 媒體檔案)。
+        活動中沒有可發送的內容時目標為 None。
+        """
+        media_paths = self.media_paths(content)
+        if not content.get("text", "") and not media_paths:
+            return None, media_paths
+        return self.config.target_index.select(target), media_paths
 
-        success_count = 0
-        total_count = len(self.config.target_groups)
-        broadcast_start = datetime.now()
+    async def simulate_broadcast(self, content: dict, campaign_name: str, target: str = None,
+                                 overrides: dict = None) -> dict:
+        """
+        模擬一次廣播而不發送：與實際廣播相同的規劃 (目標選擇、帳號分配、媒體大小)，
+        再以歷史發送記錄擬合的時間模型預估耗時、flood-wait 與上傳量。
+        overrides 可暫時改用不同的 rate / burst / concurrency / max_retries / max_flood_wait (不修改設定)。
+        回傳報告字典；沒有可發送的內容時 targets 為 None。
+        """
+        targets, media_paths = self.plan_broadcast(content, target)
+        report = {'campaign': campaign_name, 'target': target, 'targets': targets}
+        if not targets:
+            return report
 
-        print(f"📢 開始廣播到 {total_count} 個目標... (內容來自活動: {campaign_name})")
-        logging.info(f"開始廣播到 {total_count} 個目標... (內容來自活動: {campaign_name})")
+        # 與發送時相同的帳號分配 (rendezvous hashing)，並計算各帳號發送前需要解析的目標
+        accounts = Counter()
+        unresolved = 0
+        for group in targets:
+            session = self.pool.preferred(group['id'])
+            accounts[session.name] += 1
+            if session.entity_cache and session.entity_cache.get(group['id']) is None:
+                unresolved += 1
+        media_info = content.get("media_info") or {}
+        media_bytes = 0
+        for path in media_paths:
+            thumb = (media_info.get(path) or {}).get('thumb')
+            media_bytes += sum(os.path.getsize(p) for p in (path, thumb) if p and os.path.exists(p))
+
+        settings = {
+            'rate': self.config.broadcast_rate,
+            'burst': self.config.broadcast_burst,
+            'concurrency': self.config.broadcast_concurrency,
+            'max_retries': self.config.max_retries,
+            'max_flood_wait': self.config.max_flood_wait,
+            'per_peer_rate': self.config.per_peer_rate,
+        }
+        settings.update(overrides or {})
+        model = await asyncio.to_thread(TimingModel.fit, self.history_store, bool(media_paths))
+        result = await asyncio.to_thread(simulate, dict(accounts), model, media_bytes=media_bytes, **settings)
+        logging.info(f"🔮 模擬廣播 {campaign_name}: {len(targets)} 個目標，預計 {format_duration(result['duration_p50'])}",
+                     extra={'campaign': campaign_name})
+        report.update({
+            'accounts': dict(accounts),
+            'unresolved': unresolved,
+            'media_bytes': media_bytes,
+            'busy_jobs': len(self.dispatcher.jobs),
+            'settings': settings,
+            'model': model,
+            'result': result,
+        })
+        return report
+
+    async def resume_unfinished_jobs(self):
+        """行程重啟後繼續尚未完成的廣播工作：已發送的目標不會重發，只發送剩下的目標。"""
+        jobs = await asyncio.to_thread(self.job_queue.unfinished_jobs)
+
+        async def resume(job):
+            progress = await asyncio.to_thread(self.job_queue.progress, job['id'])
+            logging.info(f"♻️ 繼續未完成的廣播工作 #{job['id']} ({job['campaign']})：剩下 {progress['remaining']}/{job['total']} 個目標",
+                         extra={'campaign': job['campaign'], 'job_id': job['id']})
+            try:
+                content = await asyncio.to_thread(self.job_queue.job_content, job['id'])
+                await self._run_job(job['id'], content, job['campaign'])
+            except Exception as e:
+                logging.exception(f"❌ 繼續廣播工作 #{job['id']} 失敗: {e}",
+                                  extra={'campaign': job['campaign'], 'job_id': job['id']})
 
+        # 所有未完成的工作一起交給分派器，依各自的優先度與截止時間排序發送
+        await asyncio.gather(*(resume(job) for job in jobs))
+
+    async def _run_job(self, job_id: int, content: dict, campaign_name: str, stats: dict = None):
+        """發送 (或等待 worker 發送) 工作中尚未完成的目標，完成後產生報告與歷史記錄。"""
+        stats = stats if stats is not None else {}
+        photo_path = content.get("photo")
+        video_path = content.get("video")
+        gif_path = content.get("gif")
+        media_paths = self.media_paths(content)
+
+        job = await asyncio.to_thread(self.job_queue.job, job_id)
+        total_count = job['total']
+        broadcast_start = datetime.fromtimestamp(job['created_at'])
+        wall_start = time.monotonic()
+
+        progress = await asyncio.to_thread(self.job_queue.progress, job_id)
+        self.dispatcher.register(job_id, campaign_name, total_count, progress['remaining'],
+                                 job.get('priority') or PRIORITY_NORMAL, job.get('deadline'))
+
+        # 控制群組中的進度訊息：開始時發送一次，之後定期編輯
+        reporter = None
+        progress_task = None
+        if self.config.control_group:
+            reporter = ProgressReporter(self.client, self.config.control_group, self.config.progress_interval)
+            if await reporter.start(self._progress_text(campaign_name, job_id, total_count, progress)):
+                progress_task = asyncio.create_task(
+                    self._track_progress(job_id, campaign_name, total_count, reporter, progress, wall_start)
+                )
+        try:
+            if self.use_workers:
+                await self._wait_for_workers(job_id, stats)
+            else:
+                await self._deliver_job(job_id, content, campaign_name, media_paths, total_count, stats)
+        finally:
+            self.dispatcher.unregister(job_id)
+            if progress_task is not None:
+                progress_task.cancel()
+        await asyncio.to_thread(self.job_queue.finish, job_id)
+        tasks, (upload_bytes, upload_seconds, saved_bytes) = await self._job_results(job_id)
+        results = [task.outcome for task in tasks]
+        BROADCASTS.inc()
+
+        # 依照原本目標順序整理結果，讓報告與歷史記錄與逐一發送時一致
         success_groups = []
         failed_groups = []
-        for i, group in enumerate(self.config.target_groups, 1):
-            for attempt in range(self.config.max_retries):
-                try:
-                    if photo_path:
-                        await self.client.send_file(group['id'], photo_path, caption=message_text)
-                    elif video_path:
-                        await self.client.send_file(group['id'], video_path, caption=message_text)
-                    elif gif_path:
-                        await self.client.send_file(group['id'], gif_path, caption=message_text)
-                    elif message_text:
-                        await self.client.send_message(group['id'], message_text)
-                    else:
-                        # This case should ideally be caught earlier, but as a fallback
-                        print(f"⚠️ 無法發送內容到 {group['title']}，因為沒有可用的內容。")
-                        logging.warning(f"無法發送內容到 {group['title']}，因為沒有可用的內容。")
-                        break # Skip to next group if no content
-
-                    success_count += 1
-                    success_groups.append(f"{group['title']} (`{group['id']}`)")
-                    print(f"✅ [{i}/{total_count}] 已發送到: {group['title']}")
-                    logging.info(f"✅ [{i}/{total_count}] 已發送到: {group['title']}")
-                    break
-                except Exception as e:
-                    if attempt == self.config.max_retries - 1:
-                        failed_groups.append(f"{group['title']} (`{group['id']}`)")
-                    print(f"❌ [{i}/{total_count}] 發送失敗: {group['title']} (重試 {attempt + 1}/{self.config.max_retries}): {e}")
-                    logging.error(f"❌ [{i}/{total_count}] 發送失敗: {group['title']} (重試 {attempt + 1}/{self.config.max_retries}): {e}")
-                    if attempt < self.config.max_retries - 1:
-                        await asyncio.sleep(2)
-            if i < total_count:
-                await asyncio.sleep(self.config.broadcast_delay)
+        for task in tasks:
+            if task.outcome is None:
+                continue
+            (success_groups if task.outcome else failed_groups).append(f"{task.group['title']} (`{task.group['id']}`)")
+        success_count = len(success_groups)
+        wall_seconds = time.monotonic() - wall_start
+        upload_mb = upload_bytes / 1024 / 1024
+        saved_mb = saved_bytes / 1024 / 1024
+        accounts = list(dict.fromkeys(t.account for t in tasks if t.account))
+        account_summary = ", ".join(f"{name} {sum(1 for t in tasks if t.outcome and t.account == name)}"
+                                    for name in accounts)
 
         success_rate = f"{(success_count/total_count*100):.1f}%" if total_count > 0 else "0%"
-        print(f"📊 廣播完成: {success_count}/{total_count} ({success_rate})")
-        logging.info(f"廣播完成: {success_count}/{total_count} ({success_rate})")
-        self.save_broadcast_history(broadcast_start, success_count, total_count, campaign_name, success_rate,
-                                    is_photo=bool(photo_path), is_video=bool(video_path), is_gif=bool(gif_path))
+        logging.info(f"📊 廣播完成: {success_count}/{total_count} ({success_rate})",
+                     extra={'campaign': campaign_name, 'job_id': job_id})
+        if media_paths:
+            logging.info(f"⬆️ 上傳: {upload_mb:.2f} MB / {upload_seconds:.1f}s (節省 {saved_mb:.2f} MB)，總耗時 {wall_seconds:.1f}s",
+                         extra={'campaign': campaign_name, 'job_id': job_id})
+        if len(accounts) > 1:
+            logging.info(f"👥 各帳號成功數: {account_summary}", extra={'campaign': campaign_name, 'job_id': job_id})
+        await self.save_broadcast_history(broadcast_start, success_count, total_count, campaign_name, success_rate,
+                                          is_photo=bool(photo_path), is_video=bool(video_path), is_gif=bool(gif_path),
+                                          upload_bytes=upload_bytes, upload_seconds=upload_seconds,
+                                          wall_seconds=wall_seconds, tasks=tasks, results=results)
 
-        # 向控制群組發送廣播報告
+        # 向控制群組發送廣播報告：完整報告放得下時直接發送，否則發送摘要並附上逐一目標的結果檔
         if self.config.control_group:
+            if reporter is not None:
+                progress = await asyncio.to_thread(self.job_queue.progress, job_id)
+                await reporter.update(self._progress_text(campaign_name, job_id, total_count, progress,
+                                                          finished_in=wall_seconds), force=True)
+            failure_summary = ", ".join(f"{kind} {count}" for kind, count in Counter(
+                t.last_error or 'unknown' for t in tasks if t.outcome is False).most_common(5))
             try:
-                report_msg = (
-                    f"📊 **廣播完成報告**\n\n"
-                    f"✅ 成功: {success_count}\n"
-                    f"{chr(10).join(['  - ' + g for g in success_groups]) if success_groups else '  - 無'}\n"
-                    f"❌ 失敗: {total_count - success_count}\n"
-                    f"{chr(10).join(['  - ' + g for g in failed_groups]) if failed_groups else '  - 無'}\n"
+                failed_line = (f"❌ 失敗: {total_count - success_count}"
+                               f"{f' ({failure_summary})' if failure_summary else ''}")
+                totals = (
                     f"📋 總計: {total_count}\n"
                     f"📁 內容活動: {campaign_name}\n"
                     f"📈 成功率: {success_rate}\n"
+                    f"⬆️ 上傳: {upload_mb:.2f} MB / {upload_seconds:.1f}s (節省 {saved_mb:.2f} MB)\n"
+                    f"⏱️ 耗時: {wall_seconds:.1f}s\n"
+                    f"{f'👥 帳號: {account_summary}' + chr(10) if len(accounts) > 1 else ''}"
                     f"🔄 重啟: R{self.config.total_restarts}\n"
                     f"🕒 時間: {broadcast_start.strftime('%Y-%m-%d %H:%M:%S')}"
                 )
-                await self.client.send_message(self.config.control_group, report_msg)
+                full_report = (
+                    f"📊 **廣播完成報告**\n\n"
+                    f"✅ 成功: {success_count}\n"
+                    f"{chr(10).join(['  - ' + g for g in success_groups]) if success_groups else '  - 無'}\n"
+                    f"{failed_line}\n"
+                    f"{chr(10).join(['  - ' + g for g in failed_groups]) if failed_groups else '  - 無'}\n"
+                    f"{totals}"
+                )
+                if self._text_length(full_report) <= self.TEXT_LIMIT:
+                    await self.client.send_message(self.config.control_group, full_report)
+                else:
+                    report_msg = (f"📊 **廣播完成報告** (各群組結果見附件)\n\n"
+                                  f"✅ 成功: {success_count}\n{failed_line}\n{totals}")
+                    details = io.BytesIO(self._report_details(job_id, campaign_name, broadcast_start, tasks).encode('utf-8'))
+                    details.name = f"broadcast_report_{job_id}.txt"
+                    if self._text_length(report_msg) <= self.CAPTION_LIMIT:
+                        await self.client.send_file(self.config.control_group, details, caption=report_msg)
+                    else:
+                        await self.client.send_message(self.config.control_group, report_msg)
+                        await self.client.send_file(self.config.control_group, details)
             except Exception as e:
-                print(f"❌ 發送廣播報告到控制群組失敗: {e}")
+                logging.error(f"❌ 發送廣播報告到控制群組失敗: {e}", extra={'campaign': campaign_name, 'job_id': job_id})
         return success_count, total_count
 
-    def save_broadcast_history(self, start_time: datetime, success_count: int, total_count: int,
-                               file_path: str, success_rate: str, is_photo: bool = False,
-                               is_video: bool = False, is_gif: bool = False):
-        """將本次廣播的結果保存到 broadcast_history.json。"""
+    @staticmethod
+    def _text_length(text: str) -> int:
+        return len(text.encode('utf-16-le')) // 2
+
+    @staticmethod
+    def _progress_text(campaign_name: str, job_id: int, total_count: int, progress: dict, rate: float = None,
+                       finished_in: float = None) -> str:
+        done = total_count - progress['remaining']
+        lines = [
+            f"📢 **廣播{'已完成' if finished_in is not None else '進行中'}**: `{campaign_name}` (工作 #{job_id})",
+            f"✅ 成功 {progress['sent']} | ❌ 失敗 {progress['failed']} | 📋 {done}/{total_count}",
+        ]
+        if finished_in is not None:
+            lines.append(f"⏱️ 耗時 {format_duration(finished_in)}")
+        else:
+            if progress['deferred']:
+                lines.append(f"⏸️ 限流延後 {progress['deferred']}")
+            if rate:
+                lines.append(f"⚡ {rate:.1f} 個/秒 | ⏳ 預計剩餘 {format_duration(progress['remaining'] / rate)}")
+        return "\n".join(lines)
+
+    async def _track_progress(self, job_id: int, campaign_name: str, total_count: int, reporter: ProgressReporter,
+                              initial: dict, wall_start: float):
+        """定期讀取工作進度並更新進度訊息 (編輯頻率由 ProgressReporter 限制)。"""
+        start_done = total_count - initial['remaining']
+        while True:
+            await asyncio.sleep(reporter.interval)
+            progress = await asyncio.to_thread(self.job_queue.progress, job_id)
+            done = total_count - progress['remaining']
+            elapsed = time.monotonic() - wall_start
+            rate = (done - start_done) / elapsed if done > start_done and elapsed > 0 else None
+            await reporter.update(self._progress_text(campaign_name, job_id, total_count, progress, rate))
+
+    @staticmethod
+    def _report_details(job_id: int, campaign_name: str, broadcast_start: datetime, tasks: list) -> str:
+        """報告附件：依目標順序列出每個群組的結果、發送帳號與錯誤。"""
+        labels = {True: '成功', False: '失敗', None: '未發送'}
+        lines = [f"廣播報告: {campaign_name} (工作 #{job_id})",
+                 f"時間: {broadcast_start.strftime('%Y-%m-%d %H:%M:%S')}", ""]
+        for task in tasks:
+            line = f"{task.index}. [{labels[task.outcome]}] {task.group['title']} ({task.group['id']})"
+            if task.account:
+                line += f" - {task.account}"
+            if task.outcome is not True and (task.last_error or task.error):
+                line += f" - {task.last_error or ''}: {task.error or ''}"
+            lines.append(line)
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def media_paths(content: dict) -> list[str]:
+        """
+        活動要發送的媒體檔案：多個檔案時以相簿發送。
+        舊版內容 (沒有 media 欄位，例如升級前排入的工作) 沿用 photo -> video -> GIF 的第一個檔案。
+        """
+        if content.get("media"):
+            return list(content["media"])
+        path = content.get("photo") or content.get("video") or content.get("gif")
+        return [path] if path else []
+
+    def make_senders(self, media_paths: list = (), media_info: dict = None) -> dict:
+        """為連線池中每個可用帳號建立發送狀態 (令牌桶與媒體上傳)。media_info 為前處理得到的影片資訊。"""
+        return {s.name: _AccountSender(s, self.config, media_paths, media_info, self._limiter_for(s.name))
+                for s in self.pool.active_sessions()}
+
+    def _limiter_for(self, session_name: str) -> RateLimiter:
+        if session_name not in self.limiters:
+            self.limiters[session_name] = RateLimiter(self.config.broadcast_rate, self.config.broadcast_burst,
+                                                      self.config.per_peer_rate)
+        return self.limiters[session_name]
+
+    @staticmethod
+    def tasks_from_claims(items: list[dict], campaign: str = None) -> list:
+        """將認領到的工作目標轉成 SendTask，保留中斷前的嘗試次數與延後時間。"""
+        tasks = []
+        for item in items:
+            task = SendTask(item['idx'], item['group'])
+            task.tries = item.get('attempts', 0)
+            task.defer_until = item.get('defer_until')
+            task.deferred_seconds = item.get('deferred_seconds', 0)
+            task.job_id = item.get('job_id')
+            task.campaign = campaign
+            tasks.append(task)
+        return tasks
+
+    async def deliver(self, content: dict, tasks: list, senders: dict, total_count: int, stats: dict = None,
+                      checkpoint=None):
+        """
+        以連線池中的帳號併發發送一批目標，每個目標的結果寫入 task.outcome。
+        本機廣播與 worker 行程共用此發送流程；senders 可跨批次重用，讓媒體只上傳一次。
+        提供 checkpoint 時，每個目標的結果與延後狀態都會記錄到檢查點。
+        """
+        stats = stats if stats is not None else {}
+        sessions = [s for s in self.pool.active_sessions() if s.name in senders]
+        if len(self.pool.sessions) > 1:
+            logging.info(f"👥 使用 {len(sessions)} 個帳號分流發送。",
+                         extra={'job_id': tasks[0].job_id if tasks else None,
+                                'campaign': tasks[0].campaign if tasks else None})
+
+        # 事先依帳號批次解析尚未快取的目標 (access_hash 因帳號而異)，發送過程中就不會再觸發 entity 查詢；
+        # 分配到的帳號無法解析時 (帳號不在群組內)，改由 rendezvous 順序中的下一個帳號解析並發送
+        pending = tasks
+        while pending:
+            assigned = {}
+            for task in pending:
+                session = self.pool.preferred(task.group['id'], exclude=task.excluded)
+                if session in sessions:
+                    assigned.setdefault(session, []).append(task)
+            results = await asyncio.gather(*(
+                self._resolve_targets(s, [t.group['id'] for t in assigned_tasks])
+                for s, assigned_tasks in assigned.items()
+            ))
+            pending = []
+            for (session, assigned_tasks), failed in zip(assigned.items(), results):
+                for task in assigned_tasks:
+                    if task.group['id'] in failed and any(s is not session and s.name not in task.excluded
+                                                          for s in sessions):
+                        task.excluded.add(session.name)
+                        pending.append(task)
+
+        # 以工作佇列 + 多個 worker 併發發送，速率由各帳號的令牌桶控制，取代每個群組後固定 sleep
+        queue = SendQueue()
+        now = time.time()
+        for task in tasks:
+            # 中斷前被延後的目標，仍依原本的等待時間再發送
+            queue.put(task, (task.defer_until - now) if task.defer_until else 0)
+        worker_count = min(self.config.broadcast_concurrency * max(1, len(sessions)), len(tasks))
+        workers = [
+            asyncio.create_task(self._broadcast_worker(queue, content, senders, total_count, stats, checkpoint))
+            for _ in range(worker_count)
+        ]
+        await asyncio.gather(*workers)
+        return tasks
+
+    async def _deliver_job(self, job_id: int, content: dict, campaign_name: str, media_paths: list, total_count: int,
+                           stats: dict):
+        """本行程直接發送工作中尚未完成的目標，結果以增量檢查點寫回工作。"""
+        items = await asyncio.to_thread(self.job_queue.claim_job, job_id, self.LOCAL_WORKER)
+        tasks = self.tasks_from_claims(items, campaign_name)
+        senders = self.make_senders(media_paths, content.get("media_info"))
+        checkpoint = JobCheckpoint(self.job_queue, job_id, self.LOCAL_WORKER).start()
         try:
+            await self.deliver(content, tasks, senders, total_count, stats, checkpoint)
+        finally:
+            await checkpoint.close()
+            uploaders = [s.uploader for s in senders.values()]
+            await asyncio.to_thread(self.job_queue.add_upload, job_id, sum(u.total_bytes for u in uploaders),
+                                    sum(u.total_seconds for u in uploaders), sum(u.saved_bytes for u in uploaders))
+
+    async def _wait_for_workers(self, job_id: int, stats: dict):
+        """協調者模式：等待 worker 行程把工作中的目標發送完畢。"""
+        # 以本機模式中斷的工作沒有租約，交還佇列讓 worker 認領
+        await asyncio.to_thread(self.job_queue.release, job_id, self.LOCAL_WORKER)
+        logging.info(f"📤 廣播工作 #{job_id} 已排入佇列，等待 worker 發送...", extra={'job_id': job_id})
+        warned = False
+        while True:
+            progress = await asyncio.to_thread(self.job_queue.progress, job_id)
+            if progress['first_sent_at'] and 'first_send_at' not in stats:
+                stats['first_send_at'] = progress['first_sent_at']
+            self.dispatcher.set_remaining(job_id, progress['remaining'])
+            if progress['remaining'] == 0:
+                break
+            if not warned and not await asyncio.to_thread(self.job_queue.live_workers, self.WORKER_STALE_AFTER):
+                warned = True
+                logging.warning(f"⚠️ 目前沒有在線的 worker，廣播工作 #{job_id} 會在 worker 啟動後繼續。",
+                                extra={'job_id': job_id})
+            await asyncio.sleep(self.JOB_POLL_INTERVAL)
+
+    async def _job_results(self, job_id: int):
+        """
+        取回工作中每個目標的最終狀態。
+        回傳 (tasks, (上傳位元組, 上傳秒數, 節省位元組))。
+        """
+        items = await asyncio.to_thread(self.job_queue.items, job_id)
+        job = await asyncio.to_thread(self.job_queue.job, job_id)
+        outcomes = {'sent': True, 'failed': False}
+        tasks = []
+        for item in items:
+            task = SendTask(item['idx'], item['group'])
+            task.outcome = outcomes.get(item['status'])
+            task.tries = item['attempts'] or 0
+            task.last_error = item['error_class']
+            task.error = item['error']
+            task.latency = item['latency_ms'] / 1000 if item['latency_ms'] is not None else None
+            task.sent_at = item['sent_at']
+            task.account = item['account']
+            task.deferred_seconds = item['deferred_seconds'] or 0
+            tasks.append(task)
+        return tasks, (job['upload_bytes'], job['upload_seconds'], job['saved_bytes'])
+
+    async def _resolve_targets(self, session, group_ids: list):
+        """以該帳號的 entity 快取批次解析尚未快取的目標，回傳解析失敗的 {ID: 錯誤}。"""
+        cache = session.entity_cache
+        missing = [gid for gid in group_ids if cache and cache.get(gid) is None]
+        if not missing:
+            return {}
+        _, failed = await cache.resolve_many(missing)
+        logging.info(f"🔎 [{session.name}] 已解析 {len(missing) - len(failed)}/{len(missing)} 個未快取的目標。",
+                     extra={'account': session.name})
+        return failed
+
+    async def _broadcast_worker(self, queue: SendQueue, content: dict, senders: dict,
+                                total_count: int, stats: dict, checkpoint=None):
+        """從佇列取出目標並發送，直到佇列清空且沒有等待重試的目標。"""
+        while True:
+            task = await queue.get()
+            if task is None:
+                return
             try:
-                with open('broadcast_history.json', 'r', encoding='utf-8') as f:
-                    history = json.load(f)
-            except (FileNotFoundError, json.JSONDecodeError):
-                history = []
+                tries = task.tries
+                outcome = await self._attempt_send(task, content, senders, queue, total_count, checkpoint)
+                if task.tries > tries:
+                    # 只統計實際送出請求的嘗試 (不含因限流直接延後的目標)
+                    label = 'requeued' if outcome is _REQUEUED else self.OUTCOME_LABELS[outcome]
+                    SEND_ATTEMPTS.inc(outcome=label, error_class='' if outcome is True else (task.last_error or ''))
+                    if task.latency is not None:
+                        SEND_LATENCY.observe(task.latency)
+                if outcome is not _REQUEUED:
+                    task.outcome = outcome
+                    self.dispatcher.completed(task.job_id)
+                    if checkpoint is not None:
+                        checkpoint.record(task)
+                if outcome is True and 'first_send_at' not in stats:
+                    stats['first_send_at'] = task.sent_at
+            finally:
+                queue.task_done()
 
+    async def _send_content(self, peer, content: dict, media: list = None, client=None) -> bool:
+        """
+        依內容類型發送到單一目標。沒有可發送內容時回傳 False。
+        多個媒體以相簿在同一個請求中發送 (Telethon 每 10 個一組)，文字作為第一個媒體的說明。
+        """
+        client = client or self.client
+        message_text = content.get("text", "")
+        if media and len(media) == 1:
+            message = await client.send_file(peer, media[0].file, caption=message_text)
+            media[0].remember_sent(message)
+        elif media:
+            messages = await client.send_file(peer, [m.file for m in media], caption=message_text)
+            # 之後的目標直接引用伺服器上的媒體，不必每次再為相簿執行 UploadMedia
+            for item, message in zip(media, messages):
+                item.remember_sent(message)
+        elif message_text:
+            await client.send_message(peer, message_text)
+        else:
+            return False
+        return True
+
+    @staticmethod
+    def _log_send(level: int, message: str, task: SendTask, **fields):
+        """記錄單一目標的發送事件，附帶活動、工作、群組、嘗試次數與帳號等結構化欄位。"""
+        extra = {'campaign': task.campaign, 'job_id': task.job_id, 'group_id': task.group['id'],
+                 'group_title': task.group['title'], 'attempt': task.tries, 'account': task.account}
+        extra.update(fields)
+        logging.log(level, message, extra=extra)
+
+    async def _attempt_send(self, task: SendTask, content: dict, senders: dict,
+                            queue: SendQueue, total_count: int, checkpoint=None):
+        """
+        以負責該目標的帳號嘗試發送一次。
+        回傳 True (成功)、False (永久失敗或重試用盡)、None (沒有可發送的內容)，
+        需要稍後再試時會把目標放回佇列並回傳 _REQUEUED。
+        """
+        i, group = task.index, task.group
+
+        session = self.pool.assign(group['id'], exclude=task.excluded)
+        if session is None or session.name not in senders:
+            wait = self.pool.next_available_in(exclude=task.excluded)
+            if wait is None:
+                task.last_error = ACCOUNT
+                task.error = task.error or "沒有可用的發送帳號"
+                self._log_send(logging.ERROR, f"❌ [{i}/{total_count}] 發送失敗: {group['title']} (沒有可用的發送帳號)",
+                               task, outcome='failed', error_class=ACCOUNT)
+                return False
+            # 所有帳號都在限流中，等最早恢復的帳號
+            wait = max(1, wait)
+            task.deferred_seconds += wait
+            if task.deferred_seconds > self.config.max_flood_wait:
+                self._log_send(logging.ERROR, f"❌ [{i}/{total_count}] 發送失敗: {group['title']} (所有帳號限流，累計等待 {task.deferred_seconds:.0f}s 超過上限)",
+                               task, outcome='failed', error_class=FLOOD_WAIT, wait=wait)
+                return False
+            queue.put(task, wait)
+            if checkpoint is not None:
+                checkpoint.defer(task, wait)
+            return _REQUEUED
+        sender = senders[session.name]
+        limiter = sender.limiter
+
+        # 目標仍在伺服器要求的等待時間內，直接延後，不佔用 worker
+        blocked = limiter.peer_blocked_for(group['id'])
+        if blocked > 0:
+            queue.put(task, blocked)
+            return _REQUEUED
+
+        send_start = time.monotonic()
+        try:
+            media = await sender.get_media()
+            # 帳號的令牌依工作的優先度分配，等待令牌時不佔用分派器的名額
+            await limiter.acquire(group['id'], rank=self.dispatcher.admission_rank(task.job_id))
+            cache = session.entity_cache
+            peer = cache.peer(group['id']) if cache else group['id']
+            # 媒體已上傳、令牌已取得後才向分派器取得發送名額 (高優先度的工作優先，同優先度輪流)：
+            # 名額只在發送請求期間持有，等待令牌或上傳中的低優先度工作不會佔住名額，緊急廣播可以立即插隊
+            async with self.dispatcher.slot(task.job_id):
+                task.tries += 1
+                task.account = session.name
+                send_start = time.monotonic()
+                SENDS_IN_FLIGHT.inc()
+                try:
+                    sent = await self._send_content(peer, content, media, session.client)
+                finally:
+                    SENDS_IN_FLIGHT.dec()
+            task.latency = time.monotonic() - send_start
+            task.sent_at = time.time()
+            session.sends += 1
+            if not sent:
+                # This case should ideally be caught earlier, but as a fallback
+                self._log_send(logging.WARNING, f"⚠️ 無法發送內容到 {group['title']}，因為沒有可用的內容。", task)
+                return None
+            self._log_send(logging.INFO, f"✅ [{i}/{total_count}] 已發送到: {group['title']}", task,
+                           outcome='sent', latency_ms=round(task.latency * 1000, 1))
+            return True
+        except Exception as e:
+            kind, wait = classify_error(e)
+            if kind in (FLOOD_WAIT, SLOW_MODE):
+                FLOOD_WAIT_SECONDS.inc(wait, kind=kind)
+            task.last_error = kind
+            task.error = str(e)
+            task.latency = time.monotonic() - send_start
+            task.sent_at = time.time()
+            session.failures += 1
+
+            if kind == ACCOUNT:
+                # 帳號已失效：移出連線池，目標立即交給其他帳號
+                self.pool.mark_logged_out(session, e)
+                self._log_send(logging.ERROR, f"⛔ 帳號 {session.name} 已失效，目標 {group['title']} 改由其他帳號發送: {e}",
+                               task, outcome='requeued', error_class=kind)
+                queue.put(task)
+                return _REQUEUED
+
+            if (kind == FLOOD_WAIT and wait >= self.pool.FLOOD_FAILOVER_THRESHOLD
+                    and any(s.available and s is not session for s in self.pool.sessions)):
+                # 整個帳號被長時間限流，暫停該帳號並讓其他帳號接手，不必等待
+                self.pool.mark_flood(session, wait)
+                self._log_send(logging.WARNING, f"🔀 帳號 {session.name} 被限流 {wait}s，{group['title']} 改由其他帳號發送",
+                               task, outcome='requeued', error_class=kind, wait=wait)
+                queue.put(task)
+                return _REQUEUED
+
+            if (kind == PERMANENT and is_unresolved(e)
+                    and any(s.name not in task.excluded and s is not session and s.name in senders
+                            for s in self.pool.active_sessions())):
+                # 此帳號無法解析或存取目標 (可能不在群組內)，改由 rendezvous 順序中的下一個帳號發送
+                task.excluded.add(session.name)
+                self._log_send(logging.WARNING, f"🔀 帳號 {session.name} 無法存取 {group['title']}，改由其他帳號發送: {e}",
+                               task, outcome='requeued', error_class=kind)
+                queue.put(task)
+                return _REQUEUED
+
+            if kind == PERMANENT:
+                self._log_send(logging.ERROR, f"⛔ [{i}/{total_count}] 發送失敗 (無法重試): {group['title']}: {e}",
+                               task, outcome='failed', error_class=kind)
+                return False
+
+            if kind in (FLOOD_WAIT, SLOW_MODE):
+                # 依伺服器要求暫停此目標並延後重排，不消耗重試次數
+                wait = max(1, wait)
+                task.deferred_seconds += wait
+                if task.deferred_seconds > self.config.max_flood_wait:
+                    self._log_send(logging.ERROR, f"❌ [{i}/{total_count}] 發送失敗: {group['title']} (累計等待 {task.deferred_seconds}s 超過上限): {e}",
+                                   task, outcome='failed', error_class=kind, wait=wait)
+                    return False
+                limiter.pause_peer(group['id'], wait)
+                if kind == FLOOD_WAIT:
+                    # flood-wait 是針對整個帳號的限制：同時暫停全域令牌桶，避免繼續對其他目標發送而延長等待
+                    limiter.global_bucket.pause(wait)
+                queue.put(task, wait)
+                if checkpoint is not None:
+                    checkpoint.defer(task, wait)
+                self._log_send(logging.WARNING, f"⏳ [{i}/{total_count}] {group['title']} 需等待 {wait}s ({kind})，已延後重排",
+                               task, outcome='requeued', error_class=kind, wait=wait)
+                return _REQUEUED
+
+            task.attempt += 1
+            self._log_send(logging.ERROR, f"❌ [{i}/{total_count}] 發送失敗: {group['title']} (重試 {task.attempt}/{self.config.max_retries}): {e}",
+                           task, outcome='failed' if task.attempt >= self.config.max_retries else 'requeued',
+                           error_class=kind)
+            if task.attempt >= self.config.max_retries:
+                return False
+            # 暫時性錯誤以指數退避方式延後重排
+            queue.put(task, 2 ** task.attempt)
+            return _REQUEUED
+
+    async def save_broadcast_history(self, start_time: datetime, success_count: int, total_count: int,
+                                     file_path: str, success_rate: str, is_photo: bool = False,
+                                     is_video: bool = False, is_gif: bool = False, upload_bytes: int = 0,
+                                     upload_seconds: float = 0.0, wall_seconds: float = 0.0,
+                                     tasks: list = (), results: list = ()):
+        """將本次廣播的結果與每個目標的發送結果附加到歷史資料庫 (在執行緒中寫入，不阻塞事件循環)。"""
+        try:
             record = {
                 'time': start_time.strftime('%Y-%m-%d %H:%M:%S'),
                 'success_count': success_count,
                 'total_count': total_count,
-                'content_source': file_path, # Changed from message_file to content_source
+                'campaign': file_path,
                 'is_photo': is_photo,
-                'is_video': is_video, # New field
-                'is_gif': is_gif,     # New field
+                'is_video': is_video,
+                'is_gif': is_gif,
                 'success_rate': success_rate,
+                'upload_bytes': upload_bytes,
+                'upload_seconds': round(upload_seconds, 2),
+                'wall_seconds': round(wall_seconds, 2),
                 'scheduled': self.config.enabled,
                 'restart_count': self.config.total_restarts
             }
-            history.append(record)
-
-            # 僅保留最新的 100 筆記錄
-            history = history[-100:]
-
-            with open('broadcast_history.json', 'w', encoding='utf-8') as f:
-                json.dump(history, f, ensure_ascii=False, indent=2)
-            print("📊 廣播歷史已保存。")
+            outcomes = {True: 'sent', False: 'failed', None: 'skipped'}
+            sends = [
+                {
+                    'group_id': task.group['id'],
+                    'group_title': task.group.get('title'),
+                    'outcome': outcomes[ok],
+                    'error_class': task.last_error if not ok else None,
+                    'error': task.error if not ok else None,
+                    'attempts': task.tries,
+                    'latency_ms': round(task.latency * 1000, 1) if task.latency is not None else None,
+                    'sent_at': task.sent_at,
+                    'account': task.account,
+                    'deferred_seconds': task.deferred_seconds,
+                }
+                for task, ok in zip(tasks, results)
+            ]
+            await asyncio.to_thread(self.history_store.record_broadcast, record, start_time.timestamp(), sends)
+            logging.info("📊 廣播歷史已保存。", extra={'campaign': file_path})
         except Exception as e:
-            print(f"❌ 保存廣播歷史時發生錯誤: {e}")
\ No newline at end of file
+            logging.exception(f"❌ 保存廣播歷史時發生錯誤: {e}", extra={'campaign': file_path})
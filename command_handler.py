@@ -1,137 +1,127 @@
 from telethon import events
 from telethon.tl.types import ChannelParticipantsAdmins
 from datetime import datetime, timedelta
+import asyncio
+import itertools
 import json
 import re
 import os
 import pytz
 import logging
+import time
+import sqlite3
+
+import metrics
+from backup_manager import is_sqlite
+from dispatcher import PRIORITY_NAMES, PRIORITY_URGENT
+from media_processor import format_stats
+from simulator import format_simulation
+from target_index import normalize_tag, parse_selector
 
 class CommandHandler:
     """
     處理所有來自 Telegram 的使用者指令 (最終完整版，包含所有功能)。
     """
-    def __init__(self, bot_instance, client, config, broadcast_manager, scheduler, message_manager):
+    def __init__(self, bot_instance, client, config, broadcast_manager, scheduler, message_manager, entity_cache):
         self.bot_instance = bot_instance
         self.client = client
         self.config = config
         self.broadcast_manager = broadcast_manager
         self.scheduler = scheduler
         self.message_manager = message_manager
+        self.entity_cache = entity_cache
+        # 分頁列表的游標：(聊天, 使用者, 指令) -> {'pages': 已列出各頁的起始位置, 'next': 下一頁的起始位置}
+        self._cursors = {}
+
+    # 只有以 "/指令" 開頭的訊息會進入路由，其餘訊息在第一個字元就被排除
+    COMMAND_RE = re.compile(r'^/(\w+)(?:@\w+)?(?:\s+(.*))?$', re.DOTALL)
+
+    def _build_routes(self) -> dict:
+        """指令名稱 -> (處理函式, 參數格式, 是否需要管理員權限)。"""
+        return {
+            # --- 管理員與群組成員管理 ---
+            'list_admins': (self.list_admins, r'/list_admins', True),
+            'add_admin': (self.add_admin, r'/add_admin\s+(.+)', True),
+            'remove_admin': (self.remove_admin, r'/remove_admin\s+(.+)', True),
+            'list_members': (self.list_members, r'/list_members(?:\s+(next|prev|refresh))?', True),
+            'sync_admins': (self.sync_admins, r'/sync_admins(?:\s+.*)?', True),
+
+            # --- 新排程管理 (以活動為中心) ---
+            'add_schedule': (self.add_schedule, r'/add_schedule\s+(\d{2}:\d{2})\s+(.+)', True),
+            'remove_schedule': (self.remove_schedule, r'/remove_schedule\s+(\d{2}:\d{2})\s+(.+)', True),
+            'list_schedules': (self.list_schedules, r'/list_schedules(?:\s+.*)?', True),
+
+            # --- 廣播群組管理 ---
+            'add': (self.add_group, r'/add(?:\s+(-?\d+))?', True),
+            'add_groups': (self.add_groups, r'/add_groups\s+(.+)', True),
+            'add_by_id': (self.add_by_id, r'/add_by_id\s+(-?\d+)', True),
+            'list': (self.list_all, r'/list(?:\s+(\d+))?(?:\s+.*)?', True),
+            'list_groups': (self.list_groups, r'/list_groups(?:\s+(next|prev))?', True),
+            'remove': (self.remove_group, r'/remove\s+(\d+)', True),
+            'tag': (self.tag_groups, r'/tag\s+(\S+)\s+(.+)', True),
+            'untag': (self.untag_groups, r'/untag\s+(\S+)\s+(.+)', True),
+            'tags': (self.list_tags, r'/tags(?:\s+(.+))?', True),
+            'my_groups': (self.my_groups, r'/my_groups(?:\s+(\d+))?(?:\s+.*)?', True),
+            'refresh_dialogs': (self.refresh_dialogs, r'/refresh_dialogs(?:\s+.*)?', True),
+
+            # --- 活動與測試指令 ---
+            'campaigns': (self.list_campaigns, r'/campaigns(?:\s+.*)?', True),
+            'preview': (self.preview_campaign, r'/preview(?:\s+(.+))?', True),
+            'test': (self.test_campaign_broadcast, r'/test(?:\s+(.+))?', True),
+            'simulate': (self.simulate_campaign, r'/simulate(?:\s+(.+))?', True),
+            'optimize': (self.optimize_campaign, r'/optimize(?:\s+(.+))?', True),
+
+            # --- 其他系統指令 ---
+            'schedule': (self.show_schedule, r'/schedule(?:\s+.*)?', True),
+            'history': (self.show_history, r'/history(?:\s+(.+))?', True),
+            'enable': (self.enable_broadcast, r'/enable(?:\s+.*)?', True),
+            'disable': (self.disable_broadcast, r'/disable(?:\s+.*)?', True),
+            'status': (self.show_status, r'/status(?:\s+.*)?', True),
+            'accounts': (self.show_accounts, r'/accounts(?:\s+.*)?', True),
+            'workers': (self.show_workers, r'/workers(?:\s+.*)?', True),
+            'queue': (self.show_queue, r'/queue(?:\s+.*)?', True),
+            'metrics': (self.show_metrics, r'/metrics(?:\s+.*)?', True),
+            'backup': (self.backup_now, r'/backup(?:\s+.*)?', True),
+            'restore': (self.restore_backup, r'/restore(?:\s+(\S+))?(?:\s+(.+))?', True),
+            'help': (self.show_help, r'/help(?:\s+.*)?', False),
+            'info': (self.show_info, r'/info(?:\s+.*)?', True),
+        }
 
     def register_handlers(self):
-        # --- 管理員與群組成員管理 ---
-        self.client.add_event_handler(self.list_admins, events.NewMessage(pattern=r'^/list_admins$', func=self._is_admin))
-        self.client.add_event_handler(self.add_admin, events.NewMessage(pattern=r'/add_admin (.+)', func=self._is_admin))
-        self.client.add_event_handler(self.remove_admin, events.NewMessage(pattern=r'/remove_admin (.+)', func=self._is_admin))
-        self.client.add_event_handler(self.list_members, events.NewMessage(pattern='/list_members', func=self._is_admin))
-        self.client.add_event_handler(self.sync_admins, events.NewMessage(pattern='/sync_admins', func=self._is_admin))
-
-        # --- 新排程管理 (以活動為中心) ---
-        self.client.add_event_handler(self.add_schedule, events.NewMessage(pattern=r'/add_schedule (\d{2}:\d{2}) (.+)', func=self._is_admin))
-        self.client.add_event_handler(self.remove_schedule, events.NewMessage(pattern=r'/remove_schedule (\d{2}:\d{2}) (.+)', func=self._is_admin))
-        self.client.add_event_handler(self.list_schedules, events.NewMessage(pattern='/list_schedules', func=self._is_admin))
-        
-        # --- 廣播群組管理 ---
-        @self.client.on(events.NewMessage(pattern=r'/add(?:\s+(-?\d+))?', func=self._is_admin))
-        async def add_group(event):
-            user_id = event.sender_id
-            username = getattr(event.sender, 'username', None)
-            print(f"[CMD] 收到指令: /add 來自 {user_id} ({username})")
-            logging.info(f"[CMD] 收到指令: /add 來自 {user_id} ({username})")
-            group_id_str = event.pattern_match.group(1)
-            if group_id_str:
-                # 指定群組ID
-                try:
-                    group_id = int(group_id_str)
-                    entity = await self.client.get_entity(group_id)
-                    chat_info = {'id': entity.id, 'title': getattr(entity, 'title', f'ID {entity.id}'), 'type': 'group'}
-                    if not any(g['id'] == chat_info['id'] for g in self.config.target_groups):
-                        self.config.target_groups.append(chat_info)
-                        self.config.save_settings()
-                        await event.reply(f"✅ 已新增廣播目標: 「{chat_info['title']}」 (ID: `{chat_info['id']}`)")
-                    else:
-                        await event.reply(f"ℹ️ 「{chat_info['title']}」已在目標中。")
-                except Exception as e:
-                    await event.reply(f"❌ 新增失敗: {e}")
-            else:
-                # 新增目前群組
-                chat = await event.get_chat()
-                chat_info = {'id': chat.id, 'title': getattr(chat, 'title', f'對話 {chat.id}'), 'type': 'group'}
-                if not any(g['id'] == chat_info['id'] for g in self.config.target_groups):
-                    self.config.target_groups.append(chat_info)
-                    self.config.save_settings()
-                    await event.reply(f"✅ 已新增廣播目標: 「{chat_info['title']}」")
-                else:
-                    await event.reply(f"ℹ️ 「{chat_info['title']}」已在目標中。")
-        self.client.add_event_handler(self.list_groups, events.NewMessage(pattern=r'^/list_groups$', func=self._is_admin))
-        self.client.add_event_handler(self.remove_group, events.NewMessage(pattern=r'/remove (\d+)', func=self._is_admin))
-        self.client.add_event_handler(self.my_groups, events.NewMessage(pattern='/my_groups', func=self._is_admin))
-        self.client.add_event_handler(self.add_by_id, events.NewMessage(pattern=r'/add_by_id (-?\d+)', func=self._is_admin))
-
-        # --- 活動與測試指令 ---
-        self.client.add_event_handler(self.list_campaigns, events.NewMessage(pattern='/campaigns', func=self._is_admin))
-        self.client.add_event_handler(self.preview_campaign, events.NewMessage(pattern=r'/preview(?:\s+(.+))?', func=self._is_admin))
-        self.client.add_event_handler(self.test_campaign_broadcast, events.NewMessage(pattern=r'/test(?:\s+(.+))?', func=self._is_admin))
-
-        # --- 其他系統指令 ---
-        self.client.add_event_handler(self.show_schedule, events.NewMessage(pattern='/schedule', func=self._is_admin))
-        self.client.add_event_handler(self.show_history, events.NewMessage(pattern='/history', func=self._is_admin))
-        self.client.add_event_handler(self.enable_broadcast, events.NewMessage(pattern='/enable', func=self._is_admin))
-        self.client.add_event_handler(self.disable_broadcast, events.NewMessage(pattern='/disable', func=self._is_admin))
-        self.client.add_event_handler(self.show_status, events.NewMessage(pattern='/status', func=self._is_admin))
-        self.client.add_event_handler(self.show_help, events.NewMessage(pattern='/help'))
-        self.client.add_event_handler(self.show_info, events.NewMessage(pattern='/info', func=self._is_admin))
-        
-        @self.client.on(events.NewMessage(pattern='/list'))
-        async def handler_list(event):
-            user_id = event.sender_id
-            username = getattr(event.sender, 'username', None)
-            print(f"[CMD] 收到指令: /list 來自 {user_id} ({username})")
-            logging.info(f"[CMD] 收到指令: /list 來自 {user_id} ({username})")
-            # 僅允許管理員查詢
-            if not self.config.is_admin(user_id):
-                await event.reply("你沒有權限使用此指令。"); return
-            # 直接呼叫 list_all_groups
-            await self.bot_instance.list_all_groups(send_to_control_group=True)
-
-        @self.client.on(events.NewMessage(pattern=r'/add_groups (.+)', func=self._is_admin))
-        async def add_groups(event):
-            user_id = event.sender_id
-            username = getattr(event.sender, 'username', None)
-            print(f"[CMD] 收到指令: /add_groups 來自 {user_id} ({username})")
-            logging.info(f"[CMD] 收到指令: /add_groups 來自 {user_id} ({username})")
-            group_ids_str = event.pattern_match.group(1)
-            group_ids = [gid.strip() for gid in group_ids_str.split(',') if gid.strip()]
-            added = []
-            failed = []
-            for gid in group_ids:
-                try:
-                    group_id = int(gid)
-                    entity = await self.client.get_entity(group_id)
-                    chat_info = {'id': entity.id, 'title': getattr(entity, 'title', f'ID {entity.id}'), 'type': 'group'}
-                    if not any(g['id'] == chat_info['id'] for g in self.config.target_groups):
-                        self.config.target_groups.append(chat_info)
-                        added.append(f"{chat_info['title']} (`{chat_info['id']}`)")
-                    else:
-                        failed.append(f"{chat_info['title']} (`{chat_info['id']}`) 已存在")
-                except Exception as e:
-                    failed.append(f"ID {gid} 新增失敗: {e}")
-            self.config.save_settings()
-            msg = ""
-            if added:
-                msg += f"✅ 已新增: {'、'.join(added)}\n"
-            if failed:
-                msg += f"⚠️ 未新增/已存在: {'、'.join(failed)}"
-            await event.reply(msg or "沒有任何群組被新增。")
-
-        print("🦾 所有指令處理常式已註冊 (最終完整版)。")
-
-    async def _is_admin(self, event):
-        is_admin = self.config.is_admin(event.sender_id)
-        if not is_admin:
+        """註冊單一的指令路由處理常式，取代每個指令各自一個 NewMessage 處理常式。"""
+        self.routes = {
+            name: (handler, re.compile(pattern, re.DOTALL), admin_only)
+            for name, (handler, pattern, admin_only) in self._build_routes().items()
+        }
+        self.client.add_event_handler(self._dispatch, events.NewMessage(pattern=self.COMMAND_RE))
+        logging.info(f"🦾 指令路由已註冊 ({len(self.routes)} 個指令)。")
+
+    async def _dispatch(self, event):
+        """依指令名稱查表，檢查權限後只執行一個對應的處理函式。"""
+        command, args = event.pattern_match.group(1), event.pattern_match.group(2)
+        route = self.routes.get(command.lower())
+        if route is None:
+            return  # 不是本機器人的指令 (例如群組中其他機器人的指令)
+        handler, pattern, admin_only = route
+
+        user_id = event.sender_id
+        logging.info(f"[CMD] 收到指令: /{command} 來自 {user_id}")
+        if admin_only and not self.config.is_admin(user_id):
             await event.reply("❌ 您沒有權限執行此操作。")
-        return is_admin
+            return
+
+        # 以去除 @機器人名稱 後的指令文字比對參數格式，處理函式沿用 event.pattern_match 取參數
+        normalized = f"/{command}" + (f" {args.strip()}" if args and args.strip() else "")
+        match = pattern.fullmatch(normalized)
+        if match is None:
+            await event.reply(f"❌ 指令格式錯誤: `/{command}`。請使用 `/help` 查看用法。")
+            return
+        event.pattern_match = match
+        try:
+            await handler(event)
+        except Exception as e:
+            logging.exception(f"❌ 執行指令 /{command} 時發生錯誤: {e}")
+            await event.reply(f"❌ 執行指令時發生錯誤: {e}")
 
     def _is_control_group_member(self, event):
         # 僅允許主控制群組成員執行
@@ -143,20 +133,147 @@ class CommandHandler:
             entity_to_find = int(cleaned_str)
         except ValueError:
             entity_to_find = cleaned_str
-        return await self.client.get_entity(entity_to_find)
+        return await self.entity_cache.resolve(entity_to_find)
+
+    def _split_target(self, text: str) -> tuple[str, str]:
+        """拆開 `活動名稱 -> 目標選擇器`，回傳 (活動名稱, 選擇器或 None)；選擇器格式錯誤時拋出 ValueError。"""
+        campaign_name, sep, target = text.partition('->')
+        target = target.strip() if sep else None
+        if target:
+            parse_selector(target)
+        return campaign_name.strip(), target or None
+
+    def _describe_target(self, target: str) -> str:
+        return f"`{target}` ({self.config.target_index.count(target)} 個群組)" if target else "所有目標"
+
+    # 分頁列表每頁最多的項目數，以及 Telegram 訊息的長度上限 (以 UTF-16 計算)
+    PAGE_SIZE = 50
+    TEXT_LIMIT = 4096
+
+    @staticmethod
+    def _text_length(text: str) -> int:
+        return len(text.encode('utf-16-le')) // 2
+
+    def _page_start(self, key: tuple, arg: str):
+        """
+        依分頁參數移動游標：省略為第一頁、`next` 為上次列出的下一頁、`prev` 為上一頁。
+        回傳 (本頁起始位置, 頁碼)；沒有下一頁/上一頁時回傳 None。
+        """
+        state = self._cursors.get(key)
+        if arg == 'next':
+            if not state or state['next'] is None:
+                return None
+            state['pages'].append(state['next'])
+        elif arg == 'prev':
+            if not state or len(state['pages']) < 2:
+                return None
+            state['pages'].pop()
+        else:
+            state = self._cursors[key] = {'pages': [0], 'next': None}
+        return state['pages'][-1], len(state['pages'])
+
+    def _page_message(self, key: tuple, title: str, lines, command: str) -> str:
+        """
+        組成一頁訊息並記錄下一頁的起始位置。lines 為從本頁起始位置開始的產生器，
+        只讀取到 PAGE_SIZE 項或訊息長度上限為止，不會組出整個列表。
+        """
+        state = self._cursors[key]
+        start, page = state['pages'][-1], len(state['pages'])
+        # 預留頁尾翻頁提示的長度
+        used = self._text_length(title) + 80
+        body, more = [], False
+        for line in lines:
+            length = self._text_length(line) + 1
+            if len(body) >= self.PAGE_SIZE or (body and used + length > self.TEXT_LIMIT):
+                more = True
+                break
+            body.append(line)
+            used += length
+        state['next'] = start + len(body) if more else None
+        nav = ([f"上一頁: `{command} prev`"] if page > 1 else []) + ([f"下一頁: `{command} next`"] if more else [])
+        return f"{title}\n\n" + "\n".join(body) + (f"\n\n{' | '.join(nav)}" if nav else "")
 
     # --- 指令實作 ---
 
+    async def add_group(self, event):
+        group_id_str = event.pattern_match.group(1)
+        if group_id_str:
+            # 指定群組ID
+            try:
+                group_id = int(group_id_str)
+                entity = await self.entity_cache.resolve(group_id)
+                chat_info = {'id': entity.id, 'title': getattr(entity, 'title', f'ID {entity.id}'), 'type': 'group'}
+                if not any(g['id'] == chat_info['id'] for g in self.config.target_groups):
+                    self.config.target_groups.append(chat_info)
+                    self.config.save_settings()
+                    await event.reply(f"✅ 已新增廣播目標: 「{chat_info['title']}」 (ID: `{chat_info['id']}`)")
+                else:
+                    await event.reply(f"ℹ️ 「{chat_info['title']}」已在目標中。")
+            except Exception as e:
+                await event.reply(f"❌ 新增失敗: {e}")
+        else:
+            # 新增目前群組
+            chat = await event.get_chat()
+            chat_info = {'id': chat.id, 'title': getattr(chat, 'title', f'對話 {chat.id}'), 'type': 'group'}
+            if not any(g['id'] == chat_info['id'] for g in self.config.target_groups):
+                self.config.target_groups.append(chat_info)
+                self.config.save_settings()
+                await event.reply(f"✅ 已新增廣播目標: 「{chat_info['title']}」")
+            else:
+                await event.reply(f"ℹ️ 「{chat_info['title']}」已在目標中。")
+
+    async def add_groups(self, event):
+        group_ids_str = event.pattern_match.group(1)
+        group_ids = [gid.strip() for gid in group_ids_str.split(',') if gid.strip()]
+        added = []
+        failed = []
+        valid_ids = []
+        for gid in group_ids:
+            try:
+                valid_ids.append(int(gid))
+            except ValueError as e:
+                failed.append(f"ID {gid} 新增失敗: {e}")
+        # 一次批次解析所有 ID，避免逐一查詢造成大量請求與 flood-wait
+        resolved, errors = await self.entity_cache.resolve_many(valid_ids)
+        existing_ids = {g['id'] for g in self.config.target_groups}
+        for group_id in valid_ids:
+            if group_id not in resolved:
+                failed.append(f"ID {group_id} 新增失敗: {errors.get(group_id)}")
+                continue
+            entity = resolved[group_id]
+            chat_info = {'id': entity.id, 'title': getattr(entity, 'title', None) or f'ID {entity.id}', 'type': 'group'}
+            if chat_info['id'] not in existing_ids:
+                self.config.target_groups.append(chat_info)
+                existing_ids.add(chat_info['id'])
+                added.append(f"{chat_info['title']} (`{chat_info['id']}`)")
+            else:
+                failed.append(f"{chat_info['title']} (`{chat_info['id']}`) 已存在")
+        if added:
+            self.config.save_settings()
+        msg = ""
+        if added:
+            msg += f"✅ 已新增: {'、'.join(added)}\n"
+        if failed:
+            msg += f"⚠️ 未新增/已存在: {'、'.join(failed)}"
+        await event.reply(msg or "沒有任何群組被新增。")
+
+    async def list_all(self, event):
+        # 直接呼叫 list_all_groups (可指定頁碼: /list 2)
+        page = int(event.pattern_match.group(1) or 1)
+        await self.bot_instance.list_all_groups(send_to_control_group=True, page=page)
+
     async def sync_admins(self, event):
         if not self.config.control_group: await event.reply("❌ 未設定控制群組，無法同步。"); return
         await event.reply("⏳ 正在掃描控制群組的管理員並進行同步...")
         try:
             new_admins = []
             async for user in self.client.iter_participants(self.config.control_group, filter=ChannelParticipantsAdmins):
+                self.entity_cache.remember(user)
                 if user.bot: continue
                 new_admins.append({"id": user.id, "name": user.first_name, "username": user.username or ""})
             self.config.admins = new_admins
             self.config.save_admins()
+            self.entity_cache.save()
             await event.reply(f"✅ 同步完成！已將 **{len(new_admins)}** 位控制群組的管理員設定為機器人管理員。")
         except Exception as e: await event.reply(f"❌ 同步失敗: {e}")
 
@@ -195,21 +312,37 @@ class CommandHandler:
         await event.reply(message)
 
     async def list_members(self, event):
+        """分頁列出控制群組成員 (`next` / `prev` 翻頁，`refresh` 重新載入)，資料來自成員快照，不必每次掃描整個群組"""
         if not self.config.control_group: await event.reply("❌ 未設定控制群組。"); return
-        await event.reply("⏳ 正在獲取群組成員列表...")
+        arg = event.pattern_match.group(1)
+        key = (event.chat_id, event.sender_id, 'list_members')
+        position = self._page_start(key, arg)
+        if position is None:
+            await event.reply("📄 沒有更多頁了。使用 `/list_members` 從第一頁開始。"); return
+        start, page = position
+        cache = self.bot_instance.participant_cache
         try:
-            group = await self.client.get_entity(self.config.control_group)
-            message = f"👥 **'{group.title}' 群組成員:**\n\n"
-            count = 0
-            async for member in self.client.iter_participants(group):
-                count += 1
-                admin_marker = "👑 (機器人管理員)" if self.config.is_admin(member.id) else ""
-                name = member.first_name or "N/A"
-                username_str = f"(@{member.username})" if member.username else ""
-                message += f"• {name} {username_str} {admin_marker}\n  ID: `{member.id}`\n"
-            message += f"\n總計: {count} 位成員。"
-            await event.reply(message, parse_mode='md')
-        except Exception as e: await event.reply(f"❌ 獲取成員列表失敗: {e}")
+            snapshot = cache.get(self.config.control_group, force=(arg == 'refresh'))
+            # 只等待載入到本頁為止 (多一位用來判斷是否還有下一頁)
+            await snapshot.wait_for(start + self.PAGE_SIZE + 1)
+            if snapshot.error and not len(snapshot):
+                raise snapshot.error
+            group = await self.entity_cache.resolve(self.config.control_group)
+        except Exception as e: await event.reply(f"❌ 獲取成員列表失敗: {e}"); return
+
+        if not snapshot.complete:
+            status = f"已載入 {len(snapshot)} 位，仍在載入中"
+        else:
+            status = f"共 {len(snapshot)} 位" + ("，背景更新中" if cache.is_loading(self.config.control_group) else "")
+        if snapshot.error:
+            status += f"，⚠️ 載入未完成: {snapshot.error}"
+        lines = (
+            f"{i}. {name} {f'(@{username})' if username else ''} {'👑 (機器人管理員)' if self.config.is_admin(user_id) else ''}\n"
+            f"   ID: `{user_id}`"
+            for i, (user_id, name, username) in enumerate(snapshot.iter_from(start), start + 1)
+        )
+        title = f"👥 **'{group.title}' 群組成員** (第 {page} 頁，{status}):"
+        await event.reply(self._page_message(key, title, lines, '/list_members'), parse_mode='md')
 
     async def list_campaigns(self, event):
         campaigns = self.message_manager.list_campaigns()
@@ -232,7 +365,7 @@ class CommandHandler:
             await event.reply("❌ 請提供要預覽的活動名稱。例如: `/preview campaign_A`")
             return
 
-        content = self.message_manager.load_campaign_content(campaign_name)
+        content = await asyncio.to_thread(self.message_manager.load_campaign_content, campaign_name)
         
         if not content["text"] and not content["photo"] and not content["video"] and not content["gif"]:
             await event.reply(f"❌ 活動 `{campaign_name}` 中沒有可預覽的內容 (文字、圖片、影片或GIF)。")
@@ -241,39 +374,121 @@ class CommandHandler:
         message = f"📄 **預覽活動: `{campaign_name}`**\n\n---\n\n"
         if content["text"]:
             message += f"**文字內容:**\n{content['text']}\n\n"
-        if content["photo"]:
-            message += f"**圖片:** `{content['photo']}`\n"
-        if content["video"]:
-            message += f"**影片:** `{content['video']}`\n"
-        if content["gif"]:
-            message += f"**GIF:** `{content['gif']}`\n"
+        if len(content["media"]) > 1:
+            message += f"**相簿 ({len(content['media'])} 個媒體):**\n"
+            message += "".join(f" - `{path}`\n" for path in content["media"])
+        else:
+            if content["photo"]:
+                message += f"**圖片:** `{content['photo']}`\n"
+            if content["video"]:
+                message += f"**影片:** `{content['video']}`\n"
+            if content["gif"]:
+                message += f"**GIF:** `{content['gif']}`\n"
         
         await event.reply(message)
 
     async def test_campaign_broadcast(self, event):
-        campaign_name = event.pattern_match.group(1)
-        if not campaign_name:
-            await event.reply("❌ 請提供要測試廣播的活動名稱。例如: `/test campaign_A`")
+        if not event.pattern_match.group(1):
+            await event.reply("❌ 請提供要測試廣播的活動名稱。例如: `/test campaign_A` 或 `/test campaign_A -> tag:vip`")
+            return
+        try:
+            campaign_name, target = self._split_target(event.pattern_match.group(1))
+        except ValueError as e:
+            await event.reply(f"❌ {e}")
             return
 
         # 檢查活動是否存在
-        if campaign_name not in self.message_manager.list_campaigns():
+        if not self.message_manager.has_campaign(campaign_name):
             await event.reply(f"❌ 找不到活動 `{campaign_name}`。請使用 `/campaigns` 查看可用活動。")
             return
 
-        await event.reply(f"🧪 正在測試廣播活動 `{campaign_name}`...")
+        await event.reply(f"🧪 正在測試廣播活動 `{campaign_name}` → {self._describe_target(target)}...")
         
         # 載入活動內容
-        content = self.message_manager.load_campaign_content(campaign_name)
+        content = await asyncio.to_thread(self.message_manager.load_campaign_content, campaign_name)
         
         # 執行廣播
-        success_count, total_count = await self.broadcast_manager.send_campaign_broadcast(content, campaign_name)
+        # 手動測試以緊急優先度送出，與排程廣播同時進行時會插隊先發送
+        success_count, total_count = await self.broadcast_manager.send_campaign_broadcast(
+            content, campaign_name, target=target, priority=PRIORITY_URGENT
+        )
         
         if success_count > 0:
             await event.reply(f"✅ 測試廣播完成！成功發送 {success_count}/{total_count} 個。")
         else:
             await event.reply(f"❌ 測試廣播失敗。請檢查日誌。")
 
+    # /simulate 可暫時調整的發送參數：名稱 -> (設定鍵, 轉換函式)
+    SIMULATE_OPTIONS = {
+        'delay': ('rate', lambda v: 1 / float(v) if float(v) > 0 else 0.0),
+        'rate': ('rate', float),
+        'burst': ('burst', int),
+        'concurrency': ('concurrency', lambda v: max(1, int(v))),
+        'retries': ('max_retries', lambda v: max(1, int(v))),
+        'flood': ('max_flood_wait', float),
+    }
+    SIMULATE_OPTION_RE = re.compile(r'(?:^|\s)(\w+)=(\S+)')
+
+    async def simulate_campaign(self, event):
+        """模擬廣播而不發送，以歷史發送記錄預估耗時、flood-wait 與上傳量；可加上 delay=3 等參數比較不同的發送節奏"""
+        args = event.pattern_match.group(1) or ''
+        overrides = {}
+        try:
+            for name, value in self.SIMULATE_OPTION_RE.findall(args):
+                if name not in self.SIMULATE_OPTIONS:
+                    raise ValueError(f"未知的參數 `{name}` (可用: {', '.join(self.SIMULATE_OPTIONS)})")
+                key, convert = self.SIMULATE_OPTIONS[name]
+                overrides[key] = convert(value)
+            campaign_name, target = self._split_target(self.SIMULATE_OPTION_RE.sub('', args))
+        except ValueError as e:
+            await event.reply(f"❌ {e}")
+            return
+        if not campaign_name:
+            await event.reply("❌ 請提供要模擬的活動名稱。例如: `/simulate campaign_A`、`/simulate campaign_A -> tag:vip delay=3`")
+            return
+        if not self.message_manager.has_campaign(campaign_name):
+            await event.reply(f"❌ 找不到活動 `{campaign_name}`。請使用 `/campaigns` 查看可用活動。")
+            return
+
+        content = await asyncio.to_thread(self.message_manager.load_campaign_content, campaign_name)
+        report = await self.broadcast_manager.simulate_broadcast(content, campaign_name, target=target, overrides=overrides)
+        if report['targets'] is None:
+            await event.reply(f"❌ 活動 `{campaign_name}` 中沒有可發送的內容 (文字、圖片、影片或GIF)。")
+        elif not report['targets']:
+            await event.reply(f"❌ 沒有符合 {self._describe_target(target)} 的目標。")
+        else:
+            await event.reply(format_simulation(report))
+
+    async def optimize_campaign(self, event):
+        """前處理活動中的圖片與影片 (未指定活動時處理全部)，之後的廣播改為發送處理後的檔案。"""
+        processor = self.message_manager.processor
+        if processor is None:
+            await event.reply("❌ 未啟用媒體前處理。")
+            return
+        tools = processor.available()
+        if not any(tools.values()):
+            await event.reply("❌ 未安裝 Pillow 也找不到 ffmpeg，無法進行媒體前處理。")
+            return
+        campaign_name = (event.pattern_match.group(1) or '').strip()
+        if campaign_name and not self.message_manager.has_campaign(campaign_name):
+            await event.reply(f"❌ 找不到活動 `{campaign_name}`。請使用 `/campaigns` 查看可用活動。")
+            return
+        campaigns = [campaign_name] if campaign_name else self.message_manager.list_campaigns()
+
+        await event.reply(f"🪄 正在前處理 {len(campaigns)} 個活動的媒體...")
+        lines = []
+        for name in campaigns:
+            # 圖片縮放與影片轉檔在行程池中執行，不阻塞事件循環
+            stats = await asyncio.to_thread(processor.optimize_campaign,
+                                            os.path.join(self.message_manager.CONTENT_DB_PATH, name))
+            self.message_manager.invalidate(name)
+            lines.append(f"- {format_stats(name, stats)}")
+        if not tools['photo']:
+            lines.append("⚠️ 未安裝 Pillow，已略過圖片。")
+        if not tools['video']:
+            lines.append("⚠️ 找不到 ffmpeg/ffprobe，已略過影片。")
+        await event.reply("🪄 **媒體前處理完成**\n\n" + "\n".join(lines))
+
     async def show_schedule(self, event):
         status = "✅ 啟用" if self.config.enabled else "⏸️ 停用"
         msg = f"📅 **排程資訊**\n\n🔄 狀態: **{status}**\n"
@@ -318,31 +533,51 @@ class CommandHandler:
                 msg += f"⏱️ **倒數:** {hours} 小時 {minutes} 分鐘"
             else:
                 msg += "\n\n⚠️ 無法計算下一個廣播時間。"
+
+        # 最近一次排程執行的觸發延遲、首發延遲與耗時
+        if self.scheduler.recent_runs:
+            run = self.scheduler.recent_runs[-1]
+            status_str = run['error'] and f"❌ {run['error']}" or run['result'] or "執行中"
+            target = f", 目標: `{run['target']}`" if run.get('target') else ""
+            msg += f"\n\n🕘 **上次排程執行:** {run['fired_at'][:19]} (活動: `{run['campaign']}`{target})\n"
+            msg += f"  觸發延遲: {run['fire_delay']}s | 首發延遲: {run['first_send_latency']}s | 耗時: {run['duration']}s\n"
+            msg += f"  結果: {status_str}"
         await event.reply(msg)
 
     async def list_groups(self, event):
+        """分頁列出廣播目標 (`/list_groups next` / `prev` 翻頁)，只查詢本頁中名稱未知的群組"""
         if not self.config.target_groups:
             await event.reply("📋 無廣播目標。"); return
-            
-        # 嘗試更新群組名稱
+        key = (event.chat_id, event.sender_id, 'list_groups')
+        position = self._page_start(key, event.pattern_match.group(1))
+        if position is None:
+            await event.reply("📋 沒有更多頁了。使用 `/list_groups` 從第一頁開始。"); return
+        start, page = position
+        groups = self.config.target_groups[start:start + self.PAGE_SIZE + 1]
+
+        # 嘗試更新本頁群組的名稱 (一次批次查詢所有名稱未知的群組)
         updated = False
-        for group in self.config.target_groups:
-            if group['title'].startswith('頻道/群組 ') or group['title'].startswith('ID '):
-                try:
-                    entity = await self.client.get_entity(group['id'])
-                    if hasattr(entity, 'title'):
-                        group['title'] = entity.title
-                        updated = True
-                except Exception as e:
-                    print(f"無法更新群組 {group['id']} 的名稱: {e}")
+        unnamed = [g for g in groups if g['title'].startswith('頻道/群組 ') or g['title'].startswith('ID ')]
+        if unnamed:
+            resolved, errors = await self.entity_cache.resolve_many([g['id'] for g in unnamed])
+            for group in unnamed:
+                entity = resolved.get(group['id'])
+                if entity is not None and getattr(entity, 'title', None):
+                    group['title'] = entity.title
+                    updated = True
+                elif group['id'] in errors:
+                    logging.warning(f"⚠️ 無法更新群組 {group['id']} 的名稱: {errors[group['id']]}",
+                                    extra={'group_id': group['id']})
         
         if updated:
             self.config.save_settings()
             
-        message = "📋 廣播目標列表:\n\n" + "\n".join([
-            f"{i}. {g['title']}\n   ID: `{g['id']}`\n" for i, g in enumerate(self.config.target_groups, 1)
-        ])
-        await event.reply(message)
+        lines = (
+            f"{i}. {g['title']}\n   ID: `{g['id']}`" + (f" 標籤: {', '.join(g['tags'])}" if g.get('tags') else "") + "\n"
+            for i, g in enumerate(groups, start + 1)
+        )
+        title = f"📋 廣播目標列表 (第 {page} 頁，共 {len(self.config.target_groups)} 個):"
+        await event.reply(self._page_message(key, title, lines, '/list_groups'))
 
     async def remove_group(self, event):
         try:
@@ -353,14 +588,108 @@ class CommandHandler:
             else: await event.reply("❌ 無效編號。")
         except ValueError: await event.reply("❌ 請輸入數字。")
 
+
+    def _parse_group_ids(self, text: str) -> tuple[list, list]:
+        """解析逗號/空白分隔的群組 ID，回傳 (目標中的 ID, 不在目標中的輸入)。"""
+        found, unknown = [], []
+        for part in text.replace(',', ' ').split():
+            try:
+                group_id = int(part)
+            except ValueError:
+                unknown.append(part)
+                continue
+            (found if group_id in self.config.target_index.by_id else unknown).append(group_id)
+        return found, unknown
+
+    async def tag_groups(self, event):
+        """為廣播目標加上標籤：/tag <標籤> <ID1,ID2,...>"""
+        try:
+            tag = normalize_tag(event.pattern_match.group(1))
+        except ValueError as e:
+            await event.reply(f"❌ {e}"); return
+        group_ids, unknown = self._parse_group_ids(event.pattern_match.group(2))
+        tagged = 0
+        for group_id in group_ids:
+            group = self.config.target_index.by_id[group_id]
+            if tag not in group.setdefault('tags', []):
+                group['tags'].append(tag)
+                tagged += 1
+        if tagged:
+            self.config.save_settings()
+        msg = f"🏷️ 已為 {tagged} 個目標加上標籤 `{tag}` (共 {self.config.target_index.count(f'tag:{tag}')} 個)。"
+        if unknown:
+            msg += f"\n⚠️ 不在廣播目標中: {', '.join(map(str, unknown))}"
+        await event.reply(msg)
+
+    async def untag_groups(self, event):
+        """移除廣播目標的標籤：/untag <標籤> <ID1,ID2,...|all>"""
+        try:
+            tag = normalize_tag(event.pattern_match.group(1))
+        except ValueError as e:
+            await event.reply(f"❌ {e}"); return
+        if event.pattern_match.group(2).strip().lower() == 'all':
+            group_ids, unknown = list(self.config.target_index.by_tag.get(tag, ())), []
+        else:
+            group_ids, unknown = self._parse_group_ids(event.pattern_match.group(2))
+        removed = 0
+        for group_id in group_ids:
+            tags = self.config.target_index.by_id[group_id].get('tags', [])
+            if tag in tags:
+                tags.remove(tag)
+                removed += 1
+        if removed:
+            self.config.save_settings()
+        msg = f"🏷️ 已從 {removed} 個目標移除標籤 `{tag}`。"
+        if unknown:
+            msg += f"\n⚠️ 不在廣播目標中: {', '.join(map(str, unknown))}"
+        await event.reply(msg)
+
+    async def list_tags(self, event):
+        """列出所有標籤與群組數；/tags <選擇器> 預覽選擇器會選到的目標"""
+        selector = event.pattern_match.group(1)
+        index = self.config.target_index
+        if selector:
+            try:
+                groups = index.select(selector)
+            except ValueError as e:
+                await event.reply(f"❌ {e}"); return
+            lines = [f"🎯 `{selector}` 符合 {len(groups)} 個目標:\n"]
+            lines += [f"• {g['title']} (`{g['id']}`)" for g in groups[:50]]
+            if len(groups) > 50:
+                lines.append(f"... 以及其他 {len(groups) - 50} 個")
+            await event.reply("\n".join(lines))
+            return
+        tags = index.tags()
+        if not tags:
+            await event.reply("🏷️ 目前沒有任何標籤。使用 `/tag <標籤> <ID1,ID2,...>` 為目標加上標籤。")
+            return
+        lines = ["🏷️ **目標標籤**\n"] + [f"• `tag:{tag}`: {count} 個群組" for tag, count in tags.items()]
+        lines.append("\n💡 排程與測試可指定目標，例如 `/add_schedule 10:00 活動A -> tag:vip`")
+        await event.reply("\n".join(lines))
     async def my_groups(self, event):
-        await event.reply("⏳ 正在掃描群組..."); groups = [f"• {d.title}\n  ID: `{d.id}`" async for d in self.client.iter_dialogs() if d.is_group or d.is_channel]
-        response = "您所在的群組/頻道:\n\n" + "\n".join(groups) if groups else "找不到群組。"
+        dialog_index = self.bot_instance.dialog_index
+        if dialog_index.built_at is None:
+            await event.reply("⏳ 第一次使用，正在建立群組索引...")
+            await dialog_index.build()
+        items, page, pages = dialog_index.page(int(event.pattern_match.group(1) or 1))
+        groups = [f"• {d['title']}{'' if d['can_post'] else ' 🚫'}\n  ID: `{d['id']}`" for d in items]
+        if not groups:
+            await event.reply("找不到群組。")
+            return
+        response = f"您所在的群組/頻道 (第 {page}/{pages} 頁):\n\n" + "\n".join(groups)
+        if page < pages:
+            response += f"\n\n下一頁: `/my_groups {page + 1}`"
         await event.reply(response)
 
+    async def refresh_dialogs(self, event):
+        """完整重新掃描對話列表，重建群組索引。"""
+        await event.reply("⏳ 正在重新掃描所有對話...")
+        count = await self.bot_instance.dialog_index.build(force=True)
+        await event.reply(f"✅ 群組索引已更新，共 {count} 個群組/頻道。")
+
     async def add_by_id(self, event):
         try:
-            group_id = int(event.pattern_match.group(1)); entity = await self.client.get_entity(group_id)
+            group_id = int(event.pattern_match.group(1)); entity = await self.entity_cache.resolve(group_id)
             chat_info = {'id': entity.id, 'title': getattr(entity, 'title', f'ID {entity.id}'), 'type': 'group'}
             if not any(g['id'] == chat_info['id'] for g in self.config.target_groups):
                 self.config.target_groups.append(chat_info); self.config.save_settings()
@@ -369,12 +698,40 @@ class CommandHandler:
         except Exception as e: await event.reply(f"❌ 新增失敗: {e}")
 
     async def show_history(self, event):
+        """
+        /history: 最近 10 次廣播
+        /history <活動名稱>: 指定活動的廣播
+        /history days <N>: 最近 N 天的廣播
+        /history group <群組ID>: 指定群組的逐次發送結果
+        """
+        store = self.broadcast_manager.history_store
+        args = (event.pattern_match.group(1) or '').split()
         try:
-            with open('broadcast_history.json', 'r', encoding='utf-8') as f: history = json.load(f)
-            if not history: await event.reply("📊 無廣播歷史。"); return
-            msg = "📊 **最近10次廣播歷史:**\n\n" + "\n".join([f"• **{r['time']}** ({'定時' if r.get('scheduled') else '手動'})\n  結果: {r['success_count']}/{r['total_count']} ({r['success_rate']})\n" for r in reversed(history[-10:])])
-            await event.reply(msg)
-        except FileNotFoundError: await event.reply("📊 找不到歷史檔案。")
+            if len(args) == 2 and args[0] == 'group':
+                sends = await asyncio.to_thread(store.group_sends, int(args[1]), limit=10)
+                if not sends: await event.reply(f"📊 群組 `{args[1]}` 沒有發送記錄。"); return
+                lines = []
+                for s in sends:
+                    error_str = f" ({s['error_class']})" if s['error_class'] else ""
+                    latency_str = f", {s['latency_ms']:.0f}ms" if s['latency_ms'] is not None else ""
+                    lines.append(f"• **{s['time']}** `{s['campaign']}`: {s['outcome']}{error_str}, 嘗試 {s['attempts']} 次{latency_str}")
+                msg = f"📊 **群組 `{args[1]}` 最近{len(sends)}次發送:**\n\n" + "\n".join(lines)
+                await event.reply(msg); return
+            if len(args) == 2 and args[0] == 'days':
+                title = f"最近{int(args[1])}天"
+                history = await asyncio.to_thread(store.query, since=(datetime.now() - timedelta(days=int(args[1]))).timestamp(),
+                                                  limit=50)
+            elif args:
+                title = f"活動 `{' '.join(args)}`"
+                history = await asyncio.to_thread(store.query, campaign=' '.join(args), limit=10)
+            else:
+                title = "最近10次"
+                history = await asyncio.to_thread(store.recent, 10)
+        except ValueError:
+            await event.reply("❌ 用法: `/history`、`/history <活動名稱>`、`/history days <N>`、`/history group <群組ID>`"); return
+        if not history: await event.reply("📊 無廣播歷史。"); return
+        msg = f"📊 **{title}廣播歷史:**\n\n" + "\n".join([f"• **{r['time']}** ({'定時' if r.get('scheduled') else '手動'}) `{r['campaign']}`\n  結果: {r['success_count']}/{r['total_count']} ({r['success_rate']})\n" for r in history])
+        await event.reply(msg)
 
     async def enable_broadcast(self, event):
         if not self.config.schedules: await event.reply("❌ 請先用 `/add_schedule` 新增排程。"); return
@@ -386,16 +743,20 @@ class CommandHandler:
         await event.reply("⏸️ 所有排程已停用。")
 
     async def add_schedule(self, event):
-        match = re.match(r'/add_schedule (\d{2}:\d{2}) (.+)', event.raw_text)
+        match = event.pattern_match
         if not match:
-            await event.reply("❌ 用法錯誤。請使用 `/add_schedule HH:MM <活動名稱>`")
+            await event.reply("❌ 用法錯誤。請使用 `/add_schedule HH:MM <活動名稱> [-> 目標選擇器]`")
             return
         
         time_str = match.group(1)
-        campaign_name = match.group(2).strip()
+        try:
+            campaign_name, target = self._split_target(match.group(2))
+        except ValueError as e:
+            await event.reply(f"❌ {e}")
+            return
 
         # 檢查活動是否存在
-        if campaign_name not in self.message_manager.list_campaigns():
+        if not self.message_manager.has_campaign(campaign_name):
             await event.reply(f"❌ 找不到活動 `{campaign_name}`。請使用 `/campaigns` 查看可用活動。")
             return
 
@@ -408,28 +769,38 @@ class CommandHandler:
 
         # 檢查是否已存在相同的時間和活動組合
         for s in self.config.schedules:
-            if s['time'] == time_str and s['campaign'] == campaign_name:
+            if s['time'] == time_str and s['campaign'] == campaign_name and s.get('target') == target:
                 await event.reply(f"ℹ️ 排程 `{time_str}` 執行活動 `{campaign_name}` 已存在。")
                 return
 
-        self.config.schedules.append({'time': time_str, 'campaign': campaign_name})
+        schedule = {'time': time_str, 'campaign': campaign_name}
+        if target:
+            schedule['target'] = target
+        self.config.schedules.append(schedule)
         self.config.schedules.sort(key=lambda x: x['time']) # 依時間排序
         self.config.save_broadcast_config(is_startup=False)
         self.scheduler.setup_schedule() # 重新設定排程
 
-        await event.reply(f"✅ 已新增排程: `{time_str}` 執行活動 `{campaign_name}`。")
+        await event.reply(f"✅ 已新增排程: `{time_str}` 執行活動 `{campaign_name}` → {self._describe_target(target)}。")
 
     async def remove_schedule(self, event):
-        match = re.match(r'/remove_schedule (\d{2}:\d{2}) (.+)', event.raw_text)
+        match = event.pattern_match
         if not match:
             await event.reply("❌ 用法錯誤。請使用 `/remove_schedule HH:MM <活動名稱>`")
             return
         
         time_str = match.group(1)
-        campaign_name = match.group(2).strip()
+        try:
+            campaign_name, target = self._split_target(match.group(2))
+        except ValueError as e:
+            await event.reply(f"❌ {e}")
+            return
 
+        # 未指定目標選擇器時移除該時間與活動的所有排程
         original_len = len(self.config.schedules)
-        self.config.schedules = [s for s in self.config.schedules if not (s['time'] == time_str and s['campaign'] == campaign_name)]
+        self.config.schedules = [s for s in self.config.schedules
+                                 if not (s['time'] == time_str and s['campaign'] == campaign_name
+                                         and (target is None or s.get('target') == target))]
         
         if len(self.config.schedules) < original_len:
             self.config.save_broadcast_config(is_startup=False)
@@ -445,23 +816,177 @@ class CommandHandler:
         
         message = "⏰ **目前排程列表:**\n\n"
         for i, s in enumerate(self.config.schedules, 1):
-            message += f"{i}. 時間: `{s['time']}`, 活動: `{s['campaign']}`\n"
+            message += f"{i}. 時間: `{s['time']}`, 活動: `{s['campaign']}`, 目標: {self._describe_target(s.get('target'))}\n"
         
-        message += "\n💡 使用 `/add_schedule HH:MM <活動名稱>` 新增排程。\n"
+        message += "\n💡 使用 `/add_schedule HH:MM <活動名稱> [-> tag:標籤]` 新增排程。\n"
         message += "💡 使用 `/remove_schedule HH:MM <活動名稱>` 移除排程。"
         await event.reply(message)
 
     async def show_status(self, event):
         me = await self.client.get_me()
-        await event.reply(f"""📊 **狀態報告**\n👤 用戶: {me.first_name}\n- 目標: {len(self.config.target_groups)} 個\n- 排程: {len(self.config.schedules)} 個\n- 狀態: {'啟用' if self.config.enabled else '停用'}盡""")
+        await event.reply(f"""📊 **狀態報告**\n👤 用戶: {me.first_name}\n- 目標: {len(self.config.target_groups)} 個\n- 排程: {len(self.config.schedules)} 個\n- 狀態: {'啟用' if self.config.enabled else '停用'}盡\n\n{self.bot_instance.startup.summary()}""")
+
+    async def show_accounts(self, event):
+        """顯示多帳號連線池中各帳號的狀態與發送統計"""
+        pool = self.broadcast_manager.pool
+        lines = [f"👥 **發送帳號** ({len(pool.active_sessions())}/{len(pool.sessions)} 個可用)\n"]
+        for i, s in enumerate(pool.sessions, 1):
+            user = f"{s.me.first_name} (@{s.me.username or 'N/A'})" if s.me else "-"
+            lines.append(f"{i}. `{s.name}` {user}\n   {s.status_text()} | 成功: {s.sends} | 失敗: {s.failures}")
+            if s.last_error:
+                lines.append(f"   最後錯誤: {s.last_error}")
+        await event.reply("\n".join(lines))
+
+    async def show_queue(self, event):
+        """顯示分派器中進行中與等待中的廣播：優先度、剩餘目標、截止時間與預計開始/完成時間"""
+        dispatcher = self.broadcast_manager.dispatcher
+        rows = dispatcher.queue_status()
+        if not rows:
+            await event.reply("📭 目前沒有進行中的廣播。")
+            return
+        rate = dispatcher.rate()
+        lines = [f"📬 **廣播分派佇列** (速率: {f'{rate:.2f} 個/秒' if rate else '未知'})\n"]
+        for i, row in enumerate(rows, 1):
+            state = "發送中" if row['started'] else "等待中"
+            lines.append(f"{i}. #{row['job_id']} `{row['campaign']}` [{PRIORITY_NAMES.get(row['priority'], row['priority'])}] "
+                         f"{state}，剩餘 {row['remaining']}/{row['total']}")
+            if row['eta']:
+                lines.append(f"   預計: {dispatcher.format_eta(row['eta'])}")
+            if row['deadline']:
+                deadline = datetime.fromtimestamp(row['deadline']).strftime('%H:%M:%S')
+                lines.append(f"   截止: {deadline}{' ⚠️ 可能來不及完成' if row['late'] else ''}")
+        await event.reply("\n".join(lines))
+
+    async def show_workers(self, event):
+        """協調者模式下顯示 worker 行程的心跳與發送統計"""
+        job_queue = self.broadcast_manager.job_queue
+        if not self.broadcast_manager.use_workers:
+            await event.reply("ℹ️ 目前為本機發送模式 (BROADCAST_MODE=local)，沒有 worker 行程。")
+            return
+        workers = await asyncio.to_thread(job_queue.workers)
+        pending = await asyncio.to_thread(job_queue.pending_count)
+        now = time.time()
+        lines = [f"🛠️ **Worker 狀態** (佇列中待發送: {pending})\n"]
+        for w in workers:
+            age = now - (w['heartbeat_at'] or 0)
+            status = "✅ 在線" if age < self.broadcast_manager.WORKER_STALE_AFTER else f"💤 離線 ({age:.0f}s 前)"
+            lines.append(f"- `{w['name']}` {status}\n  成功: {w['sent']} | 失敗: {w['failed']}")
+        if not workers:
+            lines.append("尚無 worker 註冊。請執行 `python worker.py --session <名稱>`。")
+        await event.reply("\n".join(lines))
+
+    async def backup_now(self, event):
+        """立即建立設定檔與資料庫的備份快照 (只保存有變更的檔案)"""
+        snapshot = await self.bot_instance.backup_manager.snapshot()
+        if snapshot is None:
+            await event.reply("ℹ️ 設定檔與資料庫自上次備份後沒有變更，不需建立新快照。")
+            return
+        await event.reply(f"💾 已建立備份快照 `{snapshot['id']}`\n變更的檔案: {', '.join(snapshot['changed'])}")
+
+    async def restore_backup(self, event):
+        """列出備份快照，或從指定快照還原設定檔與資料庫 (/restore <快照ID> [檔名...])"""
+        backup_manager = self.bot_instance.backup_manager
+        snapshot_id, files = event.pattern_match.group(1), event.pattern_match.group(2)
+        if not snapshot_id:
+            snapshots = await asyncio.to_thread(backup_manager.find_all)
+            if not snapshots:
+                await event.reply("ℹ️ 目前沒有任何備份快照。")
+                return
+            lines = ["💾 **最近的備份快照**\n"]
+            for s in snapshots[:10]:
+                lines.append(f"• `{s['id']}` ({s['created'].replace('T', ' ')}) 變更: {', '.join(s['changed'])}")
+            lines.append("\n使用 `/restore <快照ID> [檔名...]` 還原 (還原前會先備份目前的設定)。")
+            await event.reply("\n".join(lines))
+            return
+        snapshot = await asyncio.to_thread(backup_manager.find, snapshot_id)
+        if snapshot is None:
+            await event.reply(f"❌ 找不到快照 `{snapshot_id}` (或符合的快照不只一個)，請使用 `/restore` 查看列表。")
+            return
+        names = files.replace(',', ' ').split() if files else None
+        unknown = [n for n in names or [] if n not in snapshot['files']]
+        if unknown:
+            await event.reply(f"❌ 快照 `{snapshot['id']}` 中沒有: {', '.join(unknown)}")
+            return
+        # 廣播進行中 (或有尚未完成的工作) 時不還原資料庫：回復 job_items 會讓續傳重新發送已送達的目標
+        databases = [n for n in names or snapshot['files']
+                     if is_sqlite(n) or n in (self.config.database_path, self.config.job_queue_path)]
+        skipped = []
+        if databases and (self.broadcast_manager.dispatcher.jobs
+                          or await asyncio.to_thread(self.broadcast_manager.job_queue.unfinished_jobs)):
+            if names:
+                await event.reply(f"❌ 目前有進行中或尚未完成的廣播，無法還原資料庫: {', '.join(databases)}\n"
+                                  "請等廣播完成後再試，或只還原設定檔。")
+                return
+            skipped = databases
+            names = [n for n in snapshot['files'] if n not in databases]
+            if not names:
+                await event.reply("❌ 目前有進行中或尚未完成的廣播，快照中只有資料庫，請等廣播完成後再試。")
+                return
+        try:
+            restored = await backup_manager.restore(snapshot, names)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            await event.reply(f"❌ 還原失敗: {e}")
+            return
+        self.config.reload()
+        self.scheduler.setup_schedule()
+        skipped_text = f"\n⚠️ 廣播進行中，未還原資料庫: {', '.join(skipped)}" if skipped else ""
+        await event.reply(f"♻️ 已從快照 `{snapshot['id']}` 還原: {', '.join(restored)}\n設定與排程已重新載入。{skipped_text}")
+
+    async def show_metrics(self, event):
+        """摘要本行程的發送與排程指標"""
+        def ms(seconds):
+            return f"{seconds * 1000:.0f}ms" if seconds is not None else "-"
+
+        def secs(seconds):
+            return f"{seconds:.1f}s" if seconds is not None else "-"
+
+        outcomes = {}
+        errors = {}
+        for (outcome, error_class), value in metrics.SEND_ATTEMPTS.items():
+            outcomes[outcome] = outcomes.get(outcome, 0) + value
+            if error_class:
+                errors[error_class] = errors.get(error_class, 0) + value
+        latency = metrics.SEND_LATENCY
+        upload = metrics.UPLOAD_SECONDS
+        fire = metrics.SCHEDULE_FIRE_DELAY
+        flood = {kind: value for (kind,), value in metrics.FLOOD_WAIT_SECONDS.items()}
+        lines = [
+            "📈 **效能指標** (自啟動以來)\n",
+            f"📤 發送嘗試: {int(sum(outcomes.values()))} (" +
+            ", ".join(f"{k} {int(v)}" for k, v in sorted(outcomes.items())) + ")" if outcomes else "📤 發送嘗試: 0",
+            f"⚠️ 錯誤類別: " + (", ".join(f"{k} {int(v)}" for k, v in sorted(errors.items())) or "無"),
+            f"⏱️ 發送延遲: p50 {ms(latency.quantile(0.5))} / p95 {ms(latency.quantile(0.95))} / p99 {ms(latency.quantile(0.99))}",
+            f"⬆️ 上傳: {upload.count()} 次, {metrics.UPLOAD_BYTES.total() / 1024 / 1024:.1f} MB, "
+            f"平均 {secs(upload.mean())}, p95 {secs(upload.quantile(0.95))}",
+            f"⏳ flood-wait: " + (", ".join(f"{k} {int(v)}s" for k, v in sorted(flood.items())) or "無"),
+            f"⏰ 排程觸發延遲: {fire.count()} 次, p50 {ms(fire.quantile(0.5))} / p99 {ms(fire.quantile(0.99))}",
+            f"📦 佇列深度: {int(metrics.SEND_QUEUE_DEPTH.value())} | 發送中: {int(metrics.SENDS_IN_FLIGHT.value())}",
+            f"📊 完成廣播: {int(metrics.BROADCASTS.total())}",
+        ]
+        if self.config.metrics_port:
+            lines.append(f"\n🔗 Prometheus: `http://{self.config.metrics_host}:{self.config.metrics_port}/metrics`")
+        await event.reply("\n".join(lines))
+
+    # /info 中最多列出的廣播目標與排程數，完整列表以 /list_groups、/list_schedules 查看
+    INFO_PREVIEW = 10
 
     async def show_info(self, event):
-        """顯示所有設定資訊"""
+        """顯示所有設定資訊 (目標與排程只列出前幾項，訊息長度不隨目標數增加)"""
         # 廣播目標
-        target_groups_str = "\n".join([f"- `{g['title']}` (`{g['id']}`)" for g in self.config.target_groups]) or "未設定"
+        targets = self.config.target_groups
+        target_groups_str = "\n".join([f"- `{g['title']}` (`{g['id']}`)" for g in targets[:self.INFO_PREVIEW]]) or "未設定"
+        if len(targets) > self.INFO_PREVIEW:
+            target_groups_str += f"\n… 共 {len(targets)} 個，使用 `/list_groups` 分頁查看全部"
+        tags = self.config.target_index.tags()
+        if tags:
+            target_groups_str += "\n標籤: " + ", ".join(f"`{tag}` {count}" for tag, count in itertools.islice(tags.items(), self.INFO_PREVIEW))
         
         # 廣播排程
-        schedules_str = "\n".join([f"- `{s['time']}` (活動: `{s['campaign']}`)" for s in self.config.schedules]) or "未設定"
+        schedules = self.config.schedules
+        schedules_str = "\n".join([f"- `{s['time']}` (活動: `{s['campaign']}`{f', 目標: `{t}`' if (t := s.get('target')) else ''})"
+                                   for s in schedules[:self.INFO_PREVIEW]]) or "未設定"
+        if len(schedules) > self.INFO_PREVIEW:
+            schedules_str += f"\n… 共 {len(schedules)} 個，使用 `/list_schedules` 查看全部"
         
         # 排程狀態
         schedule_status = "✅ 啟用" if self.config.enabled else "⏸️ 停用"
@@ -470,4 +995,4 @@ class CommandHandler:
         await event.reply(info_message)
 
     async def show_help(self, event):
-        await event.reply("""🤖 **指令說明**\n\n**👑 管理與成員**\n- `/list_admins`: 列出機器人管理員\n- `/add_admin <ID/@用戶名>`: 新增機器人管理員\n- `/remove_admin <ID/@用戶名>`: 移除機器人管理員\n- `/sync_admins`: **從控制群組同步管理員**\n- `/list_members`: 列出控制群組成員\n\n**⏰ 多任務排程**\n- `/add_schedule HH:MM <活動名稱>`: 新增排程\n- `/remove_schedule HH:MM <活動名稱>`: 移除排程\n- `/list_schedules`: 查看排程列表\n- `/enable` / `/disable`: 啟用/停用排程\n- `/schedule`: 查看排程狀態\n\n**🏢 廣播目標**\n- `/add`: 新增目前群組\n- `/add_by_id <ID>`: 透過 ID 新增群組\n- `/add_groups <ID1,ID2,...>`: 批量新增多個群組/頻道（用逗號分隔多個 ID）\n- `/list_groups`: 查看目標列表\n- `/remove <編號>`: 移除目標\n\n**📝 活動與測試**\n- `/campaigns`: 列出所有可用活動\n- `/preview <活動名稱>`: 預覽活動內容\n- `/test <活動名稱>`: 手動測試廣播\n\n**ℹ️ 系統**\n- `/status`: 查看狀態\n- `/history`: 查看歷史\n- `/info`: 顯示所有設定資訊""")
\ No newline at end of file
+        await event.reply("""🤖 **指令說明**\n\n**👑 管理與成員**\n- `/list_admins`: 列出機器人管理員\n- `/add_admin <ID/@用戶名>`: 新增機器人管理員\n- `/remove_admin <ID/@用戶名>`: 移除機器人管理員\n- `/sync_admins`: **從控制群組同步管理員**\n- `/list_members [next|prev|refresh]`: 分頁列出控制群組成員\n\n**⏰ 多任務排程**\n- `/add_schedule HH:MM <活動名稱> [-> tag:標籤]`: 新增排程 (可只發送到指定標籤的目標)\n- `/remove_schedule HH:MM <活動名稱>`: 移除排程\n- `/list_schedules`: 查看排程列表\n- `/enable` / `/disable`: 啟用/停用排程\n- `/schedule`: 查看排程狀態\n\n**🏢 廣播目標**\n- `/add`: 新增目前群組\n- `/add_by_id <ID>`: 透過 ID 新增群組\n- `/add_groups <ID1,ID2,...>`: 批量新增多個群組/頻道（用逗號分隔多個 ID）\n- `/list_groups [next|prev]`: 分頁查看目標列表\n- `/list [頁碼]` / `/my_groups [頁碼]`: 查看所在的群組/頻道\n- `/refresh_dialogs`: 重新掃描所有對話，更新群組索引\n- `/remove <編號>`: 移除目標\n- `/tag <標籤> <ID1,ID2,...>` / `/untag <標籤> <ID...|all>`: 為目標加上/移除標籤\n- `/tags [選擇器]`: 查看標籤，或預覽選擇器符合的目標\n\n**📝 活動與測試**\n- `/campaigns`: 列出所有可用活動\n- `/preview <活動名稱>`: 預覽活動內容\n- `/test <活動名稱> [-> tag:標籤]`: 手動測試廣播\n- `/simulate <活動名稱> [-> tag:標籤] [delay=秒 concurrency=N retries=N]`: 模擬廣播 (不發送)，預估耗時、flood-wait 與上傳量\n- `/optimize [活動名稱]`: 前處理活動的圖片與影片 (縮小、轉為可串流的 MP4)\n\n**ℹ️ 系統**\n- `/status`: 查看狀態\n- `/accounts`: 查看發送帳號狀態\n- `/workers`: 查看 worker 行程狀態\n- `/queue`: 查看進行中的廣播與預計完成時間\n- `/metrics`: 查看發送與排程效能指標\n- `/backup`: 立即備份設定檔與資料庫\n- `/restore [快照ID] [檔名...]`: 列出備份快照或從快照還原設定\n- `/history [活動名稱 | days <N> | group <ID>]`: 查看歷史\n- `/info`: 顯示所有設定資訊""")
\ No newline at end of file
@@ -1,11 +1,31 @@
 import json
+import logging
 import os
 from datetime import datetime
 from dotenv import load_dotenv
 
+from backup_manager import BACKUP_DIR, BACKUP_FILES
+from persistence import JsonWriter, load_json_file
+from target_index import TargetIndex
+
 load_dotenv()
 
-class Config:
+class LoggingConfig:
+    """
+    記錄管線的設定，只讀取環境變數。
+    可在 Config (會讀取設定檔並寫入記錄) 之前建立，讓載入設定期間的記錄也經過同一條記錄管線。
+    """
+    def __init__(self):
+        # 記錄檔 (JSON lines，依大小/時間輪替並以 gzip 壓縮)；主控台與檔案的記錄等級分開設定
+        self.log_file = os.getenv('LOG_FILE', 'bot.log')
+        self.log_console_level = os.getenv('LOG_CONSOLE_LEVEL', 'INFO')
+        self.log_file_level = os.getenv('LOG_FILE_LEVEL', 'INFO')
+        self.log_max_bytes = int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+        self.log_rotate_when = os.getenv('LOG_ROTATE_WHEN', 'midnight')
+        self.log_backup_count = int(os.getenv('LOG_BACKUP_COUNT', '14'))
+
+
+class Config(LoggingConfig):
     """
     集中管理所有設定，包括從環境變數和 JSON 檔案載入。
     """
@@ -13,12 +33,17 @@ class Config:
 
     def __init__(self, client=None):
         self.client = client
+        # 由 JobBot 在建立 client 後設定，用於解析管理員 ID
+        self.entity_cache = None
         # 從 .env 檔案或環境變數讀取 Telegram API 設定
         self.api_id = int(os.getenv('API_ID', 'default_api_id'))
         self.api_hash = os.getenv('API_HASH', 'default_api_hash')
         self.phone = os.getenv('PHONE_NUMBER', 'default_phone')
         self.password = os.getenv('PASSWORD', '')
         self.session_name = os.getenv('SESSION_NAME', 'userbot')
+        # 多帳號發送：以逗號分隔的 session 名稱，第一個 (或 SESSION_NAME) 為主帳號
+        session_names = [s.strip() for s in os.getenv('SESSION_NAMES', '').split(',') if s.strip()]
+        self.session_names = [self.session_name] + [s for s in session_names if s != self.session_name]
 
         # 控制群組設定
         self.control_group = int(os.getenv('CONTROL_GROUP', '0'))
@@ -26,21 +51,86 @@ class Config:
         # 廣播參數設定
         self.broadcast_delay = int(os.getenv('BROADCAST_DELAY', '5'))
         self.max_retries = int(os.getenv('MAX_RETRIES', '3'))
-        
+
+        # 併發廣播設定：同時進行的發送數量，以及令牌桶速率 (每秒發送次數)
+        # BROADCAST_RATE 未設定時沿用 BROADCAST_DELAY 換算出的速率
+        self.broadcast_concurrency = max(1, int(os.getenv('BROADCAST_CONCURRENCY', '5')))
+        default_rate = 1 / self.broadcast_delay if self.broadcast_delay > 0 else 0
+        self.broadcast_rate = float(os.getenv('BROADCAST_RATE', str(default_rate)))
+        self.broadcast_burst = int(os.getenv('BROADCAST_BURST', '1'))
+        self.per_peer_rate = float(os.getenv('PER_PEER_RATE', '0.2'))
+        # 單一目標因 flood-wait / slow-mode 累計可等待的秒數上限，超過即視為失敗
+        self.max_flood_wait = int(os.getenv('MAX_FLOOD_WAIT', '900'))
+        # 控制群組進度訊息的最短編輯間隔 (秒)
+        self.progress_interval = max(1.0, float(os.getenv('PROGRESS_INTERVAL', '5')))
+        # 排程廣播期望在排定時間後多少秒內完成 (0 為不設截止時間)；同時進行的廣播中截止時間較早的先發送
+        self.schedule_deadline = max(0, int(os.getenv('SCHEDULE_DEADLINE', '3600')))
+
+        # /list_members 使用的群組成員快照多久後在背景重新載入 (秒)；期間由成員加入/離開事件增量更新
+        self.participant_cache_ttl = max(60, int(os.getenv('PARTICIPANT_CACHE_TTL', '3600')))
+
         # --- 新增: 時區設定 ---
         # 從 .env 讀取時區，如果沒有則預設為 'Asia/Taipei'
         self.timezone = os.getenv('TIMEZONE', 'Asia/Taipei')
 
+        # 廣播歷史資料庫 (SQLite)
+        self.database_url = os.getenv('DATABASE_URL', 'sqlite:///userbot.db')
+        self.database_path = self.database_url[len('sqlite:///'):] if self.database_url.startswith('sqlite:///') else 'userbot.db'
+
+        # 部署模式：local = 本行程直接發送；coordinator = 只排入工作，由 worker.py 行程發送
+        self.broadcast_mode = os.getenv('BROADCAST_MODE', 'local').strip().lower()
+        self.job_queue_path = os.getenv('JOB_QUEUE_PATH', 'job_queue.db')
+
+        # Prometheus 指標端點 (METRICS_PORT=0 停用)
+        self.metrics_host = os.getenv('METRICS_HOST', '127.0.0.1')
+        self.metrics_port = int(os.getenv('METRICS_PORT', '9464'))
+
+        # 媒體前處理 (python media_processor.py 或 /optimize)：圖片長邊上限、JPEG 品質、影片 CRF 與處理行程數
+        self.media_max_dimension = int(os.getenv('MEDIA_MAX_DIMENSION', '2560'))
+        self.media_jpeg_quality = int(os.getenv('MEDIA_JPEG_QUALITY', '85'))
+        self.media_video_crf = int(os.getenv('MEDIA_VIDEO_CRF', '23'))
+        self.media_workers = int(os.getenv('MEDIA_WORKERS', str(min(4, os.cpu_count() or 1))))
+
+        # 記錄檔設定 (見 LoggingConfig)
+        super().__init__()
+
+        # 設定檔與資料庫備份 (內容去重、gzip 壓縮)：快照間隔、保留最近幾個快照與最近幾天每天一個快照
+        self.backup_dir = os.getenv('BACKUP_DIR', BACKUP_DIR)
+        # 預設備份設定檔，以及廣播歷史與工作佇列資料庫 (以 SQLite 線上備份取得一致的內容)
+        default_backup_files = ','.join(BACKUP_FILES + (self.database_path, self.job_queue_path))
+        self.backup_files = [f.strip() for f in os.getenv('BACKUP_FILES', default_backup_files).split(',') if f.strip()]
+        self.backup_interval = max(60, int(os.getenv('BACKUP_INTERVAL', '3600')))
+        self.backup_keep_recent = max(1, int(os.getenv('BACKUP_KEEP_RECENT', '24')))
+        self.backup_keep_days = max(0, int(os.getenv('BACKUP_KEEP_DAYS', '30')))
+
+        # 設定檔以 write-behind 方式原子寫入，多次修改會合併成一次寫入
+        self.writer = JsonWriter()
+
+        # 廣播目標的標籤索引 (載入與儲存設定時重建)，排程與 /test 可只發送到符合選擇器的群組
+        self._target_index = TargetIndex()
+
         # 從 JSON 檔案載入動態設定
         self.load_settings()
         self.load_broadcast_config()
         self.load_admins()
 
+    @property
+    def target_index(self) -> TargetIndex:
+        """廣播目標的標籤索引；目標列表被直接替換或增減時先重建。"""
+        if self._target_index.is_stale(self.target_groups):
+            self._target_index.rebuild(self.target_groups)
+        return self._target_index
+
+    def reload(self):
+        """重新從 JSON 檔案載入動態設定 (例如從備份還原之後)。"""
+        self.load_settings()
+        self.load_broadcast_config()
+        self.load_admins()
+
     def load_settings(self):
         """從 settings.json 載入設定，並處理多時間排程的向後相容性。"""
         try:
-            with open('settings.json', 'r', encoding='utf-8') as f:
-                settings = json.load(f)
+            settings = load_json_file('settings.json')
             self.target_groups = settings.get('target_groups', [])
             self.enabled = settings.get('enabled', False)
 
@@ -51,48 +141,46 @@ class Config:
                 self.save_settings()
             else:
                 self.broadcast_times = []
+            self._target_index.rebuild(self.target_groups)
             
         except FileNotFoundError:
-            print("⚠️ settings.json 未找到，將使用預設設定。")
+            logging.warning("⚠️ settings.json 未找到，將使用預設設定。")
             self.target_groups = []
             self.broadcast_times = []
             self.enabled = False
             self.save_settings()
         except json.JSONDecodeError:
-            print("❌ settings.json 格式錯誤，將使用預設設定並覆蓋。")
+            logging.error("❌ settings.json 格式錯誤且沒有可用的備份，將使用預設設定。")
             self.target_groups = []
             self.broadcast_times = []
             self.enabled = False
             self.save_settings()
 
     def save_settings(self):
-        """將目前設定保存到 settings.json，使用新的多時間格式。"""
-        settings = {
+        """將目前設定保存到 settings.json，使用新的多時間格式。目標列表的修改都會經過此處，因此同時重建標籤索引。"""
+        self._target_index.rebuild(self.target_groups)
+        self.writer.schedule('settings.json', lambda: {
             'target_groups': self.target_groups,
             'broadcast_times': self.broadcast_times,
             'enabled': self.enabled,
             'last_updated': datetime.now().isoformat()
-        }
-        settings.pop('broadcast_time', None)
-        
-        with open('settings.json', 'w', encoding='utf-8') as f:
-            json.dump(settings, f, ensure_ascii=False, indent=2)
+        })
 
     def load_admins(self):
         """從 admins.json 載入管理員列表。"""
         try:
-            with open(self.ADMINS_FILE, 'r', encoding='utf-8') as f:
-                self.admins = json.load(f)
+            self.admins = load_json_file(self.ADMINS_FILE)
+            self._rebuild_admin_ids()
         except FileNotFoundError:
-            print("⚠️ admins.json 未找到，將使用預設管理員設定。")
+            logging.warning("⚠️ admins.json 未找到，將使用預設管理員設定。")
             self.admins = []
             self.save_admins()
         except json.JSONDecodeError:
-            print("❌ admins.json 格式錯誤，將使用預設管理員設定並覆蓋。")
+            logging.error("❌ admins.json 格式錯誤且沒有可用的備份，將使用預設管理員設定。")
             self.admins = []
             self.save_admins()
         except IOError as e:
-            print(f"❌ 讀取 admins.json 時發生 IO 錯誤: {e}，將使用預設管理員設定。")
+            logging.error(f"❌ 讀取 admins.json 時發生 IO 錯誤: {e}，將使用預設管理員設定。")
             self.admins = []
             self.save_admins()
 
@@ -103,46 +191,64 @@ class Config:
         if not admin_users_str: return
 
         admin_ids = [int(uid.strip()) for uid in admin_users_str.split(',') if uid.strip()]
+        if self.entity_cache:
+            resolved, failed = await self.entity_cache.resolve_many(admin_ids)
+        else:
+            resolved, failed = {}, {}
+            for admin_id in admin_ids:
+                try:
+                    resolved[admin_id] = await self.client.get_entity(admin_id)
+                except Exception as e:
+                    failed[admin_id] = e
         for admin_id in admin_ids:
-            try:
-                user = await self.client.get_entity(admin_id)
+            if admin_id in resolved:
+                user = resolved[admin_id]
                 self.admins.append({"id": user.id, "name": user.first_name, "username": user.username or ""})
-            except Exception as e:
-                print(f"  ❌ 無法遷移 ID {admin_id}: {e}")
+            else:
+                logging.warning(f"  ❌ 無法遷移 ID {admin_id}: {failed.get(admin_id)}")
         self.save_admins()
 
     def save_admins(self):
         """將管理員列表保存到 admins.json。"""
-        with open(self.ADMINS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(self.admins, f, ensure_ascii=False, indent=2)
+        self._rebuild_admin_ids()
+        self.writer.schedule(self.ADMINS_FILE, lambda: self.admins)
+
+    def _rebuild_admin_ids(self):
+        # 管理員列表每次修改後都會呼叫 save_admins，在此同步更新 ID 集合
+        self.admin_ids = {admin['id'] for admin in self.admins}
 
     def is_admin(self, user_id: int) -> bool:
-        """檢查使用者 ID 是否為管理員。"""
-        return any(admin['id'] == user_id for admin in self.admins)
+        """檢查使用者 ID 是否為管理員 (O(1) 集合查詢)。"""
+        return user_id in self.admin_ids
 
     def load_broadcast_config(self):
         try:
-            with open('broadcast_config.json', 'r', encoding='utf-8') as f:
-                config = json.load(f)
+            config = load_json_file('broadcast_config.json')
             self.schedules = config.get('schedules', [])
             self.total_restarts = config.get('total_restarts', 0)
         except FileNotFoundError:
-            print("⚠️ broadcast_config.json 未找到，將使用預設設定。")
+            logging.warning("⚠️ broadcast_config.json 未找到，將使用預設設定。")
             self.schedules = []
             self.total_restarts = 0
             self.save_broadcast_config(is_startup=False)
         except json.JSONDecodeError:
-            print("❌ broadcast_config.json 格式錯誤，將使用預設設定並覆蓋。")
+            logging.error("❌ broadcast_config.json 格式錯誤且沒有可用的備份，將使用預設設定。")
             self.schedules = []
             self.total_restarts = 0
             self.save_broadcast_config(is_startup=False)
 
     def save_broadcast_config(self, is_startup=True):
         if is_startup: self.total_restarts += 1
-        config = {
-            'schedules': self.schedules, 
-            'last_startup': datetime.now().isoformat(), 
+        self.writer.schedule('broadcast_config.json', lambda: {
+            'schedules': self.schedules,
+            'last_startup': datetime.now().isoformat(),
             'total_restarts': self.total_restarts
-        }
-        with open('broadcast_config.json', 'w', encoding='utf-8') as f:
-            json.dump(config, f, ensure_ascii=False, indent=2)
\ No newline at end of file
+        })
+
+    async def flush(self):
+        """立即寫入所有尚未寫入的設定變更 (關閉前呼叫)。"""
+        await self.writer.flush()
+
+    def flush_sync(self):
+        """同步寫入所有尚未寫入的設定變更，用於事件循環已結束的情況。"""
+        self.writer.flush_sync()
\ No newline at end of file
@@ -0,0 +1,191 @@
+import json
+import logging
+import math
+import time
+
+from telethon import events, types, utils
+
+from persistence import atomic_write_text
+
+
+class DialogIndex:
+    """
+    已加入的群組/頻道索引 (ID、名稱、類型、是否可發言)，保存在 dialog_index.json。
+    只在第一次使用或手動 /refresh_dialogs 時完整掃描 iter_dialogs，
+    之後由加入/離開/改名/權限變更等事件增量更新，/list 與 /my_groups 直接從記憶體分頁回應。
+    """
+    INDEX_FILE = 'dialog_index.json'
+    PAGE_SIZE = 50
+
+    def __init__(self, client, path: str = INDEX_FILE, writer=None, entity_cache=None):
+        self.client = client
+        self.path = path
+        self.writer = writer
+        self.entity_cache = entity_cache
+        self.entries = {}
+        self.built_at = None
+        self._me_id = None
+        self.load()
+
+    # --- 檔案存取 ---
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.entries = data.get('entries', {})
+            self.built_at = data.get('built_at')
+        except FileNotFoundError:
+            self.entries, self.built_at = {}, None
+        except json.JSONDecodeError:
+            logging.error(f"❌ {self.path} 格式錯誤，將重新建立群組索引。")
+            self.entries, self.built_at = {}, None
+
+    def _snapshot(self) -> dict:
+        return {'built_at': self.built_at, 'entries': self.entries}
+
+    def save(self):
+        if self.writer:
+            self.writer.schedule(self.path, self._snapshot)
+        else:
+            atomic_write_text(self.path, json.dumps(self._snapshot(), ensure_ascii=False, indent=2))
+
+    # --- 索引內容 ---
+
+    @staticmethod
+    def can_post(entity) -> bool:
+        """依 entity 的身分與權限判斷本帳號能否在此群組/頻道發言。"""
+        if isinstance(entity, types.Chat) and entity.deactivated:
+            return False
+        if getattr(entity, 'creator', False):
+            return True
+        admin_rights = getattr(entity, 'admin_rights', None)
+        if isinstance(entity, types.Channel) and entity.broadcast:
+            # 頻道只有具備發文權限的管理員可以發送
+            return bool(admin_rights and admin_rights.post_messages)
+        if admin_rights:
+            return True
+        for rights in (getattr(entity, 'banned_rights', None), getattr(entity, 'default_banned_rights', None)):
+            if rights and rights.send_messages:
+                return False
+        return True
+
+    def upsert(self, entity, save: bool = True) -> dict:
+        """新增或更新單一群組/頻道；已無法存取 (被踢出、已離開) 時從索引移除。"""
+        if isinstance(entity, (types.ChatForbidden, types.ChannelForbidden)) or getattr(entity, 'left', False):
+            self.remove(utils.get_peer_id(entity), save)
+            return None
+        if not isinstance(entity, (types.Chat, types.Channel)):
+            return None
+        entry = {
+            'id': utils.get_peer_id(entity),
+            'title': getattr(entity, 'title', None) or str(entity.id),
+            'type': 'channel' if isinstance(entity, types.Channel) and entity.broadcast else 'group',
+            'can_post': self.can_post(entity),
+            'updated': time.time(),
+        }
+        self.entries[str(entry['id'])] = entry
+        if self.entity_cache:
+            self.entity_cache.remember(entity)
+        if save:
+            self.save()
+        return entry
+
+    def remove(self, chat_id: int, save: bool = True):
+        if self.entries.pop(str(chat_id), None) is not None and save:
+            self.save()
+
+    def get(self, chat_id: int) -> dict:
+        return self.entries.get(str(chat_id))
+
+    def all(self) -> list[dict]:
+        """依名稱排序的所有群組/頻道。"""
+        return sorted(self.entries.values(), key=lambda e: (e['title'].lower(), e['id']))
+
+    def page(self, page: int = 1, page_size: int = PAGE_SIZE) -> tuple[list[dict], int, int]:
+        """回傳 (該頁項目, 頁碼, 總頁數)；頁碼超出範圍時取最接近的一頁。"""
+        items = self.all()
+        pages = max(1, math.ceil(len(items) / page_size))
+        page = min(max(1, page), pages)
+        return items[(page - 1) * page_size:page * page_size], page, pages
+
+    # --- 完整掃描 ---
+
+    async def build(self, force: bool = False) -> int:
+        """完整掃描 iter_dialogs 重建索引；已有索引且未指定 force 時直接沿用。回傳索引中的項目數。"""
+        if self.built_at is not None and not force:
+            return len(self.entries)
+        start = time.monotonic()
+        entries = {}
+        async for dialog in self.client.iter_dialogs():
+            if not (dialog.is_group or dialog.is_channel):
+                continue
+            entity = dialog.entity
+            entries[str(dialog.id)] = {
+                'id': dialog.id,
+                'title': dialog.name,
+                'type': 'group' if dialog.is_group else 'channel',
+                'can_post': self.can_post(entity),
+                'updated': time.time(),
+            }
+            if self.entity_cache and entity is not None:
+                self.entity_cache.remember(entity)
+        self.entries = entries
+        self.built_at = time.time()
+        self.save()
+        if self.entity_cache:
+            self.entity_cache.save()
+        logging.info(f"🗂️ 群組索引已重建: {len(entries)} 個群組/頻道 ({time.monotonic() - start:.1f}s)")
+        return len(entries)
+
+    # --- 事件增量更新 ---
+
+    def register_handlers(self):
+        self.client.add_event_handler(self._on_chat_action, events.ChatAction())
+        self.client.add_event_handler(self._on_channel_update, events.Raw(types.UpdateChannel))
+        self.client.add_event_handler(self._on_message, events.NewMessage(func=lambda e: not e.is_private))
+
+    async def _me(self) -> int:
+        if self._me_id is None:
+            self._me_id = (await self.client.get_me()).id
+        return self._me_id
+
+    async def _on_chat_action(self, event):
+        try:
+            if event.new_title and str(event.chat_id) in self.entries:
+                self.entries[str(event.chat_id)]['title'] = event.new_title
+                self.save()
+                return
+            if not (event.user_joined or event.user_added or event.user_left or event.user_kicked or event.created):
+                return
+            me = await self._me()
+            if not event.created and me not in (event.user_ids or []):
+                return
+            if event.user_left or event.user_kicked:
+                self.remove(event.chat_id)
+            else:
+                self.upsert(await event.get_chat())
+        except Exception as e:
+            logging.warning(f"⚠️ 更新群組索引失敗 ({event.chat_id}): {e}")
+
+    async def _on_channel_update(self, update):
+        """加入/離開頻道或權限變更時，伺服器會送出 UpdateChannel，重新取得該頻道的狀態。"""
+        chat_id = utils.get_peer_id(types.PeerChannel(update.channel_id))
+        try:
+            self.upsert(await self.client.get_entity(types.PeerChannel(update.channel_id)))
+        except (ValueError, TypeError):
+            # 本地沒有此頻道的 access_hash (例如不相關的頻道)，略過
+            pass
+        except Exception as e:
+            # 已被踢出或頻道變為私有
+            logging.info(f"群組索引移除 {chat_id}: {e}")
+            self.remove(chat_id)
+
+    async def _on_message(self, event):
+        """收到未在索引中的群組訊息時補上 (例如離線期間被加入的群組)。"""
+        if str(event.chat_id) in self.entries:
+            return
+        try:
+            self.upsert(await event.get_chat())
+        except Exception as e:
+            logging.warning(f"⚠️ 更新群組索引失敗 ({event.chat_id}): {e}")
@@ -0,0 +1,248 @@
+import asyncio
+import collections
+import itertools
+import logging
+import time
+from contextlib import asynccontextmanager
+
+# 廣播優先度：數字越大越優先。/test 等手動廣播可插隊到排程的大量廣播之前
+PRIORITY_BULK = -10
+PRIORITY_NORMAL = 0
+PRIORITY_URGENT = 10
+PRIORITY_NAMES = {PRIORITY_BULK: '低', PRIORITY_NORMAL: '一般', PRIORITY_URGENT: '緊急'}
+
+
+class DispatchJob:
+    """分派器中的單一廣播工作：優先度、截止時間、剩餘目標數與等待發送名額的請求。"""
+    def __init__(self, job_id: int, campaign: str, total: int, remaining: int, priority: int, deadline: float = None):
+        self.job_id = job_id
+        self.campaign = campaign
+        self.total = total
+        self.remaining = remaining
+        self.priority = priority
+        self.deadline = deadline
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.waiters = collections.deque()
+        # 目前持有的名額數
+        self.holding = 0
+        # 最後一次取得名額的順序，同優先度的工作依此輪流 (round-robin)
+        self.last_served = -1
+
+    def rank(self) -> tuple:
+        return (-self.priority, self.deadline or float('inf'), self.last_served)
+
+
+class BroadcastDispatcher:
+    """
+    所有廣播共用的發送分派器。每次發送請求前 (媒體已上傳、帳號令牌已取得) 先取得名額 (slot)，只在請求期間持有，名額總數固定，
+    有多個工作在等待時依 (優先度、截止時間、輪流順序) 分配：高優先度的工作在下一個名額釋出時就插隊 (搶占)，
+    同優先度的工作輪流取得名額，互相穿插發送。帳號的令牌桶由所有工作共用，同時進行的廣播不會加倍 flood 壓力；
+    令牌同樣依工作的優先度與截止時間分配 (admission_rank)，速率受限時緊急廣播也能在下一個令牌插隊。
+    只有在等待名額的工作參與排序：高優先度的工作目標都在 flood-wait 延後時，低優先度的工作可繼續使用名額。
+    協調者模式下由 worker 行程發送，不經過此分派器 (worker 中的工作未登記，slot() 直接放行)；
+    worker 之間的順序由工作佇列認領時的排序決定 (優先度、截止時間，同條件的工作依目標順序交錯)。
+    """
+    # 計算實際發送速率所用的時間窗 (秒)
+    RATE_WINDOW = 60
+
+    def __init__(self, capacity, fallback_rate=None):
+        # capacity / fallback_rate 可為數字或回傳數字的函式 (例如依目前可用帳號數計算)
+        self._capacity = capacity
+        self._fallback_rate = fallback_rate
+        self.jobs = {}
+        self._in_use = 0
+        self._seq = itertools.count()
+        self._completions = collections.deque()
+
+    @property
+    def capacity(self) -> int:
+        return max(1, int(self._capacity() if callable(self._capacity) else self._capacity))
+
+    # --- 工作登記 ---
+
+    def register(self, job_id: int, campaign: str, total: int, remaining: int, priority: int = PRIORITY_NORMAL,
+                 deadline: float = None) -> DispatchJob:
+        job = DispatchJob(job_id, campaign, total, remaining, priority, deadline)
+        self.jobs[job_id] = job
+        eta = self.estimates().get(job_id)
+        if eta:
+            logging.info(f"📥 工作 #{job_id} ({campaign}) 已排入分派器: 優先度 {PRIORITY_NAMES.get(priority, priority)}，"
+                         f"剩餘 {remaining} 個目標，預計 {self.format_eta(eta)}", extra={'job_id': job_id, 'campaign': campaign})
+        return job
+
+    def unregister(self, job_id: int):
+        job = self.jobs.pop(job_id, None)
+        if job is None:
+            return
+        for waiter in job.waiters:
+            if not waiter.done():
+                waiter.cancel()
+        self._wake()
+        if job.deadline and time.time() > job.deadline:
+            logging.warning(f"⚠️ 工作 #{job_id} ({job.campaign}) 超過截止時間 {time.time() - job.deadline:.0f}s 才完成",
+                            extra={'job_id': job_id, 'campaign': job.campaign})
+
+    def completed(self, job_id: int, count: int = 1):
+        """工作中有目標得到最終結果 (成功或失敗)。"""
+        job = self.jobs.get(job_id)
+        if job is not None:
+            job.remaining = max(0, job.remaining - count)
+            if job.remaining == 0:
+                self._wake()
+        now = time.monotonic()
+        self._completions.extend([now] * count)
+        while self._completions and self._completions[0] < now - self.RATE_WINDOW:
+            self._completions.popleft()
+
+    def set_remaining(self, job_id: int, remaining: int):
+        """由外部 (例如 worker 的進度) 更新剩餘目標數。"""
+        job = self.jobs.get(job_id)
+        if job is not None:
+            if remaining < job.remaining:
+                self.completed(job_id, job.remaining - remaining)
+            job.remaining = remaining
+
+    # --- 發送名額 ---
+
+    def admission_rank(self, job_id: int) -> tuple:
+        """取得帳號令牌的排序 (數值小者優先)：高優先度、截止時間較早的工作先取得令牌。"""
+        job = self.jobs.get(job_id)
+        if job is None:
+            return (-PRIORITY_NORMAL, float('inf'))
+        return (-job.priority, job.deadline or float('inf'))
+
+    def _top_priority(self):
+        """等待名額的工作中最高的優先度；沒有工作在等待時回傳 None。"""
+        return max((j.priority for j in self.jobs.values() if j.waiters), default=None)
+
+    def _grant(self, job: DispatchJob, waiter: asyncio.Future = None):
+        self._in_use += 1
+        job.holding += 1
+        job.last_served = next(self._seq)
+        if job.started_at is None:
+            job.started_at = time.time()
+        if waiter is not None:
+            waiter.set_result(None)
+
+    def _wake(self):
+        """把空出的名額分配給排序最前面、且仍有請求在等待的工作。"""
+        while self._in_use < self.capacity:
+            waiting = [j for j in self.jobs.values() if j.waiters]
+            if not waiting:
+                return
+            # 最高優先度的等待者排在最前面：高優先度的工作在下一個名額釋出時就取得名額 (搶占)，低優先度的工作暫停
+            job = min(waiting, key=DispatchJob.rank)
+            waiter = job.waiters.popleft()
+            if not waiter.done():
+                self._grant(job, waiter)
+
+    async def acquire(self, job_id: int):
+        job = self.jobs.get(job_id)
+        if job is None:
+            # 未登記的工作 (例如單獨呼叫 deliver) 不受分派器控制
+            return
+        if self._in_use < self.capacity and self._top_priority() is None:
+            # 有空出的名額且沒有其他工作在等待，直接取得
+            self._grant(job)
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        job.waiters.append(waiter)
+        self._wake()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # 已取得名額但呼叫端被取消，把名額還回去
+                self.release(job_id)
+            elif waiter in job.waiters:
+                job.waiters.remove(waiter)
+            raise
+
+    def release(self, job_id: int):
+        self._in_use = max(0, self._in_use - 1)
+        job = self.jobs.get(job_id)
+        if job is not None:
+            job.holding = max(0, job.holding - 1)
+        self._wake()
+
+    @asynccontextmanager
+    async def slot(self, job_id: int):
+        """持有一個發送名額期間執行一次發送嘗試。"""
+        if job_id not in self.jobs:
+            yield
+            return
+        await self.acquire(job_id)
+        try:
+            yield
+        finally:
+            self.release(job_id)
+
+    # --- 預估時間 ---
+
+    def rate(self) -> float:
+        """目前的發送速率 (目標/秒)：有近期完成記錄時用實測值，否則用設定的速率。"""
+        now = time.monotonic()
+        recent = [t for t in self._completions if t >= now - self.RATE_WINDOW]
+        if len(recent) >= 5:
+            return len(recent) / max(1.0, now - recent[0])
+        fallback = self._fallback_rate() if callable(self._fallback_rate) else self._fallback_rate
+        return fallback or None
+
+    def estimates(self, rate: float = None) -> dict:
+        """
+        以流體模型預估每個工作的開始與完成時間 (epoch 秒)，回傳 {job_id: (開始, 完成)}。
+        高優先度的工作先獨占速率；同優先度中有截止時間的工作依截止時間先後完成，
+        其餘工作平均分配速率 (輪流發送)，因此剩餘目標少的先完成。速率未知時回傳空字典。
+        """
+        rate = rate or self.rate()
+        if not rate:
+            return {}
+        now = time.time()
+        clock = now
+        result = {}
+        by_priority = collections.defaultdict(list)
+        for job in self.jobs.values():
+            by_priority[job.priority].append(job)
+        for priority in sorted(by_priority, reverse=True):
+            jobs = by_priority[priority]
+            for job in sorted((j for j in jobs if j.deadline), key=lambda j: j.deadline):
+                start = job.started_at or clock
+                clock += job.remaining / rate
+                result[job.job_id] = (start, clock)
+            shared = sorted((j for j in jobs if not j.deadline), key=lambda j: j.remaining)
+            class_start, done = clock, 0
+            for i, job in enumerate(shared):
+                # 剩下的 n 個工作平分速率，直到剩餘最少的工作完成
+                clock += (job.remaining - done) * (len(shared) - i) / rate
+                done = job.remaining
+                start = job.started_at or class_start
+                result[job.job_id] = (start, clock)
+        return result
+
+    @staticmethod
+    def format_eta(eta: tuple) -> str:
+        start, finish = eta
+        now = time.time()
+        start_text = "已開始" if start <= now else f"{time.strftime('%H:%M:%S', time.localtime(start))} 開始"
+        return f"{start_text}，{time.strftime('%H:%M:%S', time.localtime(finish))} 完成"
+
+    def queue_status(self) -> list[dict]:
+        """依分派順序列出目前的工作與預估時間 (供 /queue 顯示)。"""
+        estimates = self.estimates()
+        rows = []
+        for job in sorted(self.jobs.values(), key=lambda j: (-j.priority, j.deadline or float('inf'), j.submitted_at)):
+            eta = estimates.get(job.job_id)
+            rows.append({
+                'job_id': job.job_id,
+                'campaign': job.campaign,
+                'priority': job.priority,
+                'total': job.total,
+                'remaining': job.remaining,
+                'deadline': job.deadline,
+                'started': job.started_at is not None,
+                'waiting': len(job.waiters),
+                'eta': eta,
+                'late': bool(eta and job.deadline and eta[1] > job.deadline),
+            })
+        return rows
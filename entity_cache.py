@@ -0,0 +1,210 @@
+import asyncio
+import json
+import logging
+import re
+import time
+from types import SimpleNamespace
+
+from telethon import types, utils
+
+from persistence import atomic_write_text
+
+
+class EntityCache:
+    """
+    持久化的 peer/entity 解析快取。
+    保存每個目標群組與管理員的 access_hash、名稱等資訊到 entity_cache.json，
+    重啟後仍可直接組出 InputPeer，廣播時不需要再向伺服器查詢 entity。
+    """
+    CACHE_FILE = 'entity_cache.json'
+    # 超過此秒數的項目會在背景重新整理
+    STALE_AFTER = 24 * 3600
+    # 背景重新整理的檢查間隔 (秒)
+    REFRESH_INTERVAL = 3600
+    # 每次批次查詢的數量上限
+    BATCH_SIZE = 100
+
+    def __init__(self, client, path: str = CACHE_FILE, writer=None):
+        self.client = client
+        self.path = path
+        self.writer = writer
+        self.entries = {}
+        self.aliases = {}
+        self._refresh_task = None
+        self.load()
+
+    # --- 檔案存取 ---
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.entries = data.get('entries', {})
+            self.aliases = data.get('aliases', {})
+        except FileNotFoundError:
+            self.entries, self.aliases = {}, {}
+        except json.JSONDecodeError:
+            logging.error(f"❌ {self.path} 格式錯誤，將重新建立 entity 快取。")
+            self.entries, self.aliases = {}, {}
+
+    def save(self):
+        if self.writer:
+            self.writer.schedule(self.path, lambda: {'entries': self.entries, 'aliases': self.aliases})
+        else:
+            atomic_write_text(self.path, json.dumps({'entries': self.entries, 'aliases': self.aliases}, ensure_ascii=False, indent=2))
+
+    # --- 查詢 ---
+
+    def _key(self, identifier):
+        """將 ID (原始或帶 -100 標記) 或 @用戶名 對應到快取鍵。"""
+        if isinstance(identifier, str) and not re.fullmatch(r'-?\d+', identifier):
+            return self.aliases.get('@' + identifier.lstrip('@').lower())
+        key = str(int(identifier))
+        if key in self.entries:
+            return key
+        return self.aliases.get(key)
+
+    def get(self, identifier) -> dict:
+        key = self._key(identifier)
+        return self.entries.get(key) if key else None
+
+    def input_peer(self, identifier):
+        """以快取資料組出 InputPeer；未快取時回傳 None。"""
+        entry = self.get(identifier)
+        if not entry:
+            return None
+        if entry['type'] == 'channel':
+            return types.InputPeerChannel(entry['raw_id'], entry['access_hash'])
+        if entry['type'] == 'chat':
+            return types.InputPeerChat(entry['raw_id'])
+        return types.InputPeerUser(entry['raw_id'], entry['access_hash'])
+
+    def peer(self, identifier):
+        """發送時使用的 peer：有快取就用 InputPeer，否則退回原本的 ID。"""
+        return self.input_peer(identifier) or identifier
+
+    @staticmethod
+    def as_entity(entry: dict):
+        """將快取項目轉為與 Telethon entity 相容的輕量物件 (id/title/first_name/username)。"""
+        return SimpleNamespace(
+            id=entry['raw_id'], title=entry.get('title'), first_name=entry.get('first_name'),
+            last_name=entry.get('last_name'), username=entry.get('username') or None,
+            bot=entry.get('bot', False)
+        )
+
+    # --- 寫入 ---
+
+    def remember(self, entity, save: bool = False) -> dict:
+        """將 Telethon entity 寫入快取並回傳快取項目。"""
+        if isinstance(entity, types.User):
+            kind = 'user'
+        elif isinstance(entity, (types.Chat, types.ChatForbidden)):
+            kind = 'chat'
+        elif isinstance(entity, (types.Channel, types.ChannelForbidden)):
+            kind = 'channel'
+        else:
+            return None
+        marked_id = utils.get_peer_id(entity)
+        entry = {
+            'raw_id': entity.id,
+            'type': kind,
+            'access_hash': getattr(entity, 'access_hash', None) or 0,
+            'title': getattr(entity, 'title', None) or utils.get_display_name(entity),
+            'first_name': getattr(entity, 'first_name', None),
+            'last_name': getattr(entity, 'last_name', None),
+            'username': getattr(entity, 'username', None) or '',
+            'bot': bool(getattr(entity, 'bot', False)),
+            'updated': time.time(),
+        }
+        key = str(marked_id)
+        self.entries[key] = entry
+        self.aliases[str(entity.id)] = key
+        if entry['username']:
+            self.aliases['@' + entry['username'].lower()] = key
+        if save:
+            self.save()
+        return entry
+
+    # --- 解析 ---
+
+    async def resolve(self, identifier, refresh: bool = False):
+        """
+        解析單一 ID 或 @用戶名，優先使用快取。
+        回傳與 Telethon entity 相容的物件，找不到時拋出例外 (與 get_entity 相同)。
+        """
+        if not refresh:
+            entry = self.get(identifier)
+            if entry:
+                return self.as_entity(entry)
+        entity = await self.client.get_entity(identifier)
+        self.remember(entity, save=True)
+        return entity
+
+    async def resolve_many(self, identifiers, refresh: bool = False):
+        """
+        批次解析多個 ID。已快取的直接回傳，其餘以 get_entity(list) 合併查詢
+        (Telethon 會依 user/chat/channel 分組成少數幾個請求)。
+        回傳 (成功 {identifier: entity}, 失敗 {identifier: 錯誤})。
+        """
+        resolved, failed, pending = {}, {}, []
+        for identifier in identifiers:
+            entry = None if refresh else self.get(identifier)
+            if entry:
+                resolved[identifier] = self.as_entity(entry)
+            else:
+                pending.append(identifier)
+
+        # 先從 session 取得 InputPeer (本地查詢)，無法取得的視為失敗
+        inputs = []
+        for identifier in pending:
+            try:
+                inputs.append((identifier, self.input_peer(identifier) or await self.client.get_input_entity(identifier)))
+            except Exception as e:
+                failed[identifier] = e
+
+        for start in range(0, len(inputs), self.BATCH_SIZE):
+            batch = inputs[start:start + self.BATCH_SIZE]
+            try:
+                entities = await self.client.get_entity([peer for _, peer in batch])
+                pairs = zip([identifier for identifier, _ in batch], entities)
+            except Exception:
+                # 批次中只要有一個失敗整批都會失敗，改為逐一查詢找出問題目標
+                pairs = []
+                for identifier, peer in batch:
+                    try:
+                        pairs.append((identifier, await self.client.get_entity(peer)))
+                    except Exception as e:
+                        failed[identifier] = e
+            for identifier, entity in pairs:
+                self.remember(entity)
+                resolved[identifier] = entity
+
+        if inputs:
+            self.save()
+        return resolved, failed
+
+    async def refresh_stale(self):
+        """重新整理過期的快取項目 (名稱、用戶名、access_hash)。"""
+        cutoff = time.time() - self.STALE_AFTER
+        stale = [key for key, entry in self.entries.items() if entry.get('updated', 0) < cutoff]
+        if not stale:
+            return 0
+        resolved, failed = await self.resolve_many(stale, refresh=True)
+        if failed:
+            logging.warning(f"Entity 快取重新整理失敗 {len(failed)} 筆: {list(failed)[:10]}")
+        return len(resolved)
+
+    def start_background_refresh(self):
+        """在事件循環中啟動定期重新整理過期項目的背景任務。"""
+        async def refresher():
+            while True:
+                try:
+                    refreshed = await self.refresh_stale()
+                    if refreshed:
+                        logging.info(f"🔄 已重新整理 {refreshed} 筆 entity 快取。")
+                except Exception as e:
+                    logging.exception(f"❌ 重新整理 entity 快取失敗: {e}")
+                await asyncio.sleep(self.REFRESH_INTERVAL)
+
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(refresher())
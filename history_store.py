@@ -0,0 +1,201 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+
+class HistoryStore:
+    """
+    以 SQLite 保存廣播歷史：每次廣播一筆 broadcasts 記錄，每個目標一筆 sends 記錄
+    (結果、錯誤類別、嘗試次數、延遲)。只做附加寫入，並以時間、活動與群組建立索引，
+    查詢時不需要載入全部資料，也沒有筆數上限。
+    """
+    LEGACY_FILE = 'broadcast_history.json'
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS broadcasts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        started_at REAL NOT NULL,
+        time TEXT NOT NULL,
+        campaign TEXT,
+        success_count INTEGER NOT NULL,
+        total_count INTEGER NOT NULL,
+        success_rate TEXT,
+        is_photo INTEGER DEFAULT 0,
+        is_video INTEGER DEFAULT 0,
+        is_gif INTEGER DEFAULT 0,
+        scheduled INTEGER DEFAULT 0,
+        restart_count INTEGER DEFAULT 0,
+        upload_bytes INTEGER DEFAULT 0,
+        upload_seconds REAL DEFAULT 0,
+        wall_seconds REAL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS idx_broadcasts_started_at ON broadcasts(started_at);
+    CREATE INDEX IF NOT EXISTS idx_broadcasts_campaign ON broadcasts(campaign, started_at);
+
+    CREATE TABLE IF NOT EXISTS sends (
+        broadcast_id INTEGER NOT NULL REFERENCES broadcasts(id),
+        group_id INTEGER NOT NULL,
+        group_title TEXT,
+        outcome TEXT NOT NULL,
+        error_class TEXT,
+        error TEXT,
+        attempts INTEGER DEFAULT 0,
+        latency_ms REAL,
+        sent_at REAL,
+        account TEXT,
+        deferred_seconds REAL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS idx_sends_broadcast ON sends(broadcast_id);
+    CREATE INDEX IF NOT EXISTS idx_sends_group ON sends(group_id, sent_at);
+    """
+
+    def __init__(self, path: str = 'userbot.db'):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        # 事件循環 (/history) 與 asyncio.to_thread (寫入歷史、/simulate 擬合模型) 共用同一連線，一次只允許一個執行緒使用
+        self._lock = threading.Lock()
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        self._add_column('sends', 'account', 'TEXT')
+        self._add_column('sends', 'deferred_seconds', 'REAL DEFAULT 0')
+        self.conn.commit()
+        self._migrate_legacy_json()
+
+    def _add_column(self, table: str, column: str, decl: str):
+        """舊版資料庫缺少新欄位時補上 (CREATE TABLE IF NOT EXISTS 不會修改既有的表)。"""
+        columns = {row['name'] for row in self.conn.execute(f"PRAGMA table_info({table})")}
+        if column not in columns:
+            self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+    def _migrate_legacy_json(self):
+        """第一次使用時匯入舊的 broadcast_history.json，匯入後將舊檔改名保留。"""
+        if not os.path.exists(self.LEGACY_FILE):
+            return
+        if self.conn.execute("SELECT 1 FROM broadcasts LIMIT 1").fetchone():
+            return
+        try:
+            with open(self.LEGACY_FILE, 'r', encoding='utf-8') as f:
+                history = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logging.warning(f"⚠️ 無法匯入舊的廣播歷史: {e}")
+            return
+        for r in history:
+            try:
+                started = datetime.strptime(r['time'], '%Y-%m-%d %H:%M:%S').timestamp()
+            except (KeyError, ValueError):
+                started = 0
+            self._insert_broadcast({**r, 'campaign': r.get('content_source')}, started)
+        self.conn.commit()
+        os.replace(self.LEGACY_FILE, self.LEGACY_FILE + '.migrated')
+        logging.info(f"📊 已將 {len(history)} 筆舊廣播歷史匯入 {self.path}。")
+
+    def _insert_broadcast(self, record: dict, started_at: float) -> int:
+        cur = self.conn.execute(
+            """INSERT INTO broadcasts (started_at, time, campaign, success_count, total_count, success_rate,
+                   is_photo, is_video, is_gif, scheduled, restart_count, upload_bytes, upload_seconds, wall_seconds)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (started_at, record.get('time', ''), record.get('campaign'), record.get('success_count', 0),
+             record.get('total_count', 0), record.get('success_rate'), int(bool(record.get('is_photo'))),
+             int(bool(record.get('is_video'))), int(bool(record.get('is_gif'))),
+             int(bool(record.get('scheduled'))), record.get('restart_count', 0),
+             record.get('upload_bytes', 0), record.get('upload_seconds', 0), record.get('wall_seconds', 0))
+        )
+        return cur.lastrowid
+
+    def record_broadcast(self, record: dict, started_at: float, sends: list[dict] = ()) -> int:
+        """在同一個交易中附加一筆廣播記錄與各目標的發送結果，回傳廣播 ID。"""
+        with self._lock, self.conn:
+            broadcast_id = self._insert_broadcast(record, started_at)
+            self.conn.executemany(
+                """INSERT INTO sends (broadcast_id, group_id, group_title, outcome, error_class, error,
+                       attempts, latency_ms, sent_at, account, deferred_seconds)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                [(broadcast_id, s['group_id'], s.get('group_title'), s['outcome'], s.get('error_class'),
+                  s.get('error'), s.get('attempts', 0), s.get('latency_ms'), s.get('sent_at'), s.get('account'),
+                  s.get('deferred_seconds', 0))
+                 for s in sends]
+            )
+        return broadcast_id
+
+    # --- 查詢 ---
+
+    def recent(self, limit: int = 10) -> list[dict]:
+        """最近的 limit 筆廣播 (新到舊)。"""
+        return self.query(limit=limit)
+
+    def query(self, since: float = None, until: float = None, campaign: str = None,
+              limit: int = 50) -> list[dict]:
+        """依時間範圍與活動查詢廣播記錄 (新到舊)。"""
+        clauses, params = [], []
+        if since is not None:
+            clauses.append("started_at >= ?"); params.append(since)
+        if until is not None:
+            clauses.append("started_at < ?"); params.append(until)
+        if campaign is not None:
+            clauses.append("campaign = ?"); params.append(campaign)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT * FROM broadcasts {where} ORDER BY started_at DESC, id DESC LIMIT ?", (*params, limit)
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def group_sends(self, group_id: int, since: float = None, until: float = None,
+                    limit: int = 50) -> list[dict]:
+        """查詢單一群組的發送記錄 (新到舊)，附上所屬廣播的時間與活動。"""
+        clauses, params = ["s.group_id = ?"], [group_id]
+        if since is not None:
+            clauses.append("s.sent_at >= ?"); params.append(since)
+        if until is not None:
+            clauses.append("s.sent_at < ?"); params.append(until)
+        with self._lock:
+            rows = self.conn.execute(
+                f"""SELECT s.*, b.time, b.campaign FROM sends s JOIN broadcasts b ON b.id = s.broadcast_id
+                    WHERE {' AND '.join(clauses)} ORDER BY s.sent_at DESC LIMIT ?""", (*params, limit)
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def broadcast_sends(self, broadcast_id: int) -> list[dict]:
+        """單次廣播中每個目標的發送結果。"""
+        with self._lock:
+            rows = self.conn.execute("SELECT * FROM sends WHERE broadcast_id = ?", (broadcast_id,)).fetchall()
+        return [dict(r) for r in rows]
+
+    def timing_samples(self, media: bool = None, since: float = None, limit: int = 20000) -> list[dict]:
+        """
+        最近的逐目標發送記錄 (新到舊)，供 /simulate 擬合時間模型：延遲、結果、錯誤類別、嘗試次數與 flood-wait 等待秒數。
+        media 為 True / False 時只取有媒體 / 純文字的廣播。
+        """
+        clauses, params = ["s.outcome != 'skipped'"], []
+        if media is not None:
+            clauses.append("(b.is_photo OR b.is_video OR b.is_gif) = ?"); params.append(int(media))
+        if since is not None:
+            clauses.append("s.sent_at >= ?"); params.append(since)
+        with self._lock:
+            rows = self.conn.execute(
+                f"""SELECT s.latency_ms, s.outcome, s.error_class, s.attempts, s.deferred_seconds
+                    FROM sends s JOIN broadcasts b ON b.id = s.broadcast_id
+                    WHERE {' AND '.join(clauses)} ORDER BY s.broadcast_id DESC LIMIT ?""", (*params, limit)
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def upload_totals(self, since: float = None) -> tuple[int, float]:
+        """有上傳媒體的廣播累計的 (上傳位元組, 上傳秒數)，用來估計上傳速度。"""
+        where, params = "WHERE upload_bytes > 0 AND upload_seconds > 0", []
+        if since is not None:
+            where += " AND started_at >= ?"; params.append(since)
+        with self._lock:
+            row = self.conn.execute(
+                f"SELECT COALESCE(SUM(upload_bytes), 0), COALESCE(SUM(upload_seconds), 0) FROM broadcasts {where}",
+                params
+            ).fetchone()
+        return row[0], row[1]
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
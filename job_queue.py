@@ -0,0 +1,394 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+# 每個目標的狀態：pending (待發送) → claimed (發送中) → sent / failed / skipped，
+# 被 flood-wait / slow-mode 擋下時為 deferred (defer_until 之後再試)
+FINAL_STATES = ('sent', 'failed', 'skipped')
+OPEN_STATES = ('pending', 'claimed', 'deferred')
+
+
+class JobQueue:
+    """
+    持久化的廣播工作 (SQLite)。每次廣播寫成一筆 jobs 記錄與每個目標一筆 job_items，
+    發送過程中以檢查點更新每個目標的狀態，行程重啟後可只發送剩下的目標。
+    協調者模式下也是協調者與 worker 之間的工作佇列：worker 以租約 (lease) 方式認領一批目標，
+    worker 異常結束時，租約到期的目標會被其他 worker 重新認領，不會遺失。
+    多個行程 (或掛載同一個檔案的多台主機) 可以同時使用同一個佇列檔案。
+    """
+    # 認領的目標在此秒數內沒有續約就會被重新分派
+    LEASE_SECONDS = 300
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        campaign TEXT,
+        content TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        finished_at REAL,
+        total INTEGER NOT NULL,
+        priority INTEGER DEFAULT 0,
+        deadline REAL,
+        upload_bytes INTEGER DEFAULT 0,
+        upload_seconds REAL DEFAULT 0,
+        saved_bytes INTEGER DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS job_items (
+        job_id INTEGER NOT NULL REFERENCES jobs(id),
+        idx INTEGER NOT NULL,
+        group_json TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        worker TEXT,
+        lease_until REAL,
+        defer_until REAL,
+        error_class TEXT,
+        error TEXT,
+        attempts INTEGER DEFAULT 0,
+        latency_ms REAL,
+        sent_at REAL,
+        account TEXT,
+        deferred_seconds REAL DEFAULT 0,
+        PRIMARY KEY (job_id, idx)
+    );
+    CREATE INDEX IF NOT EXISTS idx_job_items_status ON job_items(status, job_id, idx);
+    CREATE TABLE IF NOT EXISTS workers (
+        name TEXT PRIMARY KEY,
+        session TEXT,
+        pid INTEGER,
+        host TEXT,
+        started_at REAL,
+        heartbeat_at REAL,
+        sent INTEGER DEFAULT 0,
+        failed INTEGER DEFAULT 0
+    );
+    """
+
+    def __init__(self, path: str = 'job_queue.db'):
+        self.path = path
+        # 自行控制交易 (BEGIN IMMEDIATE)，讓多個行程認領目標時不會重複
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        columns = {row['name'] for row in self.conn.execute("PRAGMA table_info(job_items)")}
+        if 'defer_until' not in columns:
+            self.conn.execute("ALTER TABLE job_items ADD COLUMN defer_until REAL")
+        if 'deferred_seconds' not in columns:
+            self.conn.execute("ALTER TABLE job_items ADD COLUMN deferred_seconds REAL DEFAULT 0")
+        job_columns = {row['name'] for row in self.conn.execute("PRAGMA table_info(jobs)")}
+        if 'priority' not in job_columns:
+            self.conn.execute("ALTER TABLE jobs ADD COLUMN priority INTEGER DEFAULT 0")
+            self.conn.execute("ALTER TABLE jobs ADD COLUMN deadline REAL")
+        # 協調者與 worker 都會從 asyncio.to_thread 呼叫，同一連線一次只允許一個執行緒使用
+        self._lock = threading.Lock()
+
+    def _transaction(self, fn):
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn()
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+            return result
+
+    # --- 建立與查詢工作 ---
+
+    def enqueue(self, campaign: str, content: dict, targets: list[dict], priority: int = 0,
+                deadline: float = None) -> int:
+        """建立一筆廣播工作，回傳工作 ID。priority 越大越先發送，deadline 為期望完成的時間 (epoch)。"""
+        def insert():
+            cur = self.conn.execute(
+                "INSERT INTO jobs (campaign, content, created_at, total, priority, deadline) VALUES (?, ?, ?, ?, ?, ?)",
+                (campaign, json.dumps(content, ensure_ascii=False), time.time(), len(targets), priority, deadline)
+            )
+            job_id = cur.lastrowid
+            self.conn.executemany(
+                "INSERT INTO job_items (job_id, idx, group_json) VALUES (?, ?, ?)",
+                [(job_id, i, json.dumps(g, ensure_ascii=False)) for i, g in enumerate(targets, 1)]
+            )
+            return job_id
+        return self._transaction(insert)
+
+    def progress(self, job_id: int) -> dict:
+        """回傳工作的進度：各狀態的目標數、尚未完成的目標數與第一個成功發送的時間。"""
+        with self._lock:
+            counts = dict(self.conn.execute(
+                "SELECT status, COUNT(*) FROM job_items WHERE job_id = ? GROUP BY status", (job_id,)
+            ).fetchall())
+            first = self.conn.execute(
+                "SELECT MIN(sent_at) FROM job_items WHERE job_id = ? AND status = 'sent'", (job_id,)
+            ).fetchone()[0]
+        progress = {state: counts.get(state, 0) for state in OPEN_STATES + FINAL_STATES}
+        progress['remaining'] = sum(counts.get(state, 0) for state in OPEN_STATES)
+        progress['first_sent_at'] = first
+        return progress
+
+    def job(self, job_id: int) -> dict:
+        with self._lock:
+            row = self.conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def items(self, job_id: int) -> list[dict]:
+        """依目標順序回傳工作中每個目標的結果。"""
+        with self._lock:
+            rows = self.conn.execute("SELECT * FROM job_items WHERE job_id = ? ORDER BY idx", (job_id,)).fetchall()
+        items = []
+        for row in rows:
+            item = dict(row)
+            item['group'] = json.loads(item.pop('group_json'))
+            items.append(item)
+        return items
+
+    def unfinished_jobs(self) -> list[dict]:
+        """尚未完成 (行程中斷前沒有產生報告) 的工作，依建立順序。"""
+        with self._lock:
+            rows = self.conn.execute("SELECT * FROM jobs WHERE finished_at IS NULL ORDER BY id").fetchall()
+        return [dict(r) for r in rows]
+
+    def finish(self, job_id: int):
+        self._transaction(lambda: self.conn.execute(
+            "UPDATE jobs SET finished_at = ? WHERE id = ?", (time.time(), job_id)
+        ))
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM job_items WHERE status IN ('pending', 'claimed', 'deferred')"
+            ).fetchone()[0]
+
+    def workers(self) -> list[dict]:
+        with self._lock:
+            rows = self.conn.execute("SELECT * FROM workers ORDER BY name").fetchall()
+        return [dict(r) for r in rows]
+
+    def live_workers(self, stale_after: float) -> list[dict]:
+        """最近 stale_after 秒內有心跳的 worker。"""
+        cutoff = time.time() - stale_after
+        return [w for w in self.workers() if (w['heartbeat_at'] or 0) >= cutoff]
+
+    # --- 認領與檢查點 ---
+
+    def claim_job(self, job_id: int, worker: str) -> list[dict]:
+        """
+        由本行程直接發送整個工作：認領該工作所有尚未完成的目標 (含中斷前發送中或延後的目標)。
+        不設租約，協調者模式的 worker 不會搶走這些目標。
+        """
+        def take():
+            rows = self.conn.execute(
+                """SELECT idx, group_json, status, defer_until, attempts, deferred_seconds FROM job_items
+                   WHERE job_id = ? AND status IN ('pending', 'claimed', 'deferred') ORDER BY idx""",
+                (job_id,)
+            ).fetchall()
+            self.conn.execute(
+                """UPDATE job_items SET status = 'claimed', worker = ?, lease_until = NULL
+                   WHERE job_id = ? AND status IN ('pending', 'claimed', 'deferred')""",
+                (worker, job_id)
+            )
+            return [{'job_id': job_id, 'idx': r['idx'], 'group': json.loads(r['group_json']),
+                     'defer_until': r['defer_until'] if r['status'] == 'deferred' else None,
+                     'attempts': r['attempts'] or 0, 'deferred_seconds': r['deferred_seconds'] or 0} for r in rows]
+        return self._transaction(take)
+
+    def register_worker(self, name: str, session: str, pid: int, host: str):
+        now = time.time()
+        self._transaction(lambda: self.conn.execute(
+            """INSERT INTO workers (name, session, pid, host, started_at, heartbeat_at) VALUES (?, ?, ?, ?, ?, ?)
+               ON CONFLICT(name) DO UPDATE SET session = excluded.session, pid = excluded.pid, host = excluded.host,
+                   started_at = excluded.started_at, heartbeat_at = excluded.heartbeat_at""",
+            (name, session, pid, host, now, now)
+        ))
+
+    def heartbeat(self, worker: str):
+        """更新 worker 心跳，並延長它已認領 (含延後中) 目標的租約。"""
+        now = time.time()
+        def renew():
+            self.conn.execute("UPDATE workers SET heartbeat_at = ? WHERE name = ?", (now, worker))
+            self.conn.execute(
+                """UPDATE job_items SET lease_until = ?
+                   WHERE status IN ('claimed', 'deferred') AND worker = ? AND lease_until IS NOT NULL""",
+                (now + self.LEASE_SECONDS, worker)
+            )
+        self._transaction(renew)
+
+    def claim(self, worker: str, limit: int) -> list[dict]:
+        """
+        認領最多 limit 個待發送 (或租約已過期) 的目標；延後中的目標要等到 defer_until 之後才會被認領。
+        優先度高的工作先認領，其次是截止時間較早的工作；條件相同的工作依目標順序交錯認領，輪流發送。
+        """
+        now = time.time()
+        def take():
+            rows = self.conn.execute(
+                """SELECT i.job_id, i.idx, i.group_json, i.status, i.defer_until, i.attempts, i.deferred_seconds
+                   FROM job_items i JOIN jobs j ON j.id = i.job_id
+                   WHERE i.status = 'pending'
+                      OR (i.status = 'claimed' AND i.lease_until < ?)
+                      OR (i.status = 'deferred' AND (i.worker IS NULL OR i.lease_until < ?)
+                          AND COALESCE(i.defer_until, 0) <= ?)
+                   ORDER BY j.priority DESC, COALESCE(j.deadline, 1e18), i.idx, i.job_id LIMIT ?""",
+                (now, now, now, limit)
+            ).fetchall()
+            self.conn.executemany(
+                "UPDATE job_items SET status = 'claimed', worker = ?, lease_until = ? WHERE job_id = ? AND idx = ?",
+                [(worker, now + self.LEASE_SECONDS, r['job_id'], r['idx']) for r in rows]
+            )
+            return [{'job_id': r['job_id'], 'idx': r['idx'], 'group': json.loads(r['group_json']),
+                     'defer_until': r['defer_until'] if r['status'] == 'deferred' else None,
+                     'attempts': r['attempts'] or 0, 'deferred_seconds': r['deferred_seconds'] or 0} for r in rows]
+        return self._transaction(take)
+
+    def job_content(self, job_id: int) -> dict:
+        with self._lock:
+            row = self.conn.execute("SELECT content FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row['content']) if row else None
+
+    def checkpoint(self, job_id: int, worker: str, updates: list[dict]):
+        """
+        在同一個交易中寫入一批目標的狀態變更 (sent/failed/skipped/deferred)。
+        只接受仍由該 worker 持有的目標，避免覆寫已被重新分派的結果。
+        """
+        def write():
+            self.conn.executemany(
+                """UPDATE job_items SET status = ?, error_class = ?, error = ?, attempts = ?, latency_ms = ?,
+                       sent_at = ?, account = ?, defer_until = ?, deferred_seconds = ?
+                   WHERE job_id = ? AND idx = ? AND status IN ('claimed', 'deferred') AND worker = ?""",
+                [(u['status'], u.get('error_class'), u.get('error'), u.get('attempts', 0), u.get('latency_ms'),
+                  u.get('sent_at'), u.get('account'), u.get('defer_until'), u.get('deferred_seconds', 0),
+                  job_id, u['idx'], worker)
+                 for u in updates]
+            )
+            sent = sum(1 for u in updates if u['status'] == 'sent')
+            failed = sum(1 for u in updates if u['status'] == 'failed')
+            if sent or failed:
+                self.conn.execute(
+                    "UPDATE workers SET sent = sent + ?, failed = failed + ? WHERE name = ?", (sent, failed, worker)
+                )
+        self._transaction(write)
+
+    def release(self, job_id: int, worker: str, idxs: list[int] = None):
+        """
+        放回尚未完成的目標，讓其他 worker 立即認領 (例如此 worker 的帳號已失效)。
+        仍在 flood-wait 等待時間內的目標保持 deferred，到 defer_until 之後才會被重新認領。
+        未指定 idxs 時放回該 worker 在此工作中所有尚未完成的目標。
+        """
+        now = time.time()
+        if idxs is None:
+            self._transaction(lambda: self.conn.execute(
+                """UPDATE job_items SET status = CASE WHEN defer_until > ? THEN 'deferred' ELSE 'pending' END,
+                       worker = NULL, lease_until = NULL
+                   WHERE job_id = ? AND status IN ('claimed', 'deferred') AND worker = ?""",
+                (now, job_id, worker)
+            ))
+            return
+        self._transaction(lambda: self.conn.executemany(
+            """UPDATE job_items SET status = CASE WHEN defer_until > ? THEN 'deferred' ELSE 'pending' END,
+                   worker = NULL, lease_until = NULL
+               WHERE job_id = ? AND idx = ? AND status IN ('claimed', 'deferred') AND worker = ?""",
+            [(now, job_id, idx, worker) for idx in idxs]
+        ))
+
+    def add_upload(self, job_id: int, upload_bytes: int, upload_seconds: float, saved_bytes: int):
+        """累加為此工作上傳媒體的統計。"""
+        self._transaction(lambda: self.conn.execute(
+            """UPDATE jobs SET upload_bytes = upload_bytes + ?, upload_seconds = upload_seconds + ?,
+                   saved_bytes = saved_bytes + ? WHERE id = ?""",
+            (upload_bytes, upload_seconds, saved_bytes, job_id)
+        ))
+
+    def close(self):
+        self.conn.close()
+
+
+def task_update(task, account: str = None) -> dict:
+    """將 SendTask 的最終結果轉成檢查點的狀態更新。"""
+    status = {True: 'sent', False: 'failed', None: 'skipped'}[task.outcome]
+    return {
+        'idx': task.index,
+        'status': status,
+        'error_class': task.last_error if status != 'sent' else None,
+        'error': task.error if status != 'sent' else None,
+        'attempts': task.tries,
+        'latency_ms': round(task.latency * 1000, 1) if task.latency is not None else None,
+        'sent_at': task.sent_at,
+        'account': account or task.account,
+        'defer_until': None,
+        'deferred_seconds': task.deferred_seconds,
+    }
+
+
+class JobCheckpoint:
+    """
+    一次廣播工作的增量檢查點 (group commit)。
+    結果一產生就喚醒背景寫入；寫入進行中累積的結果會在下一個交易中一起寫入，
+    因此發送越快每次交易合併的目標越多，不會為每個目標各做一次同步寫入，也不阻塞事件循環。
+    行程中斷時只有最後一次交易尚未寫入的目標 (以及正在發送中的目標) 會在重啟後再發送一次。
+    """
+    def __init__(self, job_queue: JobQueue, job_id: int, worker: str, account: str = None):
+        self.job_queue = job_queue
+        self.job_id = job_id
+        self.worker = worker
+        self.account = account
+        self._updates = {}
+        self._lock = asyncio.Lock()
+        self._dirty = asyncio.Event()
+        self._closing = False
+        self._runner = None
+
+    def start(self):
+        if self._runner is None:
+            self._runner = asyncio.create_task(self._flush_loop())
+        return self
+
+    def record(self, task):
+        """記錄目標的最終結果 (成功/失敗/略過)。"""
+        self._updates[task.index] = task_update(task, self.account)
+        self._dirty.set()
+
+    def defer(self, task, seconds: float):
+        """記錄目標被延後，以及可再次發送的時間。"""
+        self._updates[task.index] = {
+            'idx': task.index,
+            'status': 'deferred',
+            'error_class': task.last_error,
+            'error': task.error,
+            'attempts': task.tries,
+            'latency_ms': None,
+            'sent_at': None,
+            'account': self.account or task.account,
+            'defer_until': time.time() + seconds,
+            'deferred_seconds': task.deferred_seconds,
+        }
+        self._dirty.set()
+
+    async def flush(self):
+        async with self._lock:
+            if not self._updates:
+                return
+            updates, self._updates = list(self._updates.values()), {}
+            try:
+                await asyncio.to_thread(self.job_queue.checkpoint, self.job_id, self.worker, updates)
+            except Exception as e:
+                # 寫入失敗時保留這批更新 (不覆蓋之後較新的狀態)，下次再試
+                for u in updates:
+                    self._updates.setdefault(u['idx'], u)
+                logging.warning(f"⚠️ 寫入廣播檢查點失敗: {e}")
+
+    async def _flush_loop(self):
+        while not self._closing:
+            await self._dirty.wait()
+            self._dirty.clear()
+            await self.flush()
+
+    async def close(self):
+        """停止背景寫入並寫入剩餘的狀態。不取消進行中的寫入，以免遺失已取出的更新。"""
+        if self._runner is not None:
+            self._closing = True
+            self._dirty.set()
+            await self._runner
+            self._runner = None
+        await self.flush()
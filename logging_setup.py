@@ -0,0 +1,139 @@
+import copy
+import glob
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import time
+from datetime import datetime, timedelta
+
+# 發送相關的結構化欄位 (以 logging 的 extra= 傳入)，會原樣寫入 JSON 記錄
+STRUCTURED_FIELDS = ('campaign', 'job_id', 'group_id', 'group_title', 'attempt', 'outcome', 'error_class',
+                     'account', 'wait', 'latency_ms')
+
+
+class _StructuredQueueHandler(logging.handlers.QueueHandler):
+    """
+    放入佇列前只做最少的處理：合併訊息參數、把例外轉成文字，保留 extra 欄位，
+    讓背景執行緒的 JSON 格式器仍能取得結構化欄位。
+    """
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """每筆記錄輸出一行 JSON：時間、等級、來源、訊息，以及存在的結構化欄位與例外內容。"""
+    def format(self, record):
+        data = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        if record.exc_text:
+            data['exc'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class ConsoleFormatter(logging.Formatter):
+    """主控台只顯示訊息本身 (與原本的 print 輸出相同)，例外堆疊只寫入檔案。"""
+    def format(self, record):
+        return record.getMessage()
+
+
+class _ConsoleFilter(logging.Filter):
+    """第三方套件 (例如 Telethon) 的一般訊息只寫入檔案，警告以上才顯示在主控台。"""
+    def filter(self, record):
+        return record.name == 'root' or record.levelno >= logging.WARNING
+
+
+class CompressingRotatingFileHandler(logging.handlers.BaseRotatingHandler):
+    """
+    依檔案大小與時間輪替的記錄檔。輪替後的舊檔以 gzip 壓縮 (<檔名>.<時間>.gz)，
+    只保留最近 backup_count 個。由背景記錄執行緒呼叫，不會阻塞事件循環。
+    """
+    def __init__(self, filename: str, max_bytes: int = 0, when: str = 'midnight', backup_count: int = 14):
+        super().__init__(filename, 'a', encoding='utf-8', delay=True)
+        self.max_bytes = max_bytes
+        self.when = (when or '').lower()
+        self.backup_count = backup_count
+        self.rollover_at = self._next_rollover(time.time())
+
+    def _next_rollover(self, now: float):
+        current = datetime.fromtimestamp(now)
+        if self.when == 'midnight':
+            return (current.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)).timestamp()
+        if self.when == 'hourly':
+            return (current.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)).timestamp()
+        return None
+
+    def shouldRollover(self, record) -> bool:
+        if self.rollover_at is not None and time.time() >= self.rollover_at:
+            return True
+        if self.max_bytes > 0:
+            if self.stream is None:
+                self.stream = self._open()
+            # 只比較目前的檔案大小 (寫入後才超過上限的記錄留在本檔)，不必為了預估長度把每筆記錄多格式化一次
+            if self.stream.tell() >= self.max_bytes:
+                return True
+        return False
+
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        if os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename) > 0:
+            # 檔名含微秒，依名稱排序即為輪替順序
+            rotated = f"{self.baseFilename}.{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}"
+            os.replace(self.baseFilename, rotated)
+            with open(rotated, 'rb') as src, gzip.open(rotated + '.gz', 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(rotated)
+            for old in sorted(glob.glob(glob.escape(self.baseFilename) + '.*.gz'))[:-self.backup_count or None]:
+                os.remove(old)
+        self.rollover_at = self._next_rollover(time.time())
+
+
+def setup_logging(config, filename: str = None) -> logging.handlers.QueueListener:
+    """
+    設定非阻塞的記錄管線：所有記錄先放入記憶體佇列，由背景執行緒寫入
+    JSON lines 記錄檔 (依大小/時間輪替並壓縮) 與主控台 (等級可分開設定)。
+    回傳 QueueListener，結束前呼叫 stop() 以寫完佇列中的記錄。
+    """
+    file_level = logging.getLevelName(config.log_file_level.upper())
+    console_level = logging.getLevelName(config.log_console_level.upper())
+
+    file_handler = CompressingRotatingFileHandler(filename or config.log_file, config.log_max_bytes,
+                                                  config.log_rotate_when, config.log_backup_count)
+    file_handler.setLevel(file_level)
+    file_handler.setFormatter(JsonLinesFormatter())
+
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(console_level)
+    console_handler.setFormatter(ConsoleFormatter())
+    console_handler.addFilter(_ConsoleFilter())
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_StructuredQueueHandler(log_queue))
+    root.setLevel(min(file_level, console_level))
+
+    listener = logging.handlers.QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    listener.start()
+    return listener
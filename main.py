@@ -1,23 +1,22 @@
 import asyncio
-from datetime import datetime
+import html
 import logging
-import os
-import shutil
 
-from config import Config
+from config import Config, LoggingConfig
 from telegram_client import TelegramClientManager
 from message_manager import MessageManager
+from media_processor import MediaProcessor
+from entity_cache import EntityCache
+from dialog_index import DialogIndex
+from participant_cache import ParticipantCache
 from broadcast_manager import BroadcastManager
+from job_queue import JobQueue
+from backup_manager import BackupManager
+import metrics
 from command_handler import CommandHandler
 from scheduler import Scheduler
-
-logging.basicConfig(
-    level=logging.INFO,
-    format='[%(asctime)s] [%(levelname)s] %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S',
-    filename='bot.log',
-    encoding='utf-8'
-)
+from logging_setup import setup_logging
+from startup_profile import StartupProfile
 
 class JobBot:
     """
@@ -27,19 +26,41 @@ class JobBot:
         """
         應用程式主類別，負責整合所有模組並啟動機器人。
         """
+        # 記錄各啟動階段耗時 (啟動通知與 /status 中顯示)
+        self.startup = StartupProfile()
+
         # 1. 建立唯一的 Config 實例
-        self.config = Config()
+        with self.startup.phase('載入設定'):
+            # 非阻塞記錄管線：JSON lines 記錄檔 (輪替並壓縮) 與主控台分開設定等級。
+            # 先於 Config 建立，載入設定檔時的警告 (例如檔案損毀、從備份還原) 才會寫入記錄檔
+            self.log_listener = setup_logging(LoggingConfig())
+            self.config = Config()
 
         # 2. 使用此 Config 實例初始化 Client Manager
-        self.client_manager = TelegramClientManager(self.config)
-        self.client = self.client_manager.get_client()
+        with self.startup.phase('建立客戶端'):
+            self.client_manager = TelegramClientManager(self.config)
+            self.client = self.client_manager.get_client()
 
         # 3. 將 client 實例回寫到 config 中，供需要 client 的功能使用
-        self.config.client = self.client
+        with self.startup.phase('載入快取與索引'):
+            self.config.client = self.client
+            self.entity_cache = EntityCache(self.client, writer=self.config.writer)
+            self.config.entity_cache = self.entity_cache
+            self.client_manager.attach_entity_cache(self.entity_cache)
+            # 已加入群組/頻道的持久化索引，由事件增量更新，不必每次完整掃描對話列表
+            self.dialog_index = DialogIndex(self.client, writer=self.config.writer, entity_cache=self.entity_cache)
+            # 控制群組成員的快照 (/list_members 分頁讀取)，由事件增量更新並定期在背景重新載入
+            self.participant_cache = ParticipantCache(self.client, ttl=self.config.participant_cache_ttl)
 
         # 4. 使用唯一的 Config 實例初始化其他管理員
-        self.message_manager = MessageManager()
-        self.broadcast_manager = BroadcastManager(self.client, self.config, self.message_manager)
+        with self.startup.phase('開啟工作佇列'):
+            self.message_manager = MessageManager(processor=MediaProcessor(self.config))
+            # 廣播工作佇列 (可從中斷處繼續)；協調者模式下由 worker 行程發送，本行程只處理指令與排程
+            self.job_queue = JobQueue(self.config.job_queue_path)
+            # 設定檔的增量備份 (內容去重、壓縮、保留策略)，與設定寫入共用鎖以取得一致的快照
+            self.backup_manager = BackupManager(self.config)
+            self.broadcast_manager = BroadcastManager(self.client, self.config, self.message_manager, self.entity_cache,
+                                                      pool=self.client_manager.pool, job_queue=self.job_queue)
         
         # 5. 初始化 Scheduler 和 CommandHandler (在 run 方法中進行)
         self.scheduler = None
@@ -48,7 +69,7 @@ class JobBot:
     async def send_startup_message(self):
         """在啟動時向控制群組發送通知訊息。"""
         if self.config.control_group == 0:
-            print("⚠️ 未設定控制群組，將不會發送啟動通知。")
+            logging.warning("⚠️ 未設定控制群組，將不會發送啟動通知。")
             return
         
         try:
@@ -69,84 +90,102 @@ class JobBot:
             - **排程數量:** {len(self.config.schedules)} 個
 - **目標群組:** {len(self.config.target_groups)} 個
 - **重啟次數:** {self.config.total_restarts}
+- **啟動耗時:** {self.startup.ready_after or 0:.1f} 秒
 
 使用 `/help` 取得指令說明。
 """
             await self.client.send_message(self.config.control_group, startup_msg)
         except Exception as e:
-            print(f"❌ 發送啟動訊息失敗: {e}")
+            logging.exception(f"❌ 發送啟動訊息失敗: {e}")
+
+    def format_group_page(self, page: int = 1) -> str:
+        """群組索引的一頁，標記已設定/未設定廣播與無法發言的群組。"""
+        broadcast_ids = set(g['id'] for g in self.config.target_groups)
+        items, page, pages = self.dialog_index.page(page)
+        start = (page - 1) * self.dialog_index.PAGE_SIZE
+        lines = [f"[群組/頻道偵測結果] 共 {len(self.dialog_index.entries)} 個 (第 {page}/{pages} 頁)"]
+        for idx, g in enumerate(items, start + 1):
+            mark = "[設定廣播]" if g['id'] in broadcast_ids else "[未設定廣播]"
+            if not g['can_post']:
+                mark += " [無法發言]"
+            lines.append(f"{idx}. {g['title']} ({g['id']}) {mark}")
+        if page < pages:
+            lines.append(f"下一頁: /list {page + 1}")
+        return "\n".join(lines)
 
-    async def list_all_groups(self, send_to_control_group=True):
-        """列出所有已加入的群組/頻道，標記已設定/未設定廣播。"""
-        dialogs = []
+    async def list_all_groups(self, send_to_control_group=True, page: int = 1):
+        """列出已加入的群組/頻道 (來自群組索引，第一次使用時才完整掃描)，標記已設定/未設定廣播。"""
         try:
-            async for dialog in self.client.iter_dialogs():
-                if dialog.is_group or dialog.is_channel:
-                    dialogs.append({
-                        'id': dialog.id,
-                        'title': dialog.name,
-                        'type': 'group' if dialog.is_group else 'channel'
-                    })
+            await self.dialog_index.build()
         except Exception as e:
-            print(f"❌ 取得群組/頻道名單失敗: {e}")
             logging.error(f"❌ 取得群組/頻道名單失敗: {e}")
             return
-        broadcast_ids = set(g['id'] for g in self.config.target_groups)
-        lines = ["[群組/頻道偵測結果]"]
-        for idx, g in enumerate(dialogs, 1):
-            mark = "[設定廣播]" if g['id'] in broadcast_ids else "[未設定廣播]"
-            lines.append(f"{idx}. {g['title']} ({g['id']}) {mark}")
-        result = "\n".join(lines)
-        print(result)
+        result = self.format_group_page(page)
         logging.info(result)
         if send_to_control_group and self.config.control_group:
             try:
-                await self.client.send_message(self.config.control_group, f"<pre>{result}</pre>", parse_mode="html")
+                await self.client.send_message(self.config.control_group, f"<pre>{html.escape(result)}</pre>",
+                                               parse_mode="html")
             except Exception as e:
-                print(f"❌ 發送群組/頻道名單到控制群組失敗: {e}")
                 logging.error(f"❌ 發送群組/頻道名單到控制群組失敗: {e}")
 
     async def run(self):
         self.loop = asyncio.get_running_loop()
         self.scheduler = Scheduler(self.config, self.broadcast_manager, self.loop, self.message_manager)
         self.command_handler = CommandHandler(
-            self, self.client, self.config, self.broadcast_manager, self.scheduler, self.message_manager
+            self, self.client, self.config, self.broadcast_manager, self.scheduler, self.message_manager,
+            self.entity_cache
         )
-        await self.client_manager.start()
-        await self.config.migrate_admins_from_env()
-        self.command_handler.register_handlers()
-        self.config.save_broadcast_config(is_startup=True)
-        self.scheduler.setup_schedule()
-        self.scheduler.start_background_runner()
-        await self.list_all_groups(send_to_control_group=True)  # 開機時自動列印
-        await self.send_startup_message()
-        print("✅ 機器人已準備就緒，正在等待指令...")
+        startup = self.startup
+        # 必要階段：主帳號登入後註冊指令與排程，即可開始接受指令
+        with startup.phase('連接 Telegram'):
+            await self.client_manager.start(connect_pool=False)
+        with startup.phase('註冊指令與排程'):
+            self.command_handler.register_handlers()
+            self.dialog_index.register_handlers()
+            self.participant_cache.register_handlers()
+            self.config.save_broadcast_config(is_startup=True)
+            self.scheduler.setup_schedule()
+            self.scheduler.start_background_runner()
+        with startup.phase('指標端點'):
+            self.metrics_server = await metrics.start_http_server(self.config.metrics_host, self.config.metrics_port)
+        if self.broadcast_manager.use_workers:
+            logging.info(f"🛰️ 協調者模式：廣播將排入 {self.config.job_queue_path}，由 worker.py 行程發送。")
+        self.entity_cache.start_background_refresh()
+
+        # 非必要工作在背景並行執行，不延後就緒時間
+        pool_task = startup.background('連接其他發送帳號', self.client_manager.start_pool())
+        admins_task = startup.background('遷移管理員', self.config.migrate_admins_from_env())
+        startup.background('群組索引', self.list_all_groups(send_to_control_group=True))  # 開機時自動列印
+        startup.background('備份設定檔', self.backup_manager.snapshot())
+        startup.background('啟動通知', self.send_startup_message(), after=[admins_task])
+        # 上次中斷前尚未完成的廣播，等所有發送帳號連線後只發送剩下的目標
+        self.resume_task = asyncio.create_task(self.resume_unfinished_jobs(pool_task))
+        self.backup_manager.start_background_backup()
+        startup.mark_ready()
         logging.info("✅ 機器人已準備就緒，正在等待指令...")
-        await self.client.run_until_disconnected()
+        try:
+            await self.client.run_until_disconnected()
+        finally:
+            self.backup_manager.stop()
+            # 關閉前把合併中尚未寫入的設定寫入磁碟
+            await self.config.flush()
+
+    async def resume_unfinished_jobs(self, pool_task: asyncio.Task):
+        await pool_task
+        await self.broadcast_manager.resume_unfinished_jobs()
 
-def backup_files():
-    os.makedirs('backup', exist_ok=True)
-    now = datetime.now().strftime('%Y%m%d_%H%M%S')
-    for f in ['settings.json', 'admins.json', 'broadcast_config.json', 'broadcast_history.json']:
-        if os.path.exists(f):
-            shutil.copy(f, f'backup/{f}.{now}.bak')
 
 if __name__ == '__main__':
-    # 啟動時建立備份資料夾
-    os.makedirs('backup', exist_ok=True)
-    # 啟動時立即備份一次
-    backup_files()
-    # 啟動每小時定時備份
-    import threading
-    def hourly_backup():
-        backup_files()
-        # 每1小時（3600秒）執行一次
-        threading.Timer(3600, hourly_backup).start()
-    hourly_backup()
+    bot = None
     try:
         bot = JobBot()
         asyncio.run(bot.run())
     except Exception as e:
-        print(f"❌ 程式發生嚴重錯誤: {e}")
+        logging.exception(f"❌ 程式發生嚴重錯誤: {e}")
     finally:
-        print("\n👋 程式已停止。")
+        logging.info("👋 程式已停止。")
+        if bot:
+            bot.config.flush_sync()
+            # 寫完佇列中尚未寫入檔案的記錄
+            bot.log_listener.stop()
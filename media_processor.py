@@ -0,0 +1,351 @@
+"""
+活動媒體前處理 (離線執行)。
+
+把活動資料夾中的原始圖片與影片轉成較小、適合 Telegram 的檔案：
+- 圖片：縮小到 MEDIA_MAX_DIMENSION 以內並重新壓縮為 JPEG (需要 Pillow)
+- 影片：轉為 H.264/AAC 的 MP4 並加上 faststart (可邊下載邊播放)，同時產生縮圖與長度/尺寸資訊 (需要 ffmpeg/ffprobe)
+處理結果以原始檔案內容的 hash 命名，存放在活動資料夾中的 .optimized/；原始檔未變更時不會重新處理。
+載入活動內容時若有處理好的檔案，就會改為發送處理後的檔案。
+
+用法:
+    python media_processor.py                 # 處理所有活動
+    python media_processor.py campaign_A      # 只處理指定活動
+"""
+import concurrent.futures
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+
+from persistence import atomic_write_text
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow 為選用套件，未安裝時不處理圖片
+    Image = None
+
+CACHE_DIR = '.optimized'
+# Telegram 接受的圖片上限 (與 Telethon send_file 自動縮小的門檻相同)
+UPLOAD_PHOTO_DIMENSION = 2560
+UPLOAD_PHOTO_BYTES = 10_000_000
+MANIFEST = 'manifest.json'
+IMAGE_EXTENSIONS = ('jpg', 'jpeg', 'png')
+VIDEO_EXTENSIONS = ('mp4', 'mov', 'avi')
+# Telegram 影片縮圖的最大邊長
+THUMB_SIZE = 320
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _scale_filter(size: int) -> str:
+    """ffmpeg 縮放參數：長邊不超過 size、保持比例且尺寸為偶數 (yuv420p 的要求)。"""
+    return (f"scale='if(gte(iw,ih),trunc(min(iw,{size})/2)*2,-2)'"
+            f":'if(gte(iw,ih),-2,trunc(min(ih,{size})/2)*2)'")
+
+
+def _ffmpeg(*args):
+    subprocess.run(['ffmpeg', '-y', '-v', 'error', *args], check=True, capture_output=True)
+
+
+def probe_video(path: str) -> dict:
+    output = subprocess.run(
+        ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'stream=width,height:format=duration',
+         '-of', 'json', path],
+        check=True, capture_output=True, text=True
+    ).stdout
+    data = json.loads(output)
+    stream = (data.get('streams') or [{}])[0]
+    return {
+        'duration': float(data.get('format', {}).get('duration') or 0),
+        'width': int(stream.get('width') or 0),
+        'height': int(stream.get('height') or 0),
+    }
+
+
+def _flatten_to_rgb(image):
+    """JPEG 沒有透明度：透明區域以白色填滿，其餘模式轉為 RGB。"""
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    if image.mode != 'RGB':
+        return image.convert('RGB')
+    return image
+
+
+def resize_photo_for_upload(path: str, max_dimension: int = UPLOAD_PHOTO_DIMENSION,
+                            max_bytes: int = UPLOAD_PHOTO_BYTES):
+    """
+    與 send_file 收到圖片路徑時相同的處理：超過 max_dimension 或 max_bytes 的圖片縮小並轉為 JPEG，
+    回傳記憶體中的檔案 (BytesIO)；不需處理、未安裝 Pillow 或無法讀取時回傳原路徑。
+    """
+    if Image is None:
+        return path
+    try:
+        with Image.open(path) as image:
+            if max(image.size) <= max_dimension and os.path.getsize(path) <= max_bytes:
+                return path
+            exif = image.info.get('exif')
+            image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+            buffer = io.BytesIO()
+            _flatten_to_rgb(image).save(buffer, 'JPEG', progressive=True, **({'exif': exif} if exif else {}))
+    except OSError:
+        return path
+    buffer.seek(0)
+    buffer.name = f"{os.path.splitext(os.path.basename(path))[0]}.jpg"
+    return buffer
+
+
+def optimize_image(src: str, dst: str, max_dimension: int, quality: int):
+    """縮小並重新壓縮圖片為 JPEG。沒有縮小且結果不比原檔小時刪除輸出並回傳 None (沿用原檔)。"""
+    with Image.open(src) as original:
+        image = ImageOps.exif_transpose(original)
+        resized = max(image.size) > max_dimension
+        if resized:
+            image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+        image = _flatten_to_rgb(image)
+        image.save(dst, 'JPEG', quality=quality, optimize=True, progressive=True)
+        width, height = image.size
+    if not resized and os.path.getsize(dst) >= os.path.getsize(src):
+        os.remove(dst)
+        return None
+    return {'kind': 'photo', 'width': width, 'height': height}
+
+
+def transcode_video(src: str, dst: str, thumb: str, max_dimension: int, crf: int) -> dict:
+    """轉為可串流播放的 MP4，並產生縮圖；回傳長度與尺寸資訊。"""
+    _ffmpeg('-i', src, '-map', '0:v:0', '-map', '0:a:0?', '-c:v', 'libx264', '-preset', 'veryfast',
+            '-crf', str(crf), '-vf', _scale_filter(max_dimension), '-pix_fmt', 'yuv420p',
+            '-c:a', 'aac', '-b:a', '128k', '-movflags', '+faststart', dst)
+    if src.lower().endswith('.mp4') and os.path.getsize(dst) >= os.path.getsize(src):
+        # 重新編碼沒有變小：改為只重新封裝 (加上 faststart)，保留原本的畫質
+        _ffmpeg('-i', src, '-map', '0:v:0', '-map', '0:a:0?', '-c', 'copy', '-movflags', '+faststart', dst)
+    info = probe_video(dst)
+    _ffmpeg('-ss', str(min(1.0, info['duration'] / 2)), '-i', dst, '-frames:v', '1',
+            '-vf', _scale_filter(THUMB_SIZE), thumb)
+    return {'kind': 'video', **info, 'thumb': os.path.basename(thumb)}
+
+
+def process_file(kind: str, src: str, dst: str, thumb: str, max_dimension: int, quality: int, crf: int):
+    """在行程池中執行的單一檔案處理。"""
+    if kind == 'photo':
+        return optimize_image(src, dst, max_dimension, quality)
+    return transcode_video(src, dst, thumb, max_dimension, crf)
+
+
+class MediaProcessor:
+    """
+    活動媒體的前處理與快取查詢。
+    optimize_campaign() 以行程池處理整個活動資料夾 (CPU 密集，應在事件循環之外執行)；
+    resolve() 只讀取 manifest，在載入活動內容時以處理好的檔案取代原始檔案。
+    """
+    def __init__(self, config):
+        self.max_dimension = config.media_max_dimension
+        self.jpeg_quality = config.media_jpeg_quality
+        self.video_crf = config.media_video_crf
+        self.workers = max(1, config.media_workers)
+
+    @staticmethod
+    def available() -> dict:
+        """各類媒體的處理工具是否可用 (Pillow 與 ffmpeg 都是選用的)。"""
+        return {'photo': Image is not None, 'video': bool(shutil.which('ffmpeg') and shutil.which('ffprobe'))}
+
+    @staticmethod
+    def _kind(name: str):
+        ext = os.path.splitext(name)[1][1:].lower()
+        if ext in IMAGE_EXTENSIONS:
+            return 'photo'
+        if ext in VIDEO_EXTENSIONS:
+            return 'video'
+        return None
+
+    @staticmethod
+    def _load_manifest(cache_dir: str) -> dict:
+        try:
+            with open(os.path.join(cache_dir, MANIFEST), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def signature(campaign_path: str):
+        """處理結果的版本 (manifest 的 mtime)，讓活動內容快取在重新處理後失效。"""
+        try:
+            return os.stat(os.path.join(campaign_path, CACHE_DIR, MANIFEST)).st_mtime_ns
+        except OSError:
+            return None
+
+    def optimize_campaign(self, campaign_path: str) -> dict:
+        """
+        處理活動資料夾中的圖片與影片，回傳統計。
+        已處理且未變更的檔案直接跳過；內容相同的檔案 (相同 hash) 共用同一份輸出。
+        """
+        available = self.available()
+        cache_dir = os.path.join(campaign_path, CACHE_DIR)
+        manifest = self._load_manifest(cache_dir)
+        by_hash = {rec['hash']: rec for rec in manifest.values()
+                   if rec.get('output') is None or os.path.exists(os.path.join(cache_dir, rec['output']))}
+        stats = {'processed': 0, 'cached': 0, 'unchanged': 0, 'skipped': 0, 'failed': 0,
+                 'bytes_before': 0, 'bytes_after': 0}
+
+        sources = {}
+        pending = {}
+        # 同一次處理中內容相同的其他檔案，等第一個處理完再共用結果
+        duplicates = {}
+        pending_hashes = set()
+        with os.scandir(campaign_path) as entries:
+            for entry in sorted(entries, key=lambda e: e.name):
+                kind = self._kind(entry.name)
+                if entry.name.startswith('.') or not entry.is_file() or kind is None:
+                    continue
+                stat = entry.stat()
+                sources[entry.name] = stat
+                if not available[kind]:
+                    stats['skipped'] += 1
+                    continue
+                record = manifest.get(entry.name)
+                if record and record['size'] == stat.st_size and record['mtime_ns'] == stat.st_mtime_ns \
+                        and record['hash'] in by_hash:
+                    stats['cached'] += 1
+                    continue
+                digest = file_hash(entry.path)
+                if digest in by_hash:
+                    # 內容已處理過 (檔案只是被複製或更新了 mtime)
+                    manifest[entry.name] = {**by_hash[digest], 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+                    stats['cached'] += 1
+                    continue
+                if digest in pending_hashes:
+                    duplicates[entry.name] = (digest, stat)
+                    continue
+                pending_hashes.add(digest)
+                output = f"{digest[:16]}.{'jpg' if kind == 'photo' else 'mp4'}"
+                thumb = f"{digest[:16]}.thumb.jpg" if kind == 'video' else None
+                pending[entry.name] = (kind, entry.path, digest, output, thumb, stat)
+
+        if pending:
+            os.makedirs(cache_dir, exist_ok=True)
+            # 由執行中的機器人 (事件循環與多個執行緒) 呼叫時不能 fork，子行程以 spawn 啟動，只匯入本模組
+            with concurrent.futures.ProcessPoolExecutor(max_workers=min(self.workers, len(pending)),
+                                                        mp_context=multiprocessing.get_context('spawn')) as pool:
+                futures = {
+                    pool.submit(process_file, kind, path, os.path.join(cache_dir, output),
+                                os.path.join(cache_dir, thumb) if thumb else None,
+                                self.max_dimension, self.jpeg_quality, self.video_crf): name
+                    for name, (kind, path, digest, output, thumb, stat) in pending.items()
+                }
+                for future in concurrent.futures.as_completed(futures):
+                    name = futures[future]
+                    kind, path, digest, output, thumb, stat = pending[name]
+                    try:
+                        info = future.result()
+                    except Exception as e:
+                        stats['failed'] += 1
+                        logging.warning(f"⚠️ 媒體前處理失敗，將發送原始檔案: {path} - {e}")
+                        continue
+                    manifest[name] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': digest,
+                                      'output': output if info else None, 'info': info}
+                    if info:
+                        stats['processed'] += 1
+                        stats['bytes_before'] += stat.st_size
+                        stats['bytes_after'] += os.path.getsize(os.path.join(cache_dir, output))
+                    else:
+                        stats['unchanged'] += 1
+            processed = {record['hash']: record for record in manifest.values()}
+            for name, (digest, stat) in duplicates.items():
+                if digest in processed:
+                    manifest[name] = {**processed[digest], 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+                    stats['cached'] += 1
+
+        # 原始檔已刪除的記錄與不再被引用的輸出檔一併清除
+        for name in [n for n in manifest if n not in sources]:
+            del manifest[name]
+        if os.path.isdir(cache_dir):
+            referenced = {MANIFEST}
+            for record in manifest.values():
+                referenced.add(record.get('output'))
+                referenced.add((record.get('info') or {}).get('thumb'))
+            for name in os.listdir(cache_dir):
+                if name not in referenced:
+                    os.remove(os.path.join(cache_dir, name))
+            atomic_write_text(os.path.join(cache_dir, MANIFEST), json.dumps(manifest, ensure_ascii=False, indent=2))
+        return stats
+
+    def resolve(self, campaign_path: str, content: dict) -> dict:
+        """
+        以處理好的檔案取代內容中的原始媒體路徑 (原始檔案變更後就不再使用舊的輸出)，
+        並把影片的長度、尺寸與縮圖放入 content['media_info'] (以發送路徑為 key)。
+        """
+        cache_dir = os.path.join(campaign_path, CACHE_DIR)
+        manifest = self._load_manifest(cache_dir)
+        if not manifest:
+            return content
+        replaced = {}
+        media_info = {}
+        for path in content["media"] + [content["photo"], content["video"]]:
+            if not path or path in replaced:
+                continue
+            record = manifest.get(os.path.basename(path))
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if not record or not record.get('output') or record['size'] != stat.st_size \
+                    or record['mtime_ns'] != stat.st_mtime_ns:
+                continue
+            output = os.path.join(cache_dir, record['output'])
+            if not os.path.exists(output):
+                continue
+            replaced[path] = output
+            info = record.get('info') or {}
+            if info.get('kind') == 'video':
+                media_info[output] = {**info, 'thumb': os.path.join(cache_dir, info['thumb']) if info.get('thumb') else None}
+        if replaced:
+            content["media"] = [replaced.get(p, p) for p in content["media"]]
+            for key in ("photo", "video"):
+                if content[key]:
+                    content[key] = replaced.get(content[key], content[key])
+            content["media_info"] = media_info
+            logging.info(f"🪄 使用 {len(replaced)} 個前處理過的媒體檔案",
+                         extra={'campaign': os.path.basename(campaign_path)})
+        return content
+
+
+def format_stats(campaign: str, stats: dict) -> str:
+    saved = stats['bytes_before'] - stats['bytes_after']
+    text = (f"{campaign}: 處理 {stats['processed']}、沿用快取 {stats['cached']}、無需處理 {stats['unchanged']}、"
+            f"失敗 {stats['failed']}")
+    if stats['skipped']:
+        text += f"、缺少工具略過 {stats['skipped']}"
+    if stats['processed']:
+        text += f" (縮小 {saved / 1024 / 1024:.2f} MB，{stats['bytes_after'] / max(1, stats['bytes_before']):.0%})"
+    return text
+
+
+if __name__ == '__main__':
+    from config import Config
+    from message_manager import MessageManager
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    config = Config()
+    processor = MediaProcessor(config)
+    tools = processor.available()
+    if not tools['photo']:
+        logging.warning("⚠️ 未安裝 Pillow，將略過圖片處理 (pip install Pillow)。")
+    if not tools['video']:
+        logging.warning("⚠️ 找不到 ffmpeg/ffprobe，將略過影片處理。")
+    campaigns = sys.argv[1:] or MessageManager().list_campaigns()
+    for name in campaigns:
+        result = processor.optimize_campaign(os.path.join(MessageManager.CONTENT_DB_PATH, name))
+        logging.info(f"🪄 {format_stats(name, result)}", extra={'campaign': name})
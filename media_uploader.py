@@ -0,0 +1,115 @@
+import asyncio
+import io
+import logging
+import os
+import time
+
+from telethon import types, utils
+
+from media_processor import resize_photo_for_upload
+from metrics import UPLOAD_BYTES, UPLOAD_SECONDS
+
+PHOTO_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi')
+
+
+class UploadedMedia:
+    """
+    單一媒體檔案在一次廣播中的上傳結果。
+    第一次成功發送後改用訊息回傳的 media 物件，之後的目標直接引用伺服器上的同一份檔案。
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.handle = None
+        self.bytes = 0
+        self.seconds = 0.0
+        self.sends = 0
+
+    @property
+    def file(self):
+        """送給 send_file 的檔案參數：已上傳的 handle，上傳失敗時退回原始路徑。"""
+        return self.handle if self.handle is not None else self.path
+
+    def remember_sent(self, message):
+        """記錄一次成功發送，並改用該訊息的 media 作為之後的 handle。"""
+        self.sends += 1
+        media = getattr(message, 'media', None)
+        if media is not None:
+            self.handle = media
+
+
+class MediaUploader:
+    """
+    每次廣播建立一個，確保同一個媒體檔案只上傳一次，並統計上傳量與耗時。
+    """
+    def __init__(self, client):
+        self.client = client
+        self.uploads = {}
+        self._locks = {}
+
+    async def prepare(self, path: str, info: dict = None) -> UploadedMedia:
+        """
+        上傳檔案 (同一路徑只會上傳一次) 並回傳可重複使用的 UploadedMedia。
+        提供前處理得到的影片資訊 (長度、尺寸、縮圖) 時，一併上傳縮圖並標記為可串流播放的影片。
+        """
+        lock = self._locks.setdefault(path, asyncio.Lock())
+        async with lock:
+            if path in self.uploads:
+                return self.uploads[path]
+            media = UploadedMedia(path)
+            start = time.monotonic()
+            try:
+                upload = path
+                ext = os.path.splitext(path)[1].lower()
+                is_video = bool(info and info.get('kind') == 'video')
+                if not is_video and ext in PHOTO_EXTENSIONS:
+                    # send_file 收到路徑時會先把超過 2560px 或 10 MB 的圖片縮小再上傳；預先上傳時套用同樣的處理，
+                    # 否則伺服器會以 PhotoInvalidDimensions / PhotoSaveFileInvalid 拒絕過大的圖片
+                    upload = await asyncio.to_thread(resize_photo_for_upload, path)
+                media.handle = await self.client.upload_file(upload)
+                media.bytes = upload.getbuffer().nbytes if isinstance(upload, io.BytesIO) else os.path.getsize(path)
+                if is_video:
+                    media.handle = await self._video_media(media, info)
+                elif ext in VIDEO_EXTENSIONS:
+                    # 未經前處理的影片：與 send_file(路徑) 相同，由檔案推斷長度、尺寸等屬性，否則會以 0:00 或一般檔案顯示
+                    media.handle = await asyncio.to_thread(self._document_media, media)
+                UPLOAD_BYTES.inc(media.bytes)
+                UPLOAD_SECONDS.observe(time.monotonic() - start)
+                logging.info(f"⬆️ 已上傳媒體: {path} ({media.bytes / 1024 / 1024:.2f} MB)")
+            except Exception as e:
+                # 上傳失敗時退回每次發送都上傳檔案的舊行為，不中斷廣播
+                logging.warning(f"⚠️ 預先上傳媒體失敗，將改為逐一上傳: {path} - {e}")
+            media.seconds = time.monotonic() - start
+            self.uploads[path] = media
+            return media
+
+    @staticmethod
+    def _document_media(media: UploadedMedia):
+        attributes, mime_type = utils.get_attributes(media.path, supports_streaming=True)
+        return types.InputMediaUploadedDocument(file=media.handle, mime_type=mime_type, attributes=attributes)
+
+    async def _video_media(self, media: UploadedMedia, info: dict):
+        thumb = None
+        if info.get('thumb') and os.path.exists(info['thumb']):
+            thumb = await self.client.upload_file(info['thumb'])
+            media.bytes += os.path.getsize(info['thumb'])
+        attributes = [
+            types.DocumentAttributeVideo(duration=info['duration'], w=info['width'], h=info['height'],
+                                         supports_streaming=True),
+            types.DocumentAttributeFilename(os.path.basename(media.path)),
+        ]
+        return types.InputMediaUploadedDocument(file=media.handle, mime_type='video/mp4', attributes=attributes,
+                                                thumb=thumb)
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(m.bytes for m in self.uploads.values())
+
+    @property
+    def total_seconds(self) -> float:
+        return sum(m.seconds for m in self.uploads.values())
+
+    @property
+    def saved_bytes(self) -> int:
+        """與「每個目標各上傳一次」相比省下的上傳量。"""
+        return sum(m.bytes * max(0, m.sends - 1) for m in self.uploads.values())
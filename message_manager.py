@@ -1,71 +1,186 @@
+import logging
 import os
-import glob
+import re
+import time
+from collections import OrderedDict
 
 class MessageManager:
     """
     管理廣播活動內容的相關操作，包括列出活動、載入活動內容（文字、圖片、影片、GIF）。
+    活動清單與已解析的內容會快取在記憶體中，並以資料夾/檔案的 mtime 判斷是否需要重新讀取。
     """
     CONTENT_DB_PATH = "content_databases"
+    # 最多快取幾個活動的內容
+    CACHE_SIZE = 128
+    # 活動清單的 mtime 檢查間隔 (秒)，避免每次查詢都對慢速儲存做 stat
+    INDEX_CHECK_INTERVAL = 2.0
+
+    # 媒體副檔名，依優先順序：圖片 -> 影片 -> GIF
+    MEDIA_EXTENSIONS = [
+        ("photo", ["jpg", "jpeg", "png"]),
+        ("video", ["mp4", "mov", "avi"]),
+        ("gif", ["gif"]),
+    ]
+    # 可組成相簿一起發送的媒體類型 (GIF 在 Telegram 中無法放入相簿)
+    ALBUM_KINDS = ("photo", "video")
+
+    def __init__(self, cache_size: int = CACHE_SIZE, processor=None):
+        self.cache_size = cache_size
+        # 媒體前處理 (MediaProcessor)：有處理好的檔案時改為發送處理後的檔案
+        self.processor = processor
+        self._campaigns = []
+        self._campaign_set = set()
+        self._index_mtime = None
+        self._index_checked_at = 0.0
+        self._content_cache = OrderedDict()
+
+    def _refresh_index(self):
+        """目錄 mtime 改變 (新增/刪除/改名活動) 時才重新掃描活動清單。"""
+        now = time.monotonic()
+        if self._index_mtime is not None and now - self._index_checked_at < self.INDEX_CHECK_INTERVAL:
+            return
+        self._index_checked_at = now
+        try:
+            mtime = os.stat(self.CONTENT_DB_PATH).st_mtime_ns
+        except OSError:
+            if self._index_mtime != -1:
+                logging.warning(f"⚠️ 找不到內容資料庫目錄：{self.CONTENT_DB_PATH}")
+            self._index_mtime = -1
+            self._campaigns = []
+            self._campaign_set = set()
+            self._content_cache.clear()
+            return
+        if mtime == self._index_mtime:
+            return
+
+        with os.scandir(self.CONTENT_DB_PATH) as entries:
+            campaigns = sorted(e.name for e in entries if e.is_dir())
+        self._campaigns = campaigns
+        self._campaign_set = set(campaigns)
+        self._index_mtime = mtime
+        # 已刪除的活動不必繼續佔用快取
+        for name in [n for n in self._content_cache if n not in self._campaign_set]:
+            del self._content_cache[name]
+        logging.info(f"📂 已找到 {len(campaigns)} 個廣播活動：{', '.join(campaigns)}")
 
     def list_campaigns(self) -> list[str]:
         """
         列出 content_databases 目錄下所有可用的廣播活動（子資料夾名稱）。
         """
-        if not os.path.isdir(self.CONTENT_DB_PATH):
-            print(f"⚠️ 找不到內容資料庫目錄：{self.CONTENT_DB_PATH}")
-            return []
-        
-        campaigns = [d for d in os.listdir(self.CONTENT_DB_PATH) if os.path.isdir(os.path.join(self.CONTENT_DB_PATH, d))]
-        print(f"📂 已找到 {len(campaigns)} 個廣播活動：{', '.join(campaigns)}")
-        return campaigns
+        self._refresh_index()
+        return list(self._campaigns)
+
+    def has_campaign(self, campaign_name: str) -> bool:
+        """檢查活動是否存在 (使用快取的索引，O(1))。"""
+        self._refresh_index()
+        return campaign_name in self._campaign_set
+
+    def invalidate(self, campaign_name: str = None):
+        """手動清除快取；未指定活動時清除全部 (包含活動清單)。"""
+        if campaign_name is None:
+            self._content_cache.clear()
+            self._index_mtime = None
+        else:
+            self._content_cache.pop(campaign_name, None)
+
+    def _content_signature(self, campaign_path: str):
+        """以活動資料夾與 message.txt 的 mtime/大小作為內容版本；資料夾不存在時回傳 None。"""
+        try:
+            dir_stat = os.stat(campaign_path)
+        except OSError:
+            return None
+        try:
+            msg_stat = os.stat(os.path.join(campaign_path, "message.txt"))
+            msg_sig = (msg_stat.st_mtime_ns, msg_stat.st_size)
+        except OSError:
+            msg_sig = None
+        optimized_sig = self.processor.signature(campaign_path) if self.processor else None
+        return (dir_stat.st_mtime_ns, msg_sig, optimized_sig)
 
     def load_campaign_content(self, campaign_name: str) -> dict:
         """
         從指定的廣播活動資料夾載入內容，包括文字、圖片、影片和GIF。
+        內容未變更時直接回傳快取結果。
         """
         campaign_path = os.path.join(self.CONTENT_DB_PATH, campaign_name)
+        signature = self._content_signature(campaign_path)
+        if signature is None:
+            logging.error(f"❌ 找不到指定的廣播活動資料夾：{campaign_path}", extra={'campaign': campaign_name})
+            self._content_cache.pop(campaign_name, None)
+            return {"text": "", "photo": None, "video": None, "gif": None, "media": []}
+
+        cached = self._content_cache.get(campaign_name)
+        if cached and cached[0] == signature:
+            self._content_cache.move_to_end(campaign_name)
+            return dict(cached[1])
+
+        content = self._read_campaign(campaign_path)
+        self._content_cache[campaign_name] = (signature, content)
+        self._content_cache.move_to_end(campaign_name)
+        while len(self._content_cache) > self.cache_size:
+            self._content_cache.popitem(last=False)
+        return dict(content)
+
+    def _read_campaign(self, campaign_path: str) -> dict:
+        """
+        實際讀取活動資料夾：一次 scandir 取代逐一副檔名的 glob。
+        content["media"] 為要發送的全部媒體：資料夾中所有圖片與影片依檔名自然排序 (2.jpg 在 10.jpg 之前)
+        組成相簿；沒有圖片或影片時為第一個 GIF。photo / video / gif 保留各類型的第一個檔案。
+        """
         content = {
             "text": "",
             "photo": None,
             "video": None,
-            "gif": None
+            "gif": None,
+            "media": []
         }
 
-        if not os.path.isdir(campaign_path):
-            print(f"❌ 找不到指定的廣播活動資料夾：{campaign_path}")
-            return content
-
+        extra = {'campaign': os.path.basename(campaign_path)}
         # 載入文字內容 (message.txt)
         message_file_path = os.path.join(campaign_path, "message.txt")
         if os.path.exists(message_file_path):
             try:
                 with open(message_file_path, 'r', encoding='utf-8') as f:
                     content["text"] = f.read().strip()
-                    print(f"📄 已載入活動文案: {message_file_path} ({len(content['text'])} 字符)")
+                    logging.info(f"📄 已載入活動文案: {message_file_path} ({len(content['text'])} 字符)", extra=extra)
             except Exception as e:
-                print(f"❌ 載入活動文案檔案失敗: {message_file_path} - {e}")
-
-        # 搜尋圖片、影片和GIF
-        # 優先順序：圖片 -> 影片 -> GIF
-        for ext in ["jpg", "jpeg", "png"]:
-            files = glob.glob(os.path.join(campaign_path, f"*.{ext}"))
-            if files:
-                content["photo"] = files[0] # 只取第一個找到的圖片
-                print(f"🖼️ 已找到圖片: {content['photo']}")
-                break
+                logging.exception(f"❌ 載入活動文案檔案失敗: {message_file_path} - {e}", extra=extra)
 
-        if not content["photo"]:
-            for ext in ["mp4", "mov", "avi"]:
-                files = glob.glob(os.path.join(campaign_path, f"*.{ext}"))
-                if files:
-                    content["video"] = files[0] # 只取第一個找到的影片
-                    print(f"🎬 已找到影片: {content['video']}")
+        # 依副檔名分組，隱藏檔 (如 .DS_Store) 不列入
+        files_by_ext = {}
+        with os.scandir(campaign_path) as entries:
+            for entry in sorted(entries, key=lambda e: _natural_key(e.name)):
+                if entry.name.startswith('.') or not entry.is_file():
+                    continue
+                ext = os.path.splitext(entry.name)[1][1:].lower()
+                files_by_ext.setdefault(ext, []).append(entry.path)
+
+        # photo / video / gif 依優先順序 (圖片 -> 影片 -> GIF) 只記錄第一個找到的檔案
+        icons = {"photo": "🖼️ 已找到圖片", "video": "🎬 已找到影片", "gif": "✨ 已找到GIF"}
+        for kind, extensions in self.MEDIA_EXTENSIONS:
+            for ext in extensions:
+                if files_by_ext.get(ext):
+                    content[kind] = files_by_ext[ext][0]
+                    logging.info(f"{icons[kind]}: {content[kind]}", extra=extra)
                     break
+            if content[kind]:
+                break
 
-        if not content["photo"] and not content["video"]:
-            files = glob.glob(os.path.join(campaign_path, "*.gif"))
-            if files:
-                content["gif"] = files[0] # 只取第一個找到的GIF
-                print(f"✨ 已找到GIF: {content['gif']}")
+        kind_by_ext = {ext: kind for kind, extensions in self.MEDIA_EXTENSIONS for ext in extensions}
+        album = sorted((path for ext, paths in files_by_ext.items() if kind_by_ext.get(ext) in self.ALBUM_KINDS
+                        for path in paths), key=lambda path: _natural_key(os.path.basename(path)))
+        if album:
+            content["media"] = album
+        elif content["gif"]:
+            content["media"] = [content["gif"]]
+        if len(content["media"]) > 1:
+            logging.info(f"🗂️ 已找到 {len(content['media'])} 個媒體，將以相簿發送", extra=extra)
 
+        if self.processor and content["media"]:
+            content = self.processor.resolve(campaign_path, content)
         return content
+
+
+def _natural_key(name: str) -> list:
+    """檔名自然排序：數字部分依數值比較。"""
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', name)]
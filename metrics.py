@@ -0,0 +1,231 @@
+import asyncio
+import bisect
+import logging
+import threading
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + [f'{n}="{v}"' for n, v in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    """指標的共同部分：名稱、說明、標籤，以及每組標籤值各自的數值。"""
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} 需要標籤 {self.labelnames}，收到 {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """只增不減的計數器 (例如發送次數、flood-wait 秒數)。"""
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def items(self) -> list[tuple[tuple, float]]:
+        with self._lock:
+            return sorted(self._values.items())
+
+    def total(self) -> float:
+        with self._lock:
+            return sum(self._values.values())
+
+    def render(self) -> list[str]:
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}"
+                                for k, v in self.items()]
+
+
+class Gauge(Counter):
+    """可增可減的即時數值 (例如佇列深度、發送中的請求數)。"""
+    kind = 'gauge'
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """
+    固定 bucket 的分佈統計 (例如每次發送延遲、上傳耗時、排程觸發延遲)。
+    除了 Prometheus 格式輸出外，也能以 bucket 內線性插值估算分位數，供 /metrics 指令摘要使用。
+    """
+    kind = 'histogram'
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            state['counts'][index] += 1
+            state['sum'] += value
+            state['count'] += 1
+
+    def _merged(self) -> dict:
+        """合併所有標籤組合的分佈。"""
+        merged = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+        with self._lock:
+            for state in self._values.values():
+                merged['counts'] = [a + b for a, b in zip(merged['counts'], state['counts'])]
+                merged['sum'] += state['sum']
+                merged['count'] += state['count']
+        return merged
+
+    def count(self) -> int:
+        return self._merged()['count']
+
+    def mean(self) -> float:
+        merged = self._merged()
+        return merged['sum'] / merged['count'] if merged['count'] else None
+
+    def quantile(self, q: float) -> float:
+        """估算分位數 (與 Prometheus histogram_quantile 相同的線性插值)；沒有資料時回傳 None。"""
+        merged = self._merged()
+        if not merged['count']:
+            return None
+        rank = q * merged['count']
+        cumulative = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, merged['counts']):
+            if cumulative + count >= rank and count:
+                if bound == float('inf'):
+                    return lower
+                return lower + (bound - lower) * (rank - cumulative) / count
+            cumulative += count
+            lower = bound if bound != float('inf') else lower
+        return lower
+
+    def render(self) -> list[str]:
+        lines = self.header()
+        with self._lock:
+            items = sorted((k, {'counts': list(v['counts']), 'sum': v['sum'], 'count': v['count']})
+                           for k, v in self._values.items())
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state['counts']):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state['sum'])}")
+            lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+
+class Registry:
+    """行程內所有指標的集合，可輸出 Prometheus text format。"""
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric: _Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"指標名稱重複: {metric.name}")
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# --- 發送路徑 ---
+SEND_ATTEMPTS = Counter('userbot_send_attempts_total', '每次發送嘗試的結果 (sent/failed/requeued) 與錯誤類別',
+                        ['outcome', 'error_class'])
+SEND_LATENCY = Histogram('userbot_send_latency_seconds', '單次發送請求的耗時 (秒)')
+SENDS_IN_FLIGHT = Gauge('userbot_sends_in_flight', '目前正在等待 Telegram 回應的發送請求數')
+SEND_QUEUE_DEPTH = Gauge('userbot_send_queue_depth', '發送佇列中等待 (含延後重試) 的目標數')
+FLOOD_WAIT_SECONDS = Counter('userbot_flood_wait_seconds_total', '伺服器要求等待的累計秒數', ['kind'])
+UPLOAD_SECONDS = Histogram('userbot_upload_seconds', '媒體上傳耗時 (秒)',
+                           buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300))
+UPLOAD_BYTES = Counter('userbot_upload_bytes_total', '實際上傳的媒體位元組數')
+BROADCASTS = Counter('userbot_broadcasts_total', '完成的廣播工作數')
+
+# --- 排程 ---
+SCHEDULE_FIRE_DELAY = Histogram('userbot_schedule_fire_delay_seconds', '排程實際觸發時間與預定時間的差 (秒)',
+                                buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30, 60))
+SCHEDULE_RUNS = Counter('userbot_schedule_runs_total', '排程廣播的執行次數與結果', ['result'])
+
+# --- 啟動 ---
+STARTUP_PHASE_SECONDS = Gauge('userbot_startup_phase_seconds', '最近一次啟動各階段的耗時 (秒)，ready 為可接受指令前的總耗時',
+                              ['phase'])
+
+
+async def _handle_http(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, registry: Registry):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), 5)
+        # 讀完標頭即可，不需要內容
+        while (await asyncio.wait_for(reader.readline(), 5)) not in (b'\r\n', b'\n', b''):
+            pass
+        parts = request_line.decode('latin-1').split()
+        if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] in ('/metrics', '/'):
+            body = registry.render().encode('utf-8')
+            status = '200 OK'
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        else:
+            body = b'not found\n'
+            status = '404 Not Found'
+            content_type = 'text/plain; charset=utf-8'
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+                     f"Connection: close\r\n\r\n".encode('latin-1') + body)
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_http_server(host: str, port: int, registry: Registry = None):
+    """在事件循環中啟動 Prometheus 抓取端點 (GET /metrics)。port 為 0 時不啟動。"""
+    if not port:
+        return None
+    registry = registry or REGISTRY
+    try:
+        server = await asyncio.start_server(lambda r, w: _handle_http(r, w, registry), host, port)
+    except OSError as e:
+        logging.warning(f"⚠️ 無法啟動指標端點 {host}:{port}: {e}")
+        return None
+    logging.info(f"📈 指標端點已啟動: http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,119 @@
+import asyncio
+import itertools
+import logging
+import time
+
+from telethon import events
+
+
+class ParticipantSnapshot:
+    """
+    單一群組的成員快照：依伺服器回傳的順序保存精簡的成員資料 (ID → (名稱, 用戶名))。
+    載入過程中即可讀取已載入的部分，分頁查詢只需等待到該頁為止。
+    """
+    def __init__(self, chat_id: int):
+        self.chat_id = chat_id
+        self.members = {}
+        self.complete = False
+        self.error = None
+        self.started_at = time.time()
+        self.built_at = None
+        self._changed = asyncio.Event()
+
+    def __len__(self):
+        return len(self.members)
+
+    def add(self, user):
+        self.members[user.id] = (user.first_name or "N/A", user.username or "")
+        self._changed.set()
+
+    def discard(self, user_id: int):
+        self.members.pop(user_id, None)
+
+    def finish(self, error: Exception = None):
+        self.complete = True
+        self.error = error
+        self.built_at = time.time()
+        self._changed.set()
+
+    async def wait_for(self, count: int):
+        """等待直到已載入 count 位成員或載入結束。"""
+        while not self.complete and len(self.members) < count:
+            self._changed.clear()
+            await self._changed.wait()
+
+    def iter_from(self, start: int):
+        """從第 start 位 (0 起算) 開始依序產生 (ID, 名稱, 用戶名)。"""
+        for user_id, (name, username) in itertools.islice(self.members.items(), start, None):
+            yield user_id, name, username
+
+
+class ParticipantCache:
+    """
+    群組成員快照的快取 (/list_members 使用)。第一次查詢時在背景以 iter_participants 載入，載入中即可分頁回應；
+    之後由成員加入/離開事件增量更新。快照超過 ttl 秒時在背景重新載入，完成前繼續以舊快照回應，
+    因此每次查詢只需處理一頁，回應時間與群組大小無關。
+    """
+    def __init__(self, client, ttl: float = 3600):
+        self.client = client
+        self.ttl = ttl
+        self.snapshots = {}
+        # 載入中的快照與其背景任務：chat_id -> (快照, 任務)
+        self._loading = {}
+
+    def register_handlers(self):
+        self.client.add_event_handler(self._on_chat_action, events.ChatAction())
+
+    def get(self, chat_id: int, force: bool = False) -> ParticipantSnapshot:
+        """
+        回傳可讀取的快照 (可能仍在載入中)。沒有快照、快照已過期或指定 force 時開始在背景重新載入；
+        過期的快照在新快照載入完成前繼續使用，force 或第一次查詢則直接回傳載入中的新快照。
+        """
+        snapshot = self.snapshots.get(chat_id)
+        expired = snapshot is not None and snapshot.complete and time.time() - snapshot.built_at > self.ttl
+        if snapshot is None or expired or force:
+            if chat_id not in self._loading:
+                fresh = ParticipantSnapshot(chat_id)
+                self._loading[chat_id] = (fresh, asyncio.create_task(self._load(fresh)))
+            if snapshot is None or force:
+                snapshot = self.snapshots[chat_id] = self._loading[chat_id][0]
+        return snapshot
+
+    def is_loading(self, chat_id: int) -> bool:
+        return chat_id in self._loading
+
+    async def _load(self, snapshot: ParticipantSnapshot):
+        start = time.monotonic()
+        try:
+            async for user in self.client.iter_participants(snapshot.chat_id):
+                snapshot.add(user)
+        except Exception as e:
+            snapshot.finish(e)
+            logging.warning(f"⚠️ 載入群組 {snapshot.chat_id} 的成員失敗 (已載入 {len(snapshot)} 位): {e}")
+            # 重新載入失敗時保留原本完整的快照
+            if self.snapshots.get(snapshot.chat_id) is snapshot or snapshot.chat_id not in self.snapshots:
+                self.snapshots[snapshot.chat_id] = snapshot
+        else:
+            snapshot.finish()
+            self.snapshots[snapshot.chat_id] = snapshot
+            logging.info(f"👥 已載入群組 {snapshot.chat_id} 的成員快照: {len(snapshot)} 位 ({time.monotonic() - start:.1f}s)")
+        finally:
+            self._loading.pop(snapshot.chat_id, None)
+
+    async def _on_chat_action(self, event):
+        """成員加入或離開時更新快照 (包含載入中的快照)，不必重新載入整個成員列表。"""
+        snapshots = [s for s in (self.snapshots.get(event.chat_id), self._loading.get(event.chat_id, (None,))[0]) if s]
+        if not snapshots:
+            return
+        try:
+            if event.user_joined or event.user_added:
+                users = await event.get_users()
+                for snapshot in snapshots:
+                    for user in users:
+                        snapshot.add(user)
+            elif event.user_left or event.user_kicked:
+                for snapshot in snapshots:
+                    for user_id in event.user_ids or []:
+                        snapshot.discard(user_id)
+        except Exception as e:
+            logging.warning(f"⚠️ 更新成員快照失敗 ({event.chat_id}): {e}")
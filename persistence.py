@@ -0,0 +1,123 @@
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime
+
+
+def atomic_write_text(path: str, text: str):
+    """先寫入暫存檔並 fsync，再以 os.replace 取代原檔，避免寫到一半當機造成檔案損毀。"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_json_file(path: str, backup_dir: str = 'backup'):
+    """
+    讀取 JSON 檔案。檔案不存在時拋出 FileNotFoundError。
+    檔案損毀時保留損毀檔 (改名為 *.corrupt-時間戳記)，並嘗試從最新的備份快照 (或舊版 .bak 複本) 還原；
+    沒有可用備份時拋出 json.JSONDecodeError，交由呼叫端決定預設值。
+    """
+    # backup_manager 依賴本模組的 atomic_write_text，在此延遲匯入以避免循環匯入
+    from backup_manager import backup_versions
+
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except json.JSONDecodeError:
+        corrupt_path = f"{path}.corrupt-{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        os.replace(path, corrupt_path)
+        logging.error(f"❌ {path} 格式錯誤，已保留為 {corrupt_path}。")
+        for index, raw in enumerate(backup_versions(path, backup_dir)):
+            try:
+                data = json.loads(raw.decode('utf-8'))
+            except (UnicodeDecodeError, json.JSONDecodeError):
+                continue
+            logging.warning(f"♻️ 已從備份還原 {path} (由新到舊第 {index + 1} 個版本)")
+            atomic_write_text(path, json.dumps(data, ensure_ascii=False, indent=2))
+            return data
+        raise
+
+
+class JsonWriter:
+    """
+    Write-behind 的 JSON 寫入器。
+    在事件循環中呼叫 schedule() 時只記下「哪個檔案需要寫入、如何取得最新內容」，
+    FLUSH_DELAY 秒內的多次修改會合併成一次寫入；序列化在事件循環中完成 (取得一致的快照)，
+    實際的檔案 I/O 則交給執行緒，不阻塞事件循環。沒有事件循環時 (例如啟動階段) 直接同步寫入。
+    """
+    FLUSH_DELAY = 0.5
+    # 寫入失敗 (磁碟已滿、權限錯誤等) 後重試的間隔
+    RETRY_DELAY = 5.0
+
+    def __init__(self, delay: float = FLUSH_DELAY):
+        self.delay = delay
+        self._pending = {}
+        self._timer = None
+        self._flush_task = None
+        # 寫入期間持有，其他需要一致快照的功能 (例如備份) 也可以取得此鎖
+        self.lock = asyncio.Lock()
+
+    def schedule(self, path: str, snapshot):
+        """排程寫入 path；snapshot 是回傳要寫入資料的函式，在實際寫入時才呼叫。"""
+        self._pending[path] = snapshot
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush_sync()
+            return
+        if self._timer is None:
+            self._timer = loop.call_later(self.delay, self._start_flush)
+
+    def _retry(self, path: str, snapshot, error: OSError):
+        """
+        寫入失敗時把內容放回待寫入 (期間有新的修改時以新的為準)，並排程重試，
+        避免暫時性的磁碟錯誤讓管理員或目標的修改遺失。
+        """
+        logging.error(f"❌ 寫入 {path} 失敗，保留修改稍後重試: {error}")
+        self._pending.setdefault(path, snapshot)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if self._timer is None:
+            self._timer = loop.call_later(self.RETRY_DELAY, self._start_flush)
+
+    def _start_flush(self):
+        self._timer = None
+        self._flush_task = asyncio.ensure_future(self.flush())
+
+    def _serialize_pending(self) -> list[tuple]:
+        pending, self._pending = self._pending, {}
+        return [(path, snapshot, json.dumps(snapshot(), ensure_ascii=False, indent=2))
+                for path, snapshot in pending.items()]
+
+    async def flush(self):
+        """立即寫入所有待寫入的檔案 (檔案 I/O 在執行緒中進行)。"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        async with self.lock:
+            for path, snapshot, text in self._serialize_pending():
+                try:
+                    await asyncio.to_thread(atomic_write_text, path, text)
+                except OSError as e:
+                    self._retry(path, snapshot, e)
+
+    def flush_sync(self):
+        """同步寫入所有待寫入的檔案，用於啟動階段與程式結束前。"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        for path, snapshot, text in self._serialize_pending():
+            try:
+                atomic_write_text(path, text)
+            except OSError as e:
+                self._retry(path, snapshot, e)
+
+    @property
+    def has_pending(self) -> bool:
+        return bool(self._pending)
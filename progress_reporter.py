@@ -0,0 +1,58 @@
+import logging
+import time
+
+from telethon import errors
+
+
+def format_duration(seconds: float) -> str:
+    """將秒數格式化為 1h02m / 3m05s / 12s。"""
+    seconds = int(max(0, seconds))
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+class ProgressReporter:
+    """
+    控制群組中的單一進度訊息：開始時發送一次，之後以固定的最小間隔編輯。
+    內容沒有變化就不編輯，因此 API 呼叫次數與目標數無關，只隨廣播時間增加且有上限。
+    """
+    def __init__(self, client, chat_id: int, interval: float):
+        self.client = client
+        self.chat_id = chat_id
+        self.interval = interval
+        self.message = None
+        self._last_text = None
+        self._next_edit_at = 0.0
+
+    async def start(self, text: str) -> bool:
+        try:
+            self.message = await self.client.send_message(self.chat_id, text)
+        except Exception as e:
+            logging.warning(f"⚠️ 發送廣播進度訊息失敗: {e}")
+            return False
+        self._last_text = text
+        self._next_edit_at = time.monotonic() + self.interval
+        return True
+
+    async def update(self, text: str, force: bool = False):
+        """更新進度訊息；距離上次編輯未達間隔時略過 (force=True 用於最後一次更新)。"""
+        if self.message is None or text == self._last_text:
+            return
+        now = time.monotonic()
+        if not force and now < self._next_edit_at:
+            return
+        self._next_edit_at = now + self.interval
+        try:
+            await self.client.edit_message(self.chat_id, self.message, text)
+            self._last_text = text
+        except errors.MessageNotModifiedError:
+            self._last_text = text
+        except errors.FloodWaitError as e:
+            # 編輯被限流時暫停更新，不影響發送
+            self._next_edit_at = now + e.seconds
+            logging.warning(f"⚠️ 編輯進度訊息被限流 {e.seconds}s")
+        except Exception as e:
+            logging.warning(f"⚠️ 編輯廣播進度訊息失敗: {e}")
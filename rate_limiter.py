@@ -0,0 +1,134 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+
+class TokenBucket:
+    """
+    令牌桶限速器。採用「預約」模式：每次取用都先扣一個令牌，
+    令牌不足時回傳需等待的秒數，讓多個協程依序排隊而不需額外的鎖。
+    rate <= 0 表示不限速。
+    """
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = max(1.0, float(capacity))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+
+    def reserve(self) -> float:
+        """預約一個令牌，回傳在發送前需要等待的秒數 (0 表示可立即發送)。"""
+        now = time.monotonic()
+        blocked = max(0.0, self.blocked_until - now)
+        if self.rate <= 0:
+            return blocked
+        self._refill(now)
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return blocked
+        return max(blocked, -self.tokens / self.rate)
+
+    def pause(self, seconds: float):
+        """暫停此桶 seconds 秒 (例如伺服器回傳的 flood-wait)。"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def blocked_for(self) -> float:
+        """距離暫停結束還有幾秒。"""
+        return max(0.0, self.blocked_until - time.monotonic())
+
+    def ready(self) -> bool:
+        """目前有可立即取用的令牌 (不消耗令牌)。"""
+        if self.blocked_for() > 0:
+            return False
+        if self.rate <= 0:
+            return True
+        self._refill(time.monotonic())
+        return self.tokens >= 1
+
+    def is_idle(self) -> bool:
+        """令牌已補滿，代表此桶目前沒有任何排隊中的預約。"""
+        if self.blocked_for() > 0:
+            return False
+        if self.rate <= 0:
+            return True
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class RateLimiter:
+    """
+    廣播用的雙層限速：一個全域令牌桶控制整體發送速率，
+    另外每個目標 (peer) 各有一個令牌桶，避免短時間內對同一群組連續發送。
+    全域令牌依 rank 分配 (數值小者優先，相同時先到先得)：排隊中的請求同一時間只有一個在預約令牌，
+    因此高優先度的工作在下一個令牌就能插隊，不必排在低優先度工作已預約的令牌之後。
+    """
+    def __init__(self, global_rate: float, global_burst: int = 1,
+                 peer_rate: float = 0, peer_burst: int = 1):
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.peer_rate = peer_rate
+        self.peer_burst = peer_burst
+        self.peer_buckets = {}
+        self._waiters = []
+        self._seq = itertools.count()
+        self._admitter = None
+
+    def _peer_bucket(self, peer_id) -> TokenBucket:
+        bucket = self.peer_buckets.get(peer_id)
+        if bucket is None:
+            # 順便清除已補滿的舊桶，避免目標很多時字典無限增長
+            if len(self.peer_buckets) > 10000:
+                self.peer_buckets = {k: b for k, b in self.peer_buckets.items() if not b.is_idle()}
+            bucket = TokenBucket(self.peer_rate, self.peer_burst)
+            self.peer_buckets[peer_id] = bucket
+        return bucket
+
+    def pause_peer(self, peer_id, seconds: float):
+        """依伺服器要求暫停對某個目標的發送。"""
+        self._peer_bucket(peer_id).pause(seconds)
+
+    def peer_blocked_for(self, peer_id) -> float:
+        """該目標還需等待幾秒才能再發送 (不消耗令牌)。"""
+        bucket = self.peer_buckets.get(peer_id)
+        return bucket.blocked_for() if bucket else 0.0
+
+    async def acquire(self, peer_id=None, rank: tuple = ()):
+        """等待直到全域與該目標的令牌都可用；rank 決定排隊時取得全域令牌的順序。"""
+        if peer_id is not None and (self.peer_rate > 0 or peer_id in self.peer_buckets):
+            # 先等待目標本身的額度，再取用全域令牌，避免在等待期間佔住全域額度
+            wait = self._peer_bucket(peer_id).reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+        await self._acquire_global(rank)
+
+    async def _acquire_global(self, rank: tuple):
+        if not self._waiters and self._admitter is None and self.global_bucket.ready():
+            # 沒有人在排隊且有令牌：直接取用
+            self.global_bucket.reserve()
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (rank, next(self._seq), waiter))
+        if self._admitter is None:
+            self._admitter = asyncio.create_task(self._admit())
+        await waiter
+
+    async def _admit(self):
+        """依 rank 逐一為排隊中的請求預約令牌，等到令牌可用時才放行並處理下一個。"""
+        try:
+            while self._waiters:
+                _, _, waiter = heapq.heappop(self._waiters)
+                if waiter.done():
+                    continue
+                wait = self.global_bucket.reserve()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                if not waiter.done():
+                    waiter.set_result(None)
+        finally:
+            self._admitter = None
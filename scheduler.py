@@ -1,16 +1,25 @@
-import schedule
 import asyncio
-import threading
+import heapq
+import itertools
 import time
-from datetime import datetime
+from collections import deque
+from datetime import datetime, timedelta
 import pytz
 import logging
-import os # Import os module
+
+from metrics import SCHEDULE_FIRE_DELAY, SCHEDULE_RUNS
 
 class Scheduler:
     """
     管理定時廣播排程，支援多個廣播時間點與時區。
+    排程直接在事件循環中執行：以「下次觸發時間」的 heap 排序，睡到最近的排程到期為止，
+    不需要每秒輪詢的背景執行緒，也不需要跨執行緒提交任務。
     """
+    # 單次睡眠上限 (秒)。到期前會重新以系統時間計算，以因應校時或時鐘跳動
+    MAX_SLEEP = 3600
+    # 保留最近幾次排程執行的紀錄
+    RUN_HISTORY_SIZE = 50
+
     def __init__(self, config, broadcast_manager, loop, message_manager): # Add message_manager
         self.config = config
         self.broadcast_manager = broadcast_manager
@@ -19,63 +28,145 @@ class Scheduler:
         try:
             self.tz = pytz.timezone(self.config.timezone)
         except pytz.UnknownTimeZoneError:
-            print(f"⚠️ 時區 '{self.config.timezone}' 無效，將使用 UTC。")
+            logging.warning(f"⚠️ 時區 '{self.config.timezone}' 無效，將使用 UTC。")
             self.tz = pytz.utc
 
+        self._heap = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._runner = None
+        # 執行中的廣播任務，以及最近的執行紀錄 (觸發延遲、首發延遲、耗時、結果)
+        self.running = set()
+        self.recent_runs = deque(maxlen=self.RUN_HISTORY_SIZE)
+
+    def _next_fire_time(self, hhmm: str, after: datetime) -> datetime:
+        """計算 after 之後 (不含) 下一次 HH:MM 的時間 (排程時區)。"""
+        hour, minute = (int(x) for x in hhmm.split(':'))
+        if not (0 <= hour < 24 and 0 <= minute < 60):
+            raise ValueError(f"無效的時間: {hhmm}")
+        local_after = after.astimezone(self.tz)
+        day = local_after.date()
+        while True:
+            candidate = self.tz.normalize(self.tz.localize(datetime(day.year, day.month, day.day, hour, minute)))
+            if candidate > local_after:
+                return candidate
+            day += timedelta(days=1)
+
+    def _push(self, fire_at: datetime, task: dict):
+        heapq.heappush(self._heap, (fire_at.timestamp(), next(self._seq), fire_at, task))
+
     def setup_schedule(self):
         """根據設定中的時間列表，建立或清除所有排程。"""
-        schedule.clear()
-        if self.config.enabled and self.config.schedules: 
-            print(f"📅 正在設定 {len(self.config.schedules)} 個每日自動廣播排程 (時區: {self.config.timezone})...")
-            
-            for task in self.config.schedules: 
+        self._heap = []
+        if self.config.enabled and self.config.schedules:
+            logging.info(f"📅 正在設定 {len(self.config.schedules)} 個每日自動廣播排程 (時區: {self.config.timezone})...")
+            now = datetime.now(self.tz)
+            for task in self.config.schedules:
                 broadcast_time = task.get("time")
                 campaign_name = task.get("campaign")
-                
+
                 if not broadcast_time or not campaign_name:
-                    print(f"  -> ❌ 無效的排程設定: {task} (缺少 'time' 或 'campaign')")
+                    logging.warning(f"  -> ❌ 無效的排程設定: {task} (缺少 'time' 或 'campaign')")
                     continue
 
                 try:
-                    # 使用指定的時區來設定排程
-                    schedule.every().day.at(broadcast_time, self.config.timezone).do(
-                        self.run_scheduled_broadcast, campaign_name=campaign_name 
-                    )
-                    print(f"  -> 已設定排程: {broadcast_time} (活動: {campaign_name})")
+                    # 使用指定的時區計算下一次觸發時間
+                    self._push(self._next_fire_time(broadcast_time, now), dict(task))
+                    target = f"，目標: {task['target']}" if task.get('target') else ""
+                    logging.info(f"  -> 已設定排程: {broadcast_time} (活動: {campaign_name}{target})", extra={'campaign': campaign_name})
                 except Exception as e:
-                    print(f"  -> ❌ 設定排程 {broadcast_time} 失敗: {e}")
+                    logging.warning(f"  -> ❌ 設定排程 {broadcast_time} 失敗: {e}", extra={'campaign': campaign_name})
         else:
-            print("⏸️ 自動廣播未啟用或未設定時間，已清除所有排程。")
+            logging.info("⏸️ 自動廣播未啟用或未設定時間，已清除所有排程。")
+        # 喚醒執行迴圈，讓它依新的 heap 重新計算睡眠時間
+        self._wakeup.set()
+
+    def next_run(self):
+        """回傳 (下次觸發時間, 活動名稱)；沒有排程時回傳 (None, None)。"""
+        if not self._heap:
+            return None, None
+        _, _, fire_at, task = self._heap[0]
+        return fire_at, task.get("campaign")
 
-    def run_scheduled_broadcast(self, campaign_name: str): 
-        """將排定的廣播任務安全地提交到主事件循環中執行。"""
-        print(f"[DEBUG] enabled={self.config.enabled}, loop_running={self.loop.is_running() if self.loop else None}")
+    def run_scheduled_broadcast(self, campaign_name: str, scheduled_at: datetime = None, target: str = None):
+        """在事件循環中建立排定的廣播任務，並追蹤其執行結果。"""
         # 增加診斷日誌，確認排程已被觸發
-        print(f"⏰ 排程時間已到 (時間: {datetime.now(self.tz).strftime('%H:%M:%S')})，準備執行廣播任務...")
-        
+        logging.info(f"⏰ 排程時間已到 (時間: {datetime.now(self.tz).strftime('%H:%M:%S')})，準備執行廣播任務...",
+                     extra={'campaign': campaign_name})
+
         if self.config.enabled and self.loop and self.loop.is_running():
-            # Load content from the specified campaign
-            content = self.message_manager.load_campaign_content(campaign_name)
-            asyncio.run_coroutine_threadsafe(
-                self.broadcast_manager.send_campaign_broadcast(content, campaign_name), self.loop 
-            )
+            task = self.loop.create_task(self._run_broadcast(campaign_name, scheduled_at, target))
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
+            return task
         else:
-            print("⚠️ 廣播任務被取消，原因：自動廣播未啟用或事件循環未運行。")
+            logging.warning("⚠️ 廣播任務被取消，原因：自動廣播未啟用或事件循環未運行。", extra={'campaign': campaign_name})
 
-    def start_background_runner(self):
-        """在一個獨立的背景執行緒中啟動排程檢查器，並加入錯誤處理。"""
-        def schedule_checker():
-            while True:
-                try:
-                    # 執行待處理的任務
-                    schedule.run_pending()
-                except Exception as e:
-                    # 如果排程執行緒發生任何錯誤，印出日誌而不是讓執行緒崩潰
-                    print(f"❌ 排程檢查器發生嚴重錯誤: {e}")
-                
-                # 每秒檢查一次，確保準時
-                time.sleep(1)
+    async def _run_broadcast(self, campaign_name: str, scheduled_at: datetime = None, target: str = None):
+        """執行一次排程廣播並記錄觸發延遲、首發延遲、耗時與結果。"""
+        fired_at = time.time()
+        record = {
+            'campaign': campaign_name,
+            'target': target,
+            'scheduled_at': scheduled_at.isoformat() if scheduled_at else None,
+            'fired_at': datetime.fromtimestamp(fired_at, self.tz).isoformat(),
+            'fire_delay': round(fired_at - scheduled_at.timestamp(), 3) if scheduled_at else None,
+            'first_send_latency': None,
+            'duration': None,
+            'result': None,
+            'error': None,
+        }
+        self.recent_runs.append(record)
+        if record['fire_delay'] is not None:
+            SCHEDULE_FIRE_DELAY.observe(max(0.0, record['fire_delay']))
+        stats = {}
+        deadline = None
+        if self.config.schedule_deadline:
+            deadline = (scheduled_at.timestamp() if scheduled_at else fired_at) + self.config.schedule_deadline
+        try:
+            # 讀取活動內容屬於檔案 I/O，交給執行緒以免阻塞事件循環
+            content = await asyncio.to_thread(self.message_manager.load_campaign_content, campaign_name)
+            success_count, total_count = await self.broadcast_manager.send_campaign_broadcast(
+                content, campaign_name, stats=stats, target=target, deadline=deadline
+            )
+            record['result'] = f"{success_count}/{total_count}"
+            SCHEDULE_RUNS.inc(result='ok')
+        except Exception as e:
+            record['error'] = str(e)
+            SCHEDULE_RUNS.inc(result='error')
+            logging.exception(f"❌ 排程廣播 '{campaign_name}' 執行失敗: {e}", extra={'campaign': campaign_name})
+        finally:
+            record['duration'] = round(time.time() - fired_at, 3)
+            if stats.get('first_send_at'):
+                record['first_send_latency'] = round(stats['first_send_at'] - fired_at, 3)
+            logging.info(f"排程廣播紀錄: {record}")
 
-        thread = threading.Thread(target=schedule_checker, daemon=True)
-        thread.start()
-        print("🚀 排程檢查器已在背景啟動 (含錯誤防護)。")
\ No newline at end of file
+    async def _run_loop(self):
+        """睡到最近一個排程到期，觸發後排入下一天的同一時間。"""
+        while True:
+            try:
+                self._wakeup.clear()
+                if not self._heap:
+                    await self._wakeup.wait()
+                    continue
+                fire_ts, _, fire_at, task = self._heap[0]
+                delay = fire_ts - time.time()
+                if delay > 0:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), min(delay, self.MAX_SLEEP))
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                heapq.heappop(self._heap)
+                self._push(self._next_fire_time(task["time"], fire_at), task)
+                self.run_scheduled_broadcast(task["campaign"], scheduled_at=fire_at, target=task.get("target"))
+            except Exception as e:
+                # 排程迴圈發生任何錯誤時記錄並繼續，不讓排程停止
+                logging.exception(f"❌ 排程檢查器發生嚴重錯誤: {e}")
+                await asyncio.sleep(1)
+
+    def start_background_runner(self):
+        """在事件循環中啟動排程執行迴圈。"""
+        if self._runner is None or self._runner.done():
+            self._runner = self.loop.create_task(self._run_loop())
+        logging.info("🚀 排程器已在事件循環中啟動。")
@@ -0,0 +1,75 @@
+from telethon import errors
+
+# 發送錯誤分類
+FLOOD_WAIT = 'flood_wait'
+SLOW_MODE = 'slow_mode'
+PERMANENT = 'permanent'
+TRANSIENT = 'transient'
+# 帳號層級的錯誤：登出、session 被撤銷或帳號停用，需改由其他帳號發送
+ACCOUNT = 'account'
+
+# PeerFloodError 沒有等待秒數，視為帳號被限流一段時間
+PEER_FLOOD_WAIT = 3600
+
+ACCOUNT_ERRORS = (
+    errors.AuthKeyUnregisteredError,
+    errors.AuthKeyDuplicatedError,
+    errors.SessionRevokedError,
+    errors.SessionExpiredError,
+    errors.UserDeactivatedError,
+    errors.UserDeactivatedBanError,
+)
+
+# 重試也不會成功的錯誤：沒有發言權限、被封鎖、目標不存在等
+PERMANENT_ERRORS = (
+    errors.ChatWriteForbiddenError,
+    errors.ChatGuestSendForbiddenError,
+    errors.ChatSendMediaForbiddenError,
+    errors.ChatSendGifsForbiddenError,
+    errors.ChatRestrictedError,
+    errors.ChatAdminRequiredError,
+    errors.ChatForbiddenError,
+    errors.ChatIdInvalidError,
+    errors.UserBannedInChannelError,
+    errors.UserIsBlockedError,
+    errors.ChannelPrivateError,
+    errors.ChannelInvalidError,
+    errors.ChannelPublicGroupNaError,
+    errors.PeerIdInvalidError,
+)
+
+# 永久錯誤中屬於「此帳號無法解析/存取目標」的錯誤 (access_hash 因帳號而異，帳號不在群組內)，
+# 可改由其他帳號發送；所有帳號都無法存取時才視為失敗
+UNRESOLVED_ERRORS = (
+    errors.ChatIdInvalidError,
+    errors.ChannelPrivateError,
+    errors.ChannelInvalidError,
+    errors.PeerIdInvalidError,
+)
+
+
+def classify_error(exc: Exception) -> tuple[str, int]:
+    """
+    將發送時的例外分類，回傳 (錯誤類別, 伺服器要求等待的秒數)。
+    只有 flood-wait 與 slow-mode 會帶有等待秒數，其餘為 0。
+    """
+    if isinstance(exc, errors.SlowModeWaitError):
+        return SLOW_MODE, int(getattr(exc, 'seconds', 0) or 0)
+    if isinstance(exc, errors.FloodWaitError):
+        return FLOOD_WAIT, int(getattr(exc, 'seconds', 0) or 0)
+    if isinstance(exc, errors.PeerFloodError):
+        return FLOOD_WAIT, PEER_FLOOD_WAIT
+    if isinstance(exc, ACCOUNT_ERRORS):
+        return ACCOUNT, 0
+    if isinstance(exc, PERMANENT_ERRORS):
+        return PERMANENT, 0
+    if isinstance(exc, ValueError):
+        # Telethon 找不到目標 entity 時會拋出 ValueError，重試也無濟於事
+        return PERMANENT, 0
+    return TRANSIENT, 0
+
+
+def is_unresolved(exc: Exception) -> bool:
+    """目標無法從目前的帳號解析或存取 (其他帳號可能可以)。"""
+    # Telethon 在此帳號的 session 中找不到目標 entity 時拋出 ValueError
+    return isinstance(exc, UNRESOLVED_ERRORS + (ValueError,))
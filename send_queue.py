@@ -0,0 +1,84 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+from metrics import SEND_QUEUE_DEPTH
+
+
+class SendTask:
+    """佇列中的單一發送目標，以及它的重試/延後狀態。"""
+    def __init__(self, index: int, group: dict):
+        self.index = index
+        self.group = group
+        self.attempt = 0
+        self.tries = 0
+        self.deferred_seconds = 0
+        self.last_error = None
+        self.error = None
+        # 最後一次發送請求的耗時 (秒) 與完成時間 (epoch)
+        self.latency = None
+        self.sent_at = None
+        # 最後一次嘗試發送的帳號 (多帳號模式)
+        self.account = None
+        # 無法解析此目標的帳號，改由 rendezvous 順序中的下一個帳號發送
+        self.excluded = set()
+        # 最終結果：True (成功)、False (失敗)、None (未發送)
+        self.outcome = None
+        # 從中斷的工作繼續時，延後中的目標最早可再發送的時間 (epoch)
+        self.defer_until = None
+        # 所屬的廣播工作與活動 (寫入結構化記錄)
+        self.job_id = None
+        self.campaign = None
+
+
+class SendQueue:
+    """
+    支援延後重排的發送佇列。
+    被 flood-wait 或 slow-mode 擋下的目標會帶著伺服器要求的等待時間放回佇列，
+    其他目標則可以繼續被 worker 取出發送，不會被單一目標阻塞。
+    """
+    def __init__(self):
+        self._heap = []
+        self._seq = itertools.count()
+        self._in_flight = 0
+        self._changed = asyncio.Event()
+
+    def put(self, task: SendTask, delay: float = 0.0):
+        """放入目標；delay 秒之後才會再被取出。"""
+        heapq.heappush(self._heap, (time.monotonic() + max(0.0, delay), next(self._seq), task))
+        SEND_QUEUE_DEPTH.inc()
+        self._changed.set()
+
+    async def get(self):
+        """
+        取出下一個已到期的目標。
+        佇列已空且沒有仍在處理中的目標 (不會再被放回) 時回傳 None。
+        """
+        while True:
+            timeout = None
+            if self._heap:
+                ready_at = self._heap[0][0]
+                now = time.monotonic()
+                if ready_at <= now:
+                    _, _, task = heapq.heappop(self._heap)
+                    SEND_QUEUE_DEPTH.dec()
+                    self._in_flight += 1
+                    return task
+                timeout = ready_at - now
+            elif self._in_flight == 0:
+                self._changed.set()  # 喚醒其他等待中的 worker 讓它們也結束
+                return None
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def task_done(self):
+        """標記一個取出的目標已處理完畢 (成功、失敗或已放回佇列)。"""
+        self._in_flight -= 1
+        self._changed.set()
+
+    def __len__(self):
+        return len(self._heap)
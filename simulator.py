@@ -0,0 +1,238 @@
+import heapq
+import itertools
+import random
+import statistics
+from datetime import datetime, timedelta
+
+from progress_reporter import format_duration
+from send_errors import FLOOD_WAIT, PERMANENT, SLOW_MODE
+
+# 歷史記錄不足時使用的預設值：每次發送請求的延遲 (秒，純文字 / 有媒體) 與上傳速度 (位元組/秒)
+DEFAULT_LATENCY = {False: 0.3, True: 1.0}
+DEFAULT_UPLOAD_RATE = 1024 * 1024
+# 同類型 (純文字 / 有媒體) 的發送記錄少於此數時，改用所有廣播的記錄
+MIN_SAMPLES = 20
+# 模擬的總事件數上限：目標越多，重複模擬的次數越少
+MAX_SIMULATED_SENDS = 200000
+
+# 單一目標最後的結果 (依歷史記錄重抽)
+SENT = 'sent'
+FAIL_PERMANENT = 'permanent'
+FAIL_RETRIES = 'retries'
+FAIL_FLOOD = 'flood'
+
+
+class TimingModel:
+    """
+    由歷史發送記錄擬合的時間模型：發送請求的延遲分布、每個目標的發送過程 (暫時性錯誤次數、flood-wait 等待秒數、
+    最後結果) 與媒體上傳速度。模擬時每個目標重抽一筆歷史記錄 (bootstrap)，保留同一目標上錯誤之間的關聯。
+    """
+    def __init__(self, latencies: list, scripts: list, upload_rate: float, sample_size: int, media: bool):
+        self.latencies = latencies or [DEFAULT_LATENCY[media]]
+        # 每個目標的發送過程：(暫時性錯誤次數, flood-wait 秒數, 最後結果)
+        self.scripts = scripts or [(0, 0, SENT)]
+        self.upload_rate = upload_rate or DEFAULT_UPLOAD_RATE
+        self.sample_size = sample_size
+        self.media = media
+
+    @staticmethod
+    def _script(row: dict) -> tuple:
+        """將一筆發送記錄轉成發送過程。嘗試次數中扣掉 flood-wait 那一次，其餘的失敗視為暫時性錯誤。"""
+        waited = row['deferred_seconds'] or 0
+        transient = max(0, (row['attempts'] or 1) - 1 - (1 if waited else 0))
+        if row['outcome'] == 'sent':
+            return transient, waited, SENT
+        if row['error_class'] == PERMANENT:
+            return transient, waited, FAIL_PERMANENT
+        if row['error_class'] in (FLOOD_WAIT, SLOW_MODE):
+            return transient, waited, FAIL_FLOOD
+        return transient, waited, FAIL_RETRIES
+
+    @classmethod
+    def fit(cls, history_store, media: bool, days: int = 30) -> 'TimingModel':
+        """以最近 days 天的發送記錄擬合模型；完全沒有記錄時使用預設值。"""
+        since = (datetime.now() - timedelta(days=days)).timestamp()
+        rows = history_store.timing_samples(media=media, since=since)
+        if len(rows) < MIN_SAMPLES:
+            rows = history_store.timing_samples(since=since)
+        upload_bytes, upload_seconds = history_store.upload_totals(since)
+        return cls(
+            latencies=[r['latency_ms'] / 1000 for r in rows if r['latency_ms'] is not None],
+            scripts=[cls._script(r) for r in rows],
+            upload_rate=upload_bytes / upload_seconds if upload_seconds else None,
+            sample_size=len(rows),
+            media=media,
+        )
+
+    def summary(self) -> dict:
+        """模型本身的統計 (每個目標的機率與延遲分位數)，在模擬報告中顯示。"""
+        n = len(self.scripts)
+        ordered = sorted(self.latencies)
+        return {
+            'samples': self.sample_size,
+            'latency_p50': ordered[len(ordered) // 2],
+            'latency_p90': ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))],
+            'flood_rate': sum(1 for s in self.scripts if s[1]) / n,
+            'retry_rate': sum(1 for s in self.scripts if s[0]) / n,
+            'failure_rate': sum(1 for s in self.scripts if s[2] != SENT) / n,
+            'upload_rate': self.upload_rate,
+        }
+
+
+class _Bucket:
+    """模擬時間上的令牌桶，與 rate_limiter.TokenBucket 的預約方式相同。"""
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(1.0, float(capacity))
+        self.tokens = self.capacity
+        self.updated = 0.0
+
+    def reserve(self, now: float) -> float:
+        if self.rate <= 0:
+            return 0.0
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+def _run_once(accounts: dict, model: TimingModel, rng: random.Random, *, rate: float, burst: int,
+              concurrency: int, max_retries: int, max_flood_wait: float, per_peer_rate: float,
+              upload_seconds: float) -> dict:
+    """
+    以離散事件模擬一次廣播，流程與 BroadcastManager.deliver 相同：固定數量的 worker 從延後佇列取出目標，
+    負責的帳號第一次發送前上傳媒體，再取得該帳號的令牌後發送；flood-wait 依要求的秒數延後，
+    暫時性錯誤以 2^n 秒退避重試，重試次數或累計等待超過上限即失敗。
+    """
+    seq = itertools.count()
+    buckets = {name: _Bucket(rate, burst) for name in accounts}
+    media_ready = {}
+    peer_gap = 1 / per_peer_rate if per_peer_rate > 0 else 0
+    # 佇列中的目標：(可發送時間, 序號, 帳號, 發送過程, 已發生的暫時性錯誤, 已等待秒數, 上次發送時間)
+    pending = []
+    for name, count in accounts.items():
+        for _ in range(count):
+            heapq.heappush(pending, (0.0, next(seq), name, rng.choice(model.scripts), 0, 0, None))
+    running = []
+    idle = max(1, min(concurrency * len(accounts), len(pending)))
+    now = 0.0
+    stats = {'sent': 0, 'failed': 0, 'attempts': 0, 'retries': 0, 'flood_waits': 0, 'flood_seconds': 0.0,
+             'first_send': None}
+    while pending or running:
+        while idle and pending and pending[0][0] <= now:
+            _, _, name, script, errors, waited, last = heapq.heappop(pending)
+            idle -= 1
+            start = now
+            if upload_seconds:
+                # 同一帳號的其他 worker 等待第一次上傳完成
+                media_ready.setdefault(name, start + upload_seconds)
+                start = max(start, media_ready[name])
+            start += buckets[name].reserve(start)
+            if last is not None and peer_gap:
+                start = max(start, last + peer_gap)
+            finish = start + rng.choice(model.latencies)
+            heapq.heappush(running, (finish, next(seq), name, script, errors, waited))
+        if not running or (idle and pending and pending[0][0] < running[0][0]):
+            now = pending[0][0]
+            continue
+        finish, _, name, script, errors, waited = heapq.heappop(running)
+        now = finish
+        idle += 1
+        stats['attempts'] += 1
+        transient, flood_wait, final = script
+        if flood_wait and not waited:
+            # 依伺服器要求暫停此目標；累計等待超過上限或歷史上最後因限流失敗時不再重試
+            stats['flood_waits'] += 1
+            if flood_wait > max_flood_wait or final == FAIL_FLOOD:
+                stats['failed'] += 1
+                continue
+            stats['flood_seconds'] += flood_wait
+            heapq.heappush(pending, (finish + flood_wait, next(seq), name, script, errors, flood_wait, finish))
+            continue
+        if errors < transient or final == FAIL_RETRIES:
+            errors += 1
+            if errors >= max_retries:
+                stats['failed'] += 1
+                continue
+            stats['retries'] += 1
+            heapq.heappush(pending, (finish + 2 ** errors, next(seq), name, script, errors, waited, finish))
+            continue
+        if final == SENT:
+            stats['sent'] += 1
+            if stats['first_send'] is None:
+                stats['first_send'] = finish
+        else:
+            stats['failed'] += 1
+    stats['duration'] = now
+    return stats
+
+
+def simulate(accounts: dict, model: TimingModel, *, rate: float, burst: int, concurrency: int, max_retries: int,
+             max_flood_wait: float, per_peer_rate: float, media_bytes: int = 0, trials: int = 20,
+             seed: int = 0) -> dict:
+    """
+    重複模擬 trials 次 (目標很多時自動減少次數)，回傳完成時間的中位數與 P90，
+    以及成功/失敗數、重試、flood-wait 次數與等待秒數的平均值。accounts 為 {帳號名稱: 負責的目標數}。
+    """
+    total = sum(accounts.values())
+    trials = max(3, min(trials, MAX_SIMULATED_SENDS // max(1, total)))
+    rng = random.Random(seed)
+    upload_seconds = media_bytes / model.upload_rate if media_bytes else 0.0
+    runs = [_run_once(accounts, model, rng, rate=rate, burst=burst, concurrency=concurrency,
+                      max_retries=max_retries, max_flood_wait=max_flood_wait, per_peer_rate=per_peer_rate,
+                      upload_seconds=upload_seconds) for _ in range(trials)]
+    durations = sorted(r['duration'] for r in runs)
+    first_sends = [r['first_send'] for r in runs if r['first_send'] is not None]
+    result = {key: statistics.fmean(r[key] for r in runs)
+              for key in ('sent', 'failed', 'attempts', 'retries', 'flood_waits', 'flood_seconds')}
+    result.update({
+        'trials': trials,
+        'duration_p50': durations[len(durations) // 2],
+        'duration_p90': durations[min(len(durations) - 1, int(len(durations) * 0.9))],
+        'first_send': statistics.fmean(first_sends) if first_sends else None,
+        'upload_bytes': media_bytes * sum(1 for count in accounts.values() if count),
+        'upload_seconds': upload_seconds,
+    })
+    return result
+
+
+def format_simulation(report: dict) -> str:
+    """/simulate 的結果訊息。"""
+    result, model, settings = report['result'], report['model'], report['settings']
+    total = len(report['targets'])
+    rate_text = f"{settings['rate']:.2f} 次/秒" if settings['rate'] > 0 else "不限速"
+    target_text = f" (`{report['target']}`)" if report['target'] else ""
+    lines = [
+        f"🔮 **模擬廣播: `{report['campaign']}`** (不會實際發送)",
+        f"🎯 目標: {total} 個{target_text} | 👥 帳號: "
+        + ", ".join(f"{name} {count}" for name, count in report['accounts'].items()),
+        f"⚙️ 每帳號 {rate_text} (burst {settings['burst']}) | 併發 {settings['concurrency']} | "
+        f"重試 {settings['max_retries']} 次 | 限流等待上限 {settings['max_flood_wait']:.0f}s",
+        "",
+        f"⏱️ 預計耗時: {format_duration(result['duration_p50'])} (P90 {format_duration(result['duration_p90'])})",
+        f"✅ 預計成功: {result['sent']:.0f} | ❌ 失敗: {result['failed']:.0f} ({result['failed'] / total * 100:.1f}%)",
+        f"🔁 重試: {result['retries']:.0f} 次 | 📨 發送請求: {result['attempts']:.0f} 次",
+        f"⏳ flood-wait: {result['flood_waits']:.0f} 次，目標累計等待 {format_duration(result['flood_seconds'])}",
+    ]
+    if report['media_bytes']:
+        lines.append(f"⬆️ 上傳: {result['upload_bytes'] / 1024 / 1024:.2f} MB "
+                     f"(每個帳號 {report['media_bytes'] / 1024 / 1024:.2f} MB，約 {result['upload_seconds']:.1f}s)"
+                     + (f"，第一則約 {result['first_send']:.1f}s 後送出" if result['first_send'] is not None else ""))
+    if report['unresolved']:
+        lines.append(f"🔎 發送前需解析 {report['unresolved']} 個未快取的目標")
+    if report['busy_jobs']:
+        lines.append(f"📬 目前有 {report['busy_jobs']} 個廣播進行中，共用發送名額，實際完成時間會較晚")
+    stats = model.summary()
+    source = (f"最近 {stats['samples']} 筆發送記錄" if stats['samples']
+              else "尚無發送記錄，使用預設值")
+    lines += [
+        "",
+        f"📐 模型: {source} (模擬 {result['trials']} 次)",
+        f"   延遲 P50 {stats['latency_p50'] * 1000:.0f}ms / P90 {stats['latency_p90'] * 1000:.0f}ms | "
+        f"flood-wait {stats['flood_rate'] * 100:.1f}% | 重試 {stats['retry_rate'] * 100:.1f}% | "
+        f"失敗 {stats['failure_rate'] * 100:.1f}%",
+    ]
+    if report['media_bytes']:
+        lines.append(f"   上傳速度 {stats['upload_rate'] / 1024 / 1024:.2f} MB/s")
+    return "\n".join(lines)
@@ -0,0 +1,65 @@
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+
+import metrics
+
+
+class StartupProfile:
+    """
+    記錄啟動各階段的耗時。必要階段 (在可接受指令前完成) 以 with phase() 計時；
+    其餘工作以 background() 放到背景並行執行，完成時記錄耗時，不延後「就緒」的時間。
+    """
+    def __init__(self):
+        self.started = time.monotonic()
+        self.phases = []  # (名稱, 秒數, 是否為背景工作)
+        self.ready_after = None
+        self.tasks = []
+
+    def _record(self, name: str, seconds: float, background: bool = False):
+        self.phases.append((name, seconds, background))
+        metrics.STARTUP_PHASE_SECONDS.set(round(seconds, 3), phase=name)
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._record(name, time.monotonic() - start)
+
+    def background(self, name: str, coro, after=()) -> asyncio.Task:
+        """在背景執行啟動工作 (可指定需先完成的其他背景工作)，失敗只記錄，不影響機器人運作。"""
+        async def runner():
+            if after:
+                await asyncio.gather(*after, return_exceptions=True)
+            start = time.monotonic()
+            try:
+                return await coro
+            except Exception as e:
+                logging.exception(f"❌ 背景啟動工作 {name} 失敗: {e}")
+            finally:
+                seconds = time.monotonic() - start
+                self._record(name, seconds, background=True)
+                logging.info(f"⏱️ 背景啟動工作 {name} 完成 ({seconds:.2f}s)")
+
+        task = asyncio.create_task(runner(), name=f'startup:{name}')
+        self.tasks.append(task)
+        return task
+
+    def mark_ready(self):
+        self.ready_after = time.monotonic() - self.started
+        metrics.STARTUP_PHASE_SECONDS.set(round(self.ready_after, 3), phase='ready')
+        logging.info(self.summary())
+
+    def summary(self) -> str:
+        """啟動耗時摘要：就緒時間與各階段耗時 (背景工作另外標示)。"""
+        ready = f"{self.ready_after:.2f}s" if self.ready_after is not None else "尚未就緒"
+        lines = [f"⏱️ 啟動耗時: 可接受指令 {ready}"]
+        for name, seconds, background in self.phases:
+            lines.append(f"- {name}: {seconds:.2f}s{' (背景)' if background else ''}")
+        pending = sum(1 for t in self.tasks if not t.done())
+        if pending:
+            lines.append(f"- 背景工作進行中: {pending} 個")
+        return "\n".join(lines)
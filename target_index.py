@@ -0,0 +1,91 @@
+import re
+
+TAG_RE = re.compile(r'^[\w\-]+$')
+
+
+def normalize_tag(tag: str) -> str:
+    """標籤不分大小寫，只允許字母、數字、底線與連字號。"""
+    tag = tag.strip().lower()
+    if tag.startswith('tag:'):
+        tag = tag[4:]
+    if not TAG_RE.match(tag):
+        raise ValueError(f"無效的標籤: {tag or '(空白)'}")
+    return tag
+
+
+def parse_selector(selector: str) -> tuple[list, list]:
+    """
+    解析目標選擇器，回傳 (包含的條件, 排除的條件)，每個條件為 ('tag', 名稱) / ('id', 群組ID) / ('all', None)。
+    語法：以逗號分隔的條件取聯集，例如 `tag:vip,tag:hk,-1001234`；條件前加 `!` 表示排除，例如 `all,!tag:test`。
+    """
+    include, exclude = [], []
+    for term in (selector or '').split(','):
+        term = term.strip()
+        if not term:
+            continue
+        target = exclude if term.startswith('!') else include
+        term = term.lstrip('!').strip()
+        if term.lower() in ('all', '*'):
+            target.append(('all', None))
+        elif term.lower().startswith('tag:'):
+            target.append(('tag', normalize_tag(term)))
+        else:
+            try:
+                target.append(('id', int(term.lower().removeprefix('id:'))))
+            except ValueError:
+                raise ValueError(f"無效的目標條件: `{term}` (可用 tag:<標籤>、群組 ID 或 all)")
+    if not include and not exclude:
+        raise ValueError("目標選擇器是空的")
+    return include, exclude
+
+
+class TargetIndex:
+    """
+    廣播目標的索引：群組 ID → 目標設定、標籤 → 群組 ID 集合、群組 ID → 在目標列表中的順序。
+    目標列表變更 (儲存設定) 時重建；依標籤選擇目標只需處理符合的群組，與目標總數無關。
+    """
+    def __init__(self, groups=()):
+        self.rebuild(groups)
+
+    def rebuild(self, groups):
+        self.groups = groups
+        self.size = len(groups)
+        self.by_id = {}
+        self.by_tag = {}
+        self.position = {}
+        for i, group in enumerate(groups):
+            self.by_id[group['id']] = group
+            self.position[group['id']] = i
+            for tag in group.get('tags', ()):
+                self.by_tag.setdefault(tag, set()).add(group['id'])
+
+    def is_stale(self, groups) -> bool:
+        """目標列表被整個替換，或增減後尚未重建索引。"""
+        return groups is not self.groups or len(groups) != self.size
+
+    def tags(self) -> dict[str, int]:
+        """所有標籤與各自的群組數 (依名稱排序)。"""
+        return {tag: len(ids) for tag, ids in sorted(self.by_tag.items())}
+
+    def _ids(self, conditions) -> set:
+        ids = set()
+        for kind, value in conditions:
+            if kind == 'all':
+                return set(self.by_id)
+            if kind == 'tag':
+                ids |= self.by_tag.get(value, set())
+            elif value in self.by_id:
+                ids.add(value)
+        return ids
+
+    def select(self, selector: str = None) -> list[dict]:
+        """依選擇器回傳符合的目標 (維持目標列表中的順序)；未指定選擇器時回傳所有目標。"""
+        if not selector:
+            return list(self.groups)
+        include, exclude = parse_selector(selector)
+        ids = self._ids(include) if include else set(self.by_id)
+        ids -= self._ids(exclude)
+        return [self.by_id[i] for i in sorted(ids, key=self.position.__getitem__)]
+
+    def count(self, selector: str = None) -> int:
+        return len(self.select(selector)) if selector else len(self.groups)
@@ -1,9 +1,118 @@
+import asyncio
 import getpass
+import hashlib
+import logging
+import time
 from telethon import TelegramClient, errors
 
+from entity_cache import EntityCache
+
+
+class SessionState:
+    """
+    連線池中的單一帳號：Telethon 客戶端、專屬的 entity 快取，以及健康/限流狀態。
+    """
+    def __init__(self, name: str, client: TelegramClient, entity_cache: EntityCache = None):
+        self.name = name
+        self.client = client
+        self.entity_cache = entity_cache
+        self.authorized = False
+        self.logged_out = False
+        self.flood_until = 0.0
+        self.me = None
+        self.sends = 0
+        self.failures = 0
+        self.last_error = None
+
+    @property
+    def available(self) -> bool:
+        """已登入且目前沒有被限流。"""
+        return self.authorized and not self.logged_out and time.time() >= self.flood_until
+
+    def flood_remaining(self) -> float:
+        return max(0.0, self.flood_until - time.time())
+
+    def status_text(self) -> str:
+        if self.logged_out:
+            return "⛔ 已登出/停用"
+        if not self.authorized:
+            return "⚠️ 未授權"
+        if self.flood_remaining() > 0:
+            return f"⏳ 限流中 ({self.flood_remaining():.0f}s)"
+        return "✅ 正常"
+
+
+class SessionPool:
+    """
+    多帳號連線池。以 rendezvous hashing 將目標群組固定分配給某個帳號 (同一群組總是由同一帳號發送)，
+    該帳號限流或登出時，才改由分數次高的可用帳號接手，恢復後自動回到原帳號。
+    """
+    # flood-wait 超過此秒數時，將整個帳號標記為限流並把目標轉給其他帳號
+    FLOOD_FAILOVER_THRESHOLD = 30
+
+    def __init__(self, sessions: list):
+        self.sessions = sessions
+        self.by_name = {s.name: s for s in sessions}
+
+    @classmethod
+    def from_client(cls, client, entity_cache=None, name: str = 'default'):
+        """以單一已連線的客戶端建立連線池 (單帳號模式)。"""
+        session = SessionState(name, client, entity_cache)
+        session.authorized = True
+        return cls([session])
+
+    @property
+    def primary(self) -> SessionState:
+        return self.sessions[0]
+
+    def active_sessions(self) -> list:
+        return [s for s in self.sessions if s.authorized and not s.logged_out]
+
+    @staticmethod
+    def _score(session_name: str, group_id) -> int:
+        digest = hashlib.md5(f"{session_name}:{group_id}".encode('utf-8')).digest()
+        return int.from_bytes(digest[:8], 'big')
+
+    def preferred(self, group_id, exclude=()) -> SessionState:
+        """不考慮限流時，該群組固定分配到的帳號 (略過 exclude 中的帳號)；沒有候選帳號時回傳 None。"""
+        candidates = [s for s in self.active_sessions() or self.sessions if s.name not in exclude]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda s: self._score(s.name, group_id))
+
+    def assign(self, group_id, exclude=()) -> SessionState:
+        """
+        回傳目前應負責發送該群組的可用帳號；exclude 為已確認無法解析該群組的帳號，
+        改由 rendezvous 順序中的下一個帳號接手。全部帳號都不可用時回傳 None。
+        """
+        available = [s for s in self.sessions if s.available and s.name not in exclude]
+        if not available:
+            return None
+        return max(available, key=lambda s: self._score(s.name, group_id))
+
+    def next_available_in(self, exclude=()) -> float:
+        """距離最早有帳號 (不含 exclude) 解除限流還有幾秒；沒有任何登入中的帳號時回傳 None。"""
+        active = [s for s in self.active_sessions() if s.name not in exclude]
+        if not active:
+            return None
+        return min(s.flood_remaining() for s in active)
+
+    def mark_flood(self, session: SessionState, seconds: float):
+        session.flood_until = max(session.flood_until, time.time() + seconds)
+        logging.warning(f"⏳ 帳號 {session.name} 被限流 {seconds:.0f}s，其目標將暫時由其他帳號發送。",
+                        extra={'account': session.name, 'wait': round(seconds)})
+
+    def mark_logged_out(self, session: SessionState, error=None):
+        session.logged_out = True
+        session.last_error = str(error) if error else None
+        logging.error(f"⛔ 帳號 {session.name} 已登出或被停用: {error}", extra={'account': session.name})
+
+
 class TelegramClientManager:
     """
     管理 Telethon 客戶端的初始化、啟動和連接。
+    SESSION_NAMES 設定多個 session 時會建立多帳號連線池；第一個 session 為主帳號，
+    負責指令、排程與控制群組訊息，其餘帳號只參與廣播發送。
     """
     def __init__(self, config):
         self.config = config
@@ -12,13 +121,22 @@ class TelegramClientManager:
             config.api_id,
             config.api_hash
         )
+        sessions = [SessionState(config.session_name, self.client)]
+        for name in config.session_names:
+            if name == config.session_name:
+                continue
+            # access_hash 因帳號而異，每個帳號各自保存一份 entity 快取
+            client = TelegramClient(name, config.api_id, config.api_hash)
+            cache = EntityCache(client, path=f'entity_cache_{name}.json', writer=config.writer)
+            sessions.append(SessionState(name, client, cache))
+        self.pool = SessionPool(sessions)
 
-    async def start(self):
+    async def start(self, connect_pool: bool = True):
         """
         啟動並連接 Telethon 客戶端。
-        會根據設定處理 2FA 密碼。
+        會根據設定處理 2FA 密碼。connect_pool=False 時只連接主帳號，其餘帳號由呼叫端另外呼叫 start_pool()。
         """
-        print("⏳ 正在連接 Telegram...")
+        logging.info("⏳ 正在連接 Telegram...")
         await self.client.connect()
 
         if not await self.client.is_user_authorized():
@@ -28,12 +146,38 @@ class TelegramClientManager:
             except errors.SessionPasswordNeededError:
                 password = self.config.password or getpass.getpass('請輸入您的兩步驟驗證密碼: ')
                 await self.client.sign_in(password=password)
-        
+
         me = await self.client.get_me()
-        print(f"✅ Telegram 客戶端已連接")
-        print(f"👤 登入用戶: {me.first_name} {me.last_name or ''} (@{me.username or 'N/A'})")
+        self.pool.primary.authorized = True
+        self.pool.primary.me = me
+        logging.info("✅ Telegram 客戶端已連接", extra={'account': self.pool.primary.name})
+        logging.info(f"👤 登入用戶: {me.first_name} {me.last_name or ''} (@{me.username or 'N/A'})",
+                     extra={'account': self.pool.primary.name})
+
+        if connect_pool:
+            await self.start_pool()
+
+    async def start_pool(self):
+        """並行連接其餘帳號。這些 session 必須事先登入完成，未授權的帳號不會加入發送。"""
+        await asyncio.gather(*(self._connect_session(session) for session in self.pool.sessions[1:]))
+
+    async def _connect_session(self, session):
+        try:
+            await session.client.connect()
+            if not await session.client.is_user_authorized():
+                logging.warning(f"⚠️ 帳號 session '{session.name}' 尚未登入，將不參與廣播。", extra={'account': session.name})
+                return
+            session.me = await session.client.get_me()
+            session.authorized = True
+            logging.info(f"👥 已加入發送帳號: {session.name} ({session.me.first_name})", extra={'account': session.name})
+        except Exception as e:
+            session.last_error = str(e)
+            logging.error(f"❌ 連接帳號 session '{session.name}' 失敗: {e}", extra={'account': session.name})
 
+    def attach_entity_cache(self, entity_cache: EntityCache):
+        """主帳號沿用 JobBot 建立的 entity 快取。"""
+        self.pool.primary.entity_cache = entity_cache
 
     def get_client(self) -> TelegramClient:
         """返回已初始化的 Telethon 客戶端實例。"""
-        return self.client
\ No newline at end of file
+        return self.client
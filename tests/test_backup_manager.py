@@ -0,0 +1,96 @@
+import asyncio
+import json
+import os
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+
+from backup_manager import BackupManager, list_snapshots
+from persistence import JsonWriter, load_json_file
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    # 備份的檔名是相對路徑 (與設定檔相同)，在暫存目錄中執行
+    monkeypatch.chdir(tmp_path)
+    config = SimpleNamespace(writer=JsonWriter(), backup_dir='backup', backup_files=['settings.json', 'history.db'],
+                             backup_interval=3600, backup_keep_recent=2, backup_keep_days=0)
+    return BackupManager(config)
+
+
+def write_settings(value):
+    with open('settings.json', 'w', encoding='utf-8') as f:
+        json.dump({'value': value}, f)
+
+
+def insert_rows(count):
+    conn = sqlite3.connect('history.db')
+    with conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS t (n INTEGER)")
+        conn.executemany("INSERT INTO t VALUES (?)", [(i,) for i in range(count)])
+    conn.close()
+
+
+def count_rows(conn):
+    return conn.execute("SELECT COUNT(*) FROM t").fetchone()[0]
+
+
+def test_snapshot_only_stores_changes(manager):
+    write_settings(1)
+    insert_rows(3)
+    first = asyncio.run(manager.snapshot())
+    assert first['changed'] == ['history.db', 'settings.json']
+    assert asyncio.run(manager.snapshot()) is None
+
+    write_settings(22)
+    second = asyncio.run(manager.snapshot())
+    assert second['changed'] == ['settings.json']
+    assert second['files']['history.db'] == first['files']['history.db']
+    assert [s['id'] for s in list_snapshots('backup')] == [second['id'], first['id']]
+
+
+def test_prune_removes_old_snapshots_and_objects(manager):
+    snapshots = []
+    for value in (1, 22, 333):
+        write_settings(value)
+        snapshots.append(asyncio.run(manager.snapshot()))
+    # keep_recent=2：最舊的快照與只被它引用的內容已被清除
+    assert [s['id'] for s in manager.find_all()] == [snapshots[2]['id'], snapshots[1]['id']]
+    objects = {name[:-3] for _, _, files in os.walk(os.path.join('backup', 'objects')) for name in files}
+    assert objects == set(snapshots[1]['files'].values()) | set(snapshots[2]['files'].values())
+
+
+def test_restore_files_and_database(manager):
+    # 還原前後各建立一次快照，保留較多快照以免被還原的快照被清除
+    manager.keep_recent = 10
+    write_settings(1)
+    insert_rows(3)
+    first = asyncio.run(manager.snapshot())
+    write_settings(22)
+    insert_rows(2)
+    asyncio.run(manager.snapshot())
+
+    conn = sqlite3.connect('history.db')
+    try:
+        assert count_rows(conn) == 5
+        assert asyncio.run(manager.restore(manager.find(first['id']), ['history.db'])) == ['history.db']
+        # 以備份 API 寫回，已開啟的連線也讀到還原後的內容
+        assert count_rows(conn) == 3
+    finally:
+        conn.close()
+    with open('settings.json', encoding='utf-8') as f:
+        assert json.load(f) == {'value': 22}
+
+    assert asyncio.run(manager.restore(first, [])) == []
+    assert asyncio.run(manager.restore(first)) == ['settings.json', 'history.db']
+    with open('settings.json', encoding='utf-8') as f:
+        assert json.load(f) == {'value': 1}
+
+
+def test_corrupt_settings_restored_from_snapshot(manager):
+    write_settings(1)
+    asyncio.run(manager.snapshot())
+    with open('settings.json', 'w', encoding='utf-8') as f:
+        f.write('{broken')
+    assert load_json_file('settings.json') == {'value': 1}
@@ -0,0 +1,69 @@
+import asyncio
+import time
+
+import pytest
+
+from dispatcher import PRIORITY_BULK, PRIORITY_NORMAL, PRIORITY_URGENT, BroadcastDispatcher
+
+
+def test_admission_rank_orders_priority_then_deadline():
+    dispatcher = BroadcastDispatcher(1)
+    dispatcher.register(1, 'bulk', 10, 10, PRIORITY_BULK)
+    dispatcher.register(2, 'late', 10, 10, PRIORITY_URGENT, deadline=2000.0)
+    dispatcher.register(3, 'early', 10, 10, PRIORITY_URGENT, deadline=1000.0)
+    ranks = {job_id: dispatcher.admission_rank(job_id) for job_id in (1, 2, 3)}
+    assert sorted(ranks, key=ranks.get) == [3, 2, 1]
+    # 未登記的工作 (例如單獨呼叫 deliver) 視為一般優先度
+    assert dispatcher.admission_rank(99) == (-PRIORITY_NORMAL, float('inf'))
+
+
+def test_rank_rotates_between_jobs_of_same_priority():
+    async def run():
+        dispatcher = BroadcastDispatcher(1)
+        dispatcher.register(1, 'a', 3, 3)
+        dispatcher.register(2, 'b', 3, 3)
+        order = []
+
+        async def send(job_id):
+            async with dispatcher.slot(job_id):
+                order.append(job_id)
+                await asyncio.sleep(0)
+
+        await asyncio.gather(*(send(job_id) for job_id in (1, 1, 1, 2, 2, 2)))
+        return order
+
+    assert asyncio.run(run()) == [1, 2, 1, 2, 1, 2]
+
+
+def test_urgent_job_takes_next_free_slot():
+    async def run():
+        dispatcher = BroadcastDispatcher(1)
+        dispatcher.register(1, 'bulk', 5, 5, PRIORITY_BULK)
+        order = []
+
+        async def send(job_id):
+            async with dispatcher.slot(job_id):
+                order.append(job_id)
+                await asyncio.sleep(0.01)
+
+        bulk = [asyncio.create_task(send(1)) for _ in range(3)]
+        await asyncio.sleep(0)
+        dispatcher.register(2, 'urgent', 1, 1, PRIORITY_URGENT)
+        await asyncio.gather(*bulk, send(2))
+        return order
+
+    assert asyncio.run(run()) == [1, 2, 1, 1]
+
+
+def test_estimates_fluid_model():
+    dispatcher = BroadcastDispatcher(1)
+    dispatcher.register(1, 'urgent', 10, 10, PRIORITY_URGENT)
+    dispatcher.register(2, 'small', 5, 5)
+    dispatcher.register(3, 'large', 10, 10)
+    now = time.time()
+    estimates = dispatcher.estimates(rate=1)
+    # 緊急工作先獨占速率；兩個一般工作平分速率，剩餘較少的先完成
+    assert estimates[1][1] == pytest.approx(now + 10, abs=1)
+    assert estimates[2][1] == pytest.approx(now + 20, abs=1)
+    assert estimates[3][1] == pytest.approx(now + 25, abs=1)
+    assert BroadcastDispatcher(1).estimates() == {}
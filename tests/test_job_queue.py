@@ -0,0 +1,76 @@
+import time
+
+import pytest
+
+from job_queue import JobQueue
+
+TARGETS = [{'id': -1001}, {'id': -1002}, {'id': -1003}]
+
+
+@pytest.fixture
+def job_queue(tmp_path):
+    queue = JobQueue(str(tmp_path / 'job_queue.db'))
+    yield queue
+    queue.close()
+
+
+def test_claim_does_not_hand_out_leased_items(job_queue):
+    job_id = job_queue.enqueue('campaign_A', {'text': 'hi'}, TARGETS)
+    first = job_queue.claim('w1', 2)
+    second = job_queue.claim('w2', 5)
+    assert [item['idx'] for item in first] == [1, 2]
+    assert [item['idx'] for item in second] == [3]
+    assert first[0]['group'] == {'id': -1001}
+    assert job_queue.claim('w3', 5) == []
+    assert job_queue.progress(job_id)['claimed'] == 3
+
+
+def test_claim_prefers_higher_priority(job_queue):
+    job_queue.enqueue('bulk', {}, TARGETS)
+    urgent = job_queue.enqueue('urgent', {}, TARGETS[:1], priority=10)
+    assert [item['job_id'] for item in job_queue.claim('w1', 2)] == [urgent, urgent - 1]
+
+
+def test_checkpoint_and_release_keep_deferred_items(job_queue):
+    job_id = job_queue.enqueue('campaign_A', {}, TARGETS)
+    job_queue.claim('w1', 3)
+    job_queue.checkpoint(job_id, 'w1', [
+        {'idx': 1, 'status': 'sent', 'attempts': 1, 'sent_at': time.time()},
+        {'idx': 2, 'status': 'deferred', 'error_class': 'flood_wait', 'defer_until': time.time() + 60,
+         'deferred_seconds': 60},
+    ])
+    # 其他 worker 的檢查點不會覆寫 w1 持有的目標
+    job_queue.checkpoint(job_id, 'w2', [{'idx': 3, 'status': 'failed'}])
+    job_queue.release(job_id, 'w1')
+
+    progress = job_queue.progress(job_id)
+    assert (progress['sent'], progress['deferred'], progress['pending'], progress['failed']) == (1, 1, 1, 0)
+    # 延後中的目標在 defer_until 之前不會被重新認領
+    assert [item['idx'] for item in job_queue.claim('w2', 5)] == [3]
+
+
+def test_resume_after_restart(tmp_path):
+    path = str(tmp_path / 'job_queue.db')
+    queue = JobQueue(path)
+    job_id = queue.enqueue('campaign_A', {'text': 'hi'}, TARGETS)
+    queue.claim_job(job_id, 'main')
+    defer_until = time.time() + 30
+    queue.checkpoint(job_id, 'main', [
+        {'idx': 1, 'status': 'sent'},
+        {'idx': 2, 'status': 'deferred', 'defer_until': defer_until, 'deferred_seconds': 30, 'attempts': 1},
+    ])
+    queue.close()
+
+    queue = JobQueue(path)
+    try:
+        assert [job['id'] for job in queue.unfinished_jobs()] == [job_id]
+        assert queue.job_content(job_id) == {'text': 'hi'}
+        items = queue.claim_job(job_id, 'main')
+        assert [item['idx'] for item in items] == [2, 3]
+        assert items[0]['defer_until'] == pytest.approx(defer_until)
+        assert (items[0]['attempts'], items[0]['deferred_seconds']) == (1, 30)
+        assert items[1]['defer_until'] is None
+        queue.finish(job_id)
+        assert queue.unfinished_jobs() == []
+    finally:
+        queue.close()
@@ -0,0 +1,68 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from persistence import JsonWriter, atomic_write_text, load_json_file
+
+
+def test_atomic_write_text_replaces_file(tmp_path):
+    path = tmp_path / 'settings.json'
+    path.write_text('old', encoding='utf-8')
+    atomic_write_text(str(path), '{"a": 1}')
+    assert path.read_text(encoding='utf-8') == '{"a": 1}'
+    assert os.listdir(tmp_path) == ['settings.json']
+
+
+def test_corrupt_file_without_backup_is_kept(tmp_path):
+    path = tmp_path / 'settings.json'
+    path.write_text('{broken', encoding='utf-8')
+    with pytest.raises(json.JSONDecodeError):
+        load_json_file(str(path), str(tmp_path / 'backup'))
+    corrupt = [name for name in os.listdir(tmp_path) if name.startswith('settings.json.corrupt-')]
+    assert len(corrupt) == 1
+    assert (tmp_path / corrupt[0]).read_text(encoding='utf-8') == '{broken'
+
+
+def test_corrupt_file_restored_from_newest_valid_copy(tmp_path):
+    backup_dir = tmp_path / 'backup'
+    backup_dir.mkdir()
+    (backup_dir / 'settings.json.20240101_000000.bak').write_text('{"version": 1}', encoding='utf-8')
+    (backup_dir / 'settings.json.20240102_000000.bak').write_text('{"version": 2}', encoding='utf-8')
+    (backup_dir / 'settings.json.20240103_000000.bak').write_text('{also broken', encoding='utf-8')
+    path = tmp_path / 'settings.json'
+    path.write_text('{broken', encoding='utf-8')
+
+    assert load_json_file(str(path), str(backup_dir)) == {'version': 2}
+    assert json.loads(path.read_text(encoding='utf-8')) == {'version': 2}
+
+
+def test_writer_coalesces_to_latest_snapshot(tmp_path):
+    path = str(tmp_path / 'settings.json')
+    data = {'count': 0}
+
+    async def run():
+        writer = JsonWriter(delay=0.01)
+        for i in range(5):
+            data['count'] = i
+            writer.schedule(path, lambda: dict(data))
+        await writer.flush()
+        return writer
+
+    writer = asyncio.run(run())
+    assert not writer.has_pending
+    with open(path, encoding='utf-8') as f:
+        assert json.load(f) == {'count': 4}
+
+
+def test_writer_keeps_pending_snapshot_when_write_fails(tmp_path):
+    path = tmp_path / 'missing' / 'settings.json'
+    writer = JsonWriter()
+    writer.schedule(str(path), lambda: {'a': 1})
+    # 沒有事件循環時 schedule 直接同步寫入；目錄不存在，寫入失敗但修改不能遺失
+    assert writer.has_pending
+    path.parent.mkdir()
+    writer.flush_sync()
+    assert not writer.has_pending
+    assert json.loads(path.read_text(encoding='utf-8')) == {'a': 1}
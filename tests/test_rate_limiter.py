@@ -0,0 +1,65 @@
+import asyncio
+import time
+
+import pytest
+
+from rate_limiter import RateLimiter, TokenBucket
+
+
+def test_reserve_spends_burst_then_waits():
+    bucket = TokenBucket(rate=10, capacity=2)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    # 之後的預約依序排隊：第 n 個不足的令牌需等待 n / rate 秒
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+    assert bucket.reserve() == pytest.approx(0.2, abs=0.01)
+    assert not bucket.ready()
+
+
+def test_unlimited_bucket_only_honours_pause():
+    bucket = TokenBucket(rate=0)
+    assert bucket.reserve() == 0
+    bucket.pause(5)
+    assert bucket.reserve() == pytest.approx(5, abs=0.05)
+    assert not bucket.ready()
+
+
+def test_pause_delays_reservations():
+    bucket = TokenBucket(rate=10, capacity=5)
+    bucket.pause(1)
+    assert bucket.blocked_for() == pytest.approx(1, abs=0.05)
+    assert bucket.reserve() == pytest.approx(1, abs=0.05)
+
+
+def test_higher_rank_jumps_the_global_queue():
+    async def run():
+        limiter = RateLimiter(global_rate=20)
+        await limiter.acquire()  # 用掉唯一的令牌，之後的請求都要排隊
+        order = []
+
+        async def send(name, rank):
+            await limiter.acquire(rank=rank)
+            order.append(name)
+
+        bulk = [asyncio.create_task(send(f'bulk{i}', (10,))) for i in range(3)]
+        await asyncio.sleep(0)
+        urgent = asyncio.create_task(send('urgent', (-10,)))
+        await asyncio.gather(*bulk, urgent)
+        return order
+
+    order = asyncio.run(run())
+    # 第一個低優先度請求已在等待令牌，緊急請求排在下一個令牌
+    assert order.index('urgent') <= 1
+
+
+def test_peer_pause_blocks_only_that_peer():
+    async def run():
+        limiter = RateLimiter(global_rate=0, peer_rate=0)
+        limiter.pause_peer(1, 0.2)
+        assert limiter.peer_blocked_for(1) > 0
+        assert limiter.peer_blocked_for(2) == 0
+        start = time.monotonic()
+        await limiter.acquire(2)
+        return time.monotonic() - start
+
+    assert asyncio.run(run()) < 0.1
@@ -0,0 +1,34 @@
+from telethon import errors
+
+from send_errors import (ACCOUNT, FLOOD_WAIT, PEER_FLOOD_WAIT, PERMANENT, SLOW_MODE, TRANSIENT, classify_error,
+                         is_unresolved)
+
+
+def test_flood_wait_carries_seconds():
+    assert classify_error(errors.FloodWaitError(request=None, capture=30)) == (FLOOD_WAIT, 30)
+
+
+def test_slow_mode_is_not_flood_wait():
+    # SlowModeWaitError 是 FloodError 的子類，需先於 FloodWaitError 判斷
+    assert classify_error(errors.SlowModeWaitError(request=None, capture=12)) == (SLOW_MODE, 12)
+
+
+def test_peer_flood_uses_default_wait():
+    assert classify_error(errors.PeerFloodError(request=None)) == (FLOOD_WAIT, PEER_FLOOD_WAIT)
+
+
+def test_account_and_permanent_errors():
+    assert classify_error(errors.SessionRevokedError(request=None)) == (ACCOUNT, 0)
+    assert classify_error(errors.ChatWriteForbiddenError(request=None)) == (PERMANENT, 0)
+    assert classify_error(ValueError('Could not find the input entity')) == (PERMANENT, 0)
+
+
+def test_other_errors_are_transient():
+    assert classify_error(ConnectionError('reset')) == (TRANSIENT, 0)
+    assert classify_error(errors.RPCError(request=None, message='INTERNAL')) == (TRANSIENT, 0)
+
+
+def test_unresolved_errors():
+    assert is_unresolved(errors.ChannelPrivateError(request=None))
+    assert is_unresolved(ValueError('Could not find the input entity'))
+    assert not is_unresolved(errors.ChatWriteForbiddenError(request=None))
@@ -0,0 +1,38 @@
+import asyncio
+
+from send_queue import SendQueue, SendTask
+
+
+def test_delayed_tasks_come_out_after_ready_ones():
+    async def run():
+        queue = SendQueue()
+        queue.put(SendTask(1, {'id': 1}), 0.05)
+        queue.put(SendTask(2, {'id': 2}))
+        queue.put(SendTask(3, {'id': 3}))
+        order = []
+        while (task := await queue.get()) is not None:
+            order.append(task.index)
+            queue.task_done()
+        return order
+
+    assert asyncio.run(run()) == [2, 3, 1]
+
+
+def test_get_waits_for_task_put_back_while_in_flight():
+    async def run():
+        queue = SendQueue()
+        queue.put(SendTask(1, {'id': 1}))
+        task = await queue.get()
+        # 處理中的目標被放回 (例如 flood-wait)：佇列暫時是空的，get() 不能提早回傳 None
+        waiting = asyncio.ensure_future(queue.get())
+        await asyncio.sleep(0)
+        assert not waiting.done()
+        queue.put(task, 0.01)
+        queue.task_done()
+        again = await waiting
+        queue.task_done()
+        return again, await queue.get()
+
+    again, finished = asyncio.run(run())
+    assert again.index == 1
+    assert finished is None
@@ -0,0 +1,40 @@
+import pytest
+
+from simulator import FAIL_PERMANENT, SENT, TimingModel, simulate
+
+SETTINGS = dict(rate=0, burst=1, concurrency=1, max_retries=3, max_flood_wait=900, per_peer_rate=0, trials=3)
+
+
+def model(scripts, latency=0.1):
+    return TimingModel(latencies=[latency], scripts=scripts, upload_rate=None, sample_size=len(scripts), media=False)
+
+
+def test_sequential_sends():
+    report = simulate({'a': 10}, model([(0, 0, SENT)]), **SETTINGS)
+    assert report['sent'] == 10
+    assert report['failed'] == 0
+    assert report['duration_p50'] == pytest.approx(1.0)
+
+
+def test_concurrency_and_rate_limit():
+    assert simulate({'a': 10}, model([(0, 0, SENT)]), **{**SETTINGS, 'concurrency': 2})['duration_p50'] \
+        == pytest.approx(0.5)
+    # 每秒 1 個令牌：第 10 個目標在第 9 秒才取得令牌
+    limited = simulate({'a': 10}, model([(0, 0, SENT)]), **{**SETTINGS, 'concurrency': 5, 'rate': 1})
+    assert limited['duration_p50'] == pytest.approx(9.1)
+
+
+def test_flood_wait_and_retries():
+    flood = simulate({'a': 4}, model([(0, 30, SENT)]), **SETTINGS)
+    assert (flood['sent'], flood['flood_waits'], flood['flood_seconds']) == (4, 4, 120)
+    assert simulate({'a': 4}, model([(0, 30, SENT)]), **{**SETTINGS, 'max_flood_wait': 10})['failed'] == 4
+    retried = simulate({'a': 2}, model([(1, 0, SENT)]), **SETTINGS)
+    assert (retried['sent'], retried['retries'], retried['attempts']) == (2, 2, 4)
+
+
+def test_fixed_seed_is_reproducible():
+    mixed = model([(0, 0, SENT), (1, 0, SENT), (0, 20, SENT), (0, 0, FAIL_PERMANENT)], latency=0.2)
+    settings = {**SETTINGS, 'concurrency': 3, 'trials': 10}
+    first = simulate({'a': 50, 'b': 30}, mixed, seed=7, **settings)
+    assert first == simulate({'a': 50, 'b': 30}, mixed, seed=7, **settings)
+    assert first['sent'] + first['failed'] == 80
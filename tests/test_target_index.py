@@ -0,0 +1,43 @@
+import pytest
+
+from target_index import TargetIndex, normalize_tag, parse_selector
+
+GROUPS = [
+    {'id': -1001, 'title': 'A', 'tags': ['vip']},
+    {'id': -1002, 'title': 'B', 'tags': ['hk', 'test']},
+    {'id': -1003, 'title': 'C', 'tags': ['vip', 'hk']},
+    {'id': -1004, 'title': 'D'},
+]
+
+
+def test_parse_selector_terms():
+    assert parse_selector('tag:VIP, -1001, id:-1002') == ([('tag', 'vip'), ('id', -1001), ('id', -1002)], [])
+    assert parse_selector('all,!tag:test') == ([('all', None)], [('tag', 'test')])
+    assert parse_selector('!-1004') == ([], [('id', -1004)])
+
+
+@pytest.mark.parametrize('selector', ['', ' , ', 'tag:', 'tag:a b', 'group42'])
+def test_parse_selector_rejects_invalid(selector):
+    with pytest.raises(ValueError):
+        parse_selector(selector)
+
+
+def test_normalize_tag():
+    assert normalize_tag(' tag:Promo-1 ') == 'promo-1'
+
+
+def test_select_keeps_list_order():
+    index = TargetIndex(GROUPS)
+    assert [g['id'] for g in index.select('tag:hk,-1001')] == [-1001, -1002, -1003]
+    assert [g['id'] for g in index.select('all,!tag:vip')] == [-1002, -1004]
+    assert [g['id'] for g in index.select('!tag:test')] == [-1001, -1003, -1004]
+    assert index.count() == 4
+    assert index.tags() == {'hk': 2, 'test': 1, 'vip': 2}
+
+
+def test_is_stale_after_list_changes():
+    groups = list(GROUPS)
+    index = TargetIndex(groups)
+    assert not index.is_stale(groups)
+    groups.append({'id': -1005})
+    assert index.is_stale(groups)
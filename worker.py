@@ -0,0 +1,183 @@
+"""
+廣播 worker 行程 (協調者模式)。
+
+協調者 (BROADCAST_MODE=coordinator 的 main.py) 負責指令與排程，並把廣播排入 JOB_QUEUE_PATH 的工作佇列；
+每個 worker 使用自己的 Telegram session，從佇列認領目標、發送，並回寫結果供協調者產生報告與歷史記錄。
+worker 需在與協調者相同的目錄 (或可存取相同活動檔案與佇列檔案的共享目錄) 下執行。
+
+用法:
+    python worker.py --session sender2
+    python worker.py --session sender3 --batch-size 100
+"""
+import argparse
+import asyncio
+from collections import OrderedDict
+import logging
+import os
+import socket
+
+from config import Config, LoggingConfig
+from telegram_client import TelegramClientManager, SessionPool
+from entity_cache import EntityCache
+from broadcast_manager import BroadcastManager
+from job_queue import JobQueue, JobCheckpoint
+import metrics
+from logging_setup import setup_logging
+from send_errors import ACCOUNT
+
+
+class _WorkerCheckpoint(JobCheckpoint):
+    """worker 的檢查點：帳號失效造成的失敗不寫入，改為交還佇列給其他 worker。"""
+    def __init__(self, job_queue, job_id, worker, account, pool):
+        super().__init__(job_queue, job_id, worker, account)
+        self.pool = pool
+        self.released = []
+
+    def record(self, task):
+        if task.outcome is False and task.last_error == ACCOUNT and not self.pool.active_sessions():
+            self.released.append(task.index)
+            return
+        super().record(task)
+
+
+class BroadcastWorker:
+    """
+    從持久化工作佇列認領目標並發送的 worker。
+    同一個廣播工作的媒體在此 worker 中只上傳一次；發送期間定期送出心跳以延長租約。
+    """
+    HEARTBEAT_INTERVAL = 10
+    POLL_INTERVAL = 1.0
+    BATCH_SIZE = 50
+    # 同時保留發送狀態的工作數
+    MAX_CACHED_JOBS = 8
+
+    def __init__(self, config, client, job_queue: JobQueue, session_name: str, batch_size: int = None):
+        self.config = config
+        self.client = client
+        self.job_queue = job_queue
+        self.session_name = session_name
+        self.batch_size = batch_size or self.BATCH_SIZE
+        self.name = f"{socket.gethostname()}:{os.getpid()}:{session_name}"
+        self.entity_cache = EntityCache(client, path=f'entity_cache_{session_name}.json', writer=config.writer)
+        self.broadcast_manager = BroadcastManager(
+            client, config, None, self.entity_cache,
+            pool=SessionPool.from_client(client, self.entity_cache, session_name), job_queue=job_queue
+        )
+        # 最近幾個工作的發送狀態 (已上傳的媒體) 與已回報的上傳量；同優先度的工作會交錯認領，不能換工作就重建
+        self._jobs = OrderedDict()
+        self._stopping = False
+
+    async def _heartbeat_loop(self):
+        while not self._stopping:
+            try:
+                await asyncio.to_thread(self.job_queue.heartbeat, self.name)
+            except Exception as e:
+                logging.warning(f"⚠️ worker 心跳更新失敗: {e}")
+            await asyncio.sleep(self.HEARTBEAT_INTERVAL)
+
+    def _senders_for(self, job_id: int, content: dict) -> dict:
+        """同一工作的批次重用發送狀態 (媒體只上傳一次)；帳號的令牌桶由 BroadcastManager 跨工作共用。"""
+        if job_id not in self._jobs:
+            senders = self.broadcast_manager.make_senders(self.broadcast_manager.media_paths(content),
+                                                          content.get("media_info"))
+            self._jobs[job_id] = {'senders': senders, 'reported': (0, 0.0, 0)}
+            while len(self._jobs) > self.MAX_CACHED_JOBS:
+                self._jobs.popitem(last=False)
+        self._jobs.move_to_end(job_id)
+        return self._jobs[job_id]['senders']
+
+    async def _report_upload(self, job_id: int):
+        state = self._jobs.get(job_id)
+        if state is None:
+            return
+        uploaders = [s.uploader for s in state['senders'].values()]
+        totals = (sum(u.total_bytes for u in uploaders), sum(u.total_seconds for u in uploaders),
+                  sum(u.saved_bytes for u in uploaders))
+        delta = tuple(now - before for now, before in zip(totals, state['reported']))
+        if any(delta):
+            await asyncio.to_thread(self.job_queue.add_upload, job_id, *delta)
+            state['reported'] = totals
+
+    async def process_batch(self, items: list[dict]):
+        """發送一批認領到的目標 (可能來自不同工作)，結果以增量檢查點寫回佇列。"""
+        by_job = {}
+        for item in items:
+            by_job.setdefault(item['job_id'], []).append(item)
+        for job_id, job_items in by_job.items():
+            job = await asyncio.to_thread(self.job_queue.job, job_id)
+            content = await asyncio.to_thread(self.job_queue.job_content, job_id)
+            senders = self._senders_for(job_id, content)
+            tasks = self.broadcast_manager.tasks_from_claims(job_items, job['campaign'])
+            checkpoint = _WorkerCheckpoint(self.job_queue, job_id, self.name, self.session_name,
+                                           self.broadcast_manager.pool).start()
+            try:
+                await self.broadcast_manager.deliver(content, tasks, senders, job['total'], checkpoint=checkpoint)
+            finally:
+                await checkpoint.close()
+                await self._report_upload(job_id)
+            if checkpoint.released:
+                # 帳號已失效：未送出的目標交還佇列給其他 worker，此 worker 停止認領
+                await asyncio.to_thread(self.job_queue.release, job_id, self.name, checkpoint.released)
+                logging.error(f"⛔ 帳號 {self.session_name} 已失效，已交還 {len(checkpoint.released)} 個目標，worker 即將停止。",
+                              extra={'job_id': job_id, 'account': self.session_name})
+                self._stopping = True
+            sent = sum(1 for t in tasks if t.outcome)
+            logging.info(f"📦 工作 #{job_id}: 已完成 {len(tasks) - len(checkpoint.released)} 個目標 (成功 {sent})",
+                         extra={'job_id': job_id, 'campaign': job['campaign'], 'account': self.session_name})
+
+    async def run(self):
+        await asyncio.to_thread(self.job_queue.register_worker, self.name, self.session_name,
+                                os.getpid(), socket.gethostname())
+        self.entity_cache.start_background_refresh()
+        heartbeat = asyncio.create_task(self._heartbeat_loop())
+        logging.info(f"🛠️ worker {self.name} 已啟動，等待廣播工作...")
+        try:
+            while not self._stopping:
+                items = await asyncio.to_thread(self.job_queue.claim, self.name, self.batch_size)
+                if not items:
+                    await asyncio.sleep(self.POLL_INTERVAL)
+                    continue
+                try:
+                    await self.process_batch(items)
+                except Exception as e:
+                    # 未回寫的目標會在租約到期後重新分派
+                    logging.exception(f"❌ worker 處理批次時發生錯誤: {e}")
+        finally:
+            self._stopping = True
+            heartbeat.cancel()
+            await self.config.flush()
+
+    def stop(self):
+        self._stopping = True
+
+
+async def main(args):
+    listener = setup_logging(LoggingConfig(), f'worker_{args.session}.log')
+    config = Config()
+    # worker 使用自己的 session 發送，不參與 SESSION_NAMES 多帳號池
+    config.session_name = args.session
+    config.session_names = [args.session]
+    client_manager = TelegramClientManager(config)
+    await client_manager.start()
+    # 每個 worker 各自提供指標端點 (與協調者使用不同的埠)
+    await metrics.start_http_server(config.metrics_host, args.metrics_port)
+    worker = BroadcastWorker(config, client_manager.get_client(), JobQueue(args.queue or config.job_queue_path),
+                             args.session, args.batch_size)
+    try:
+        await worker.run()
+    finally:
+        logging.info("👋 worker 已停止。", extra={'account': args.session})
+        listener.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="廣播 worker：從工作佇列認領目標並發送")
+    parser.add_argument('--session', required=True, help="此 worker 使用的 Telegram session 名稱")
+    parser.add_argument('--queue', help="工作佇列檔案 (預設為 JOB_QUEUE_PATH)")
+    parser.add_argument('--batch-size', type=int, help="每次認領的目標數")
+    parser.add_argument('--metrics-port', type=int, default=0, help="此 worker 的 Prometheus 指標埠 (0 = 不啟動)")
+    args = parser.parse_args()
+    try:
+        asyncio.run(main(args))
+    except KeyboardInterrupt:
+        pass